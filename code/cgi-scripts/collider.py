@@ -49,6 +49,7 @@ sys.path.append(SRMCOLLIDER_HOME)
 import srmcollider.collider as collider
 import srmcollider.c_getnonuis as c_getnonuis
 from srmcollider.precursor import Precursor
+from srmcollider import result_cache
 from srmcollider.srmcollider_website_helper import getSRMParameter, get_ssrcalc_values
 from srmcollider.srmcollider_website_helper import unique_values, write_csv_row
 from srmcollider.srmcollider_website_helper import SRMColliderController
@@ -59,11 +60,11 @@ rounding_precision = 4
 # form_action = "/srmcollider/collider.py"
 form_action = "/srmcollider/%s" % collider_script_name
 
-db = MySQLdb.connect(read_default_file=default_mysql)
-
-controller = SRMColliderController()
-controller.initialize(db_used=db_used, default_org_prefix=default_org_prefix,
-    db_tables_map=db_tables_map)
+def create_controller():
+    controller = SRMColliderController()
+    controller.initialize(db_used=db_used, default_org_prefix=default_org_prefix,
+        db_tables_map=db_tables_map)
+    return controller
 
 def get_html_ions():
   ions = ['aions'      ,
@@ -156,8 +157,8 @@ def print_peptide_header(current_sequence, precursor, par, precursors_obj):
 
     print "</div>"
 
-def print_transition_overview(fragments, precursor, nonunique_obj):
-    ii = precursor.seq_id
+def print_transition_overview(fragments, precursor, nonunique_obj, seq_id):
+    ii = seq_id
     print "<h3>Transition Overview</h3>" 
     ## #print "<a title="Show Tables" href="javascript:toggleDisplay('col_transitions2_%s')"> " % ii
     ## #print "<h3>Transition Overview<small><small> (Click to fold)</small></small> </h3>" 
@@ -282,7 +283,7 @@ def print_transition_detail(unuseable, nonunique_obj, ii):
         print "</td></tr>"
     print "</table>"
 
-def main(par, controller):
+def main(par, controller, db, get_precursors=None):
     local_cursor = db.cursor()
 
     # create unique files and prepare a csv
@@ -305,10 +306,12 @@ def main(par, controller):
     print_header(controller.peptides)
     print shared.toggleDisplay # Javascript function to toggle a div
 
-    do_analysis(par.input_sequences, par.seqs, par, writer_uis, local_cursor, controller)
+    do_analysis(par.input_sequences, par.seqs, par, writer_uis, local_cursor, controller,
+                get_precursors)
     fuis.close()
 
-def do_analysis(input_sequences, seqs, par, wuis, local_cursor, controller):
+def do_analysis(input_sequences, seqs, par, wuis, local_cursor, controller,
+                get_precursors=None):
     """
     ###########################################################################
     # Do analysis
@@ -318,14 +321,23 @@ def do_analysis(input_sequences, seqs, par, wuis, local_cursor, controller):
     # 4. For each precursors, find the list of transitions that interfers
     # 5. For each transition, find the precursors that interfere 
     # 6. Print information
+    #
+    # The interfering precursors are selected with get_precursors(par,
+    # precursor, cursor), by default from the database.
     ###########################################################################
     """
 
     q3_low, q3_high = par.q3_range
     uis = par.uis
-    pepmap = get_ssrcalc_values(seqs, input_sequences, default_ssrcalc, local_cursor, ssrcalc_path)
+    cache = None
+    if result_cache_dir:
+        cache = result_cache.ResultCache(result_cache_dir, ttl=result_cache_ttl,
+                                         maxsize=result_cache_maxsize)
+    pepmap = get_ssrcalc_values(seqs, input_sequences, default_ssrcalc, local_cursor,
+                                ssrcalc_path, cache)
     toggle_all_str = '<script language="javascript"> function toggleAll(){ '
     mycollider = collider.SRMcollider()
+    if get_precursors is None: get_precursors = mycollider._get_all_precursors
 
     for seq_id, peptide in enumerate(controller.peptides):
         #
@@ -342,21 +354,32 @@ def do_analysis(input_sequences, seqs, par, wuis, local_cursor, controller):
         #
         precursor = Precursor(modified_sequence = peptide.get_modified_sequence(), parent_id = -1,
             q1 = peptide.charged_mass, q1_charge = 2, ssrcalc = ssrcalc, transition_group = -1)
-        precursor.seq_id = seq_id
-        precursors_obj = mycollider._get_all_precursors(par, precursor, local_cursor)
-
-        # 
-        # Step 4 and 5: Find interferences per precursor, then find
-        # interferences per transition (see the two readouts in the html)
-        #
-        collisions_per_peptide = \
-        c_getnonuis.calculate_collisions_per_peptide_other_ion_series(
-            tuple(transitions), precursors_obj, par, q3_low, q3_high,
-            par.q3_window, par.ppm, par.chargeCheck) 
 
-        nonunique = c_getnonuis._find_clashes_forall_other_series( 
-            tuple(transitions), precursors_obj, par, q3_low, q3_high,
-            par.q3_window, par.ppm, peptide.charged_mass - par.q1_window, par.chargeCheck)
+        # Steps 3 to 5 only depend on the peptide and the parameters, thus
+        # they can be answered from the cache
+        cachekey = result_cache.get_peptide_key(precursor.modified_sequence,
+            precursor.q1, ssrcalc, transitions, par)
+        cached = None
+        if cache is not None: cached = cache.get(cachekey)
+        if cached is not None:
+            precursors_obj, collisions_per_peptide, nonunique = cached
+        else:
+            precursors_obj = get_precursors(par, precursor, local_cursor)
+
+            # 
+            # Step 4 and 5: Find interferences per precursor, then find
+            # interferences per transition (see the two readouts in the html)
+            #
+            collisions_per_peptide = \
+            c_getnonuis.calculate_collisions_per_peptide_other_ion_series(
+                tuple(transitions), precursors_obj, par, q3_low, q3_high,
+                par.q3_window, par.ppm, par.chargeCheck) 
+
+            nonunique = c_getnonuis._find_clashes_forall_other_series( 
+                tuple(transitions), precursors_obj, par, q3_low, q3_high,
+                par.q3_window, par.ppm, peptide.charged_mass - par.q1_window, par.chargeCheck)
+            if cache is not None:
+                cache.put(cachekey, (precursors_obj, collisions_per_peptide, nonunique))
 
         # also add those that have no interference
         for fragment in peptide.fragments: 
@@ -368,7 +391,7 @@ def do_analysis(input_sequences, seqs, par, wuis, local_cursor, controller):
         # Step 6: printing
         #
         do_all_print(peptide, collisions_per_peptide, 
-                 wuis, precursor, par, precursors_obj, nonunique_obj)
+                 wuis, precursor, par, precursors_obj, nonunique_obj, seq_id)
         toggle_all_str += "toggleDisplay('col_peptides_%s'); toggleDisplay('col_transitions_%s');\n" % (seq_id,seq_id)
 
     toggle_all_str += "};</script>"
@@ -379,53 +402,22 @@ def do_analysis(input_sequences, seqs, par, wuis, local_cursor, controller):
     </script>"""
 
 def do_all_print(peptide, collisions_per_peptide, 
-    wuis, precursor, par, precursors_obj, nonunique_obj):
+    wuis, precursor, par, precursors_obj, nonunique_obj, seq_id):
     fragments = peptide.fragments
     uis = par.uis
     current_sequence = precursor.modified_sequence
     if uis > 0: write_csv_row(fragments, collisions_per_peptide, current_sequence, uis, wuis)
     print_peptide_header(current_sequence, precursor, par, precursors_obj ) 
-    print_transition_overview(fragments[:], precursor, nonunique_obj)
+    print_transition_overview(fragments[:], precursor, nonunique_obj, seq_id)
     print_uniqueness_analysis(collisions_per_peptide, peptide)
-    print_collding_peptides(collisions_per_peptide, precursors_obj, precursor.seq_id, fragments)
-    print_transition_detail(fragments[:], nonunique_obj, precursor.seq_id)
+    print_collding_peptides(collisions_per_peptide, precursors_obj, seq_id, fragments)
+    print_transition_detail(fragments[:], nonunique_obj, seq_id)
 
 ###########################################################################
 ###########################################################################
 # START OF HTML
 
-print 'Content-type: text/html\n\n'
-print shared.header
-print shared.warm_welcome
-print "<div class='main'>"
-
-
-sample_peptides_html = controller.get_sample_peptides_html()
-form = cgi.FieldStorage()   # FieldStorage object to
-
-if form.has_key('peptides'):
-    # Parse input and start processing with main
-    try:
-      par = controller.parse_srmcollider_form(form, genomes_that_require_N15_data)
-    except KeyError,e:
-        print "Could not parse your input %s." % cgi.escape(str(e)) 
-        print "<br/>Please check the <a href='instructions.html'>Instructions</a> and make sure the modifications you used are supported by the SRMCollider."
-        exit()
-    start = time.time()
-    main(par, controller)
-    print "<hr> <br/>This query took: %s s" % (time.time() - start)
-else:
-
-  html_ions = get_html_ions()
-  textfield_peptides = ""
-
-  # Parse Skyline input and write it into the textfield
-  if form.has_key("SkylineReport"):
-    textfield_peptides = controller.parse_skyline(
-      cgi.escape(form.getvalue("SkylineReport")) )
-
-  print shared.toggleDisplay # Javascript function to toggle a div
-  print """
+input_form_html = """
 <form action="%(form_action)s" method="post">
     <p class='input_field'>
         <label for="peptides">Please enter the peptide sequences here (see <a href="instructions.html">Instructions</a> for help):</label><br />
@@ -537,14 +529,56 @@ peptides are fully tryptic only <br/>
 To try this tool, you could use the following sample peptides:
 <br/>%(sample_peptides_html)s    
 </!-->
-""" % {'sample_peptides_html' : sample_peptides_html, 
-        'genome_select': genome_select, 
-        'ion_series' : html_ions, 
-        'form_action' : form_action, 
-        'textfield_peptides' : textfield_peptides} 
-
-print "</div>"
-print """
+"""
+
+def handle_form(form, db, controller, get_precursors=None):
+    """Print the result page for the submitted form (or the empty form).
+
+    Everything is printed to stdout, the Content-type header needs to be
+    printed before. Optionally, a function to select the interfering
+    precursors can be given, see do_analysis.
+    """
+    print shared.header
+    print shared.warm_welcome
+    print "<div class='main'>"
+
+    sample_peptides_html = controller.get_sample_peptides_html()
+
+    if form.has_key('peptides'):
+        # Parse input and start processing with main
+        try:
+          par = controller.parse_srmcollider_form(form, genomes_that_require_N15_data)
+        except KeyError,e:
+            print "Could not parse your input %s." % cgi.escape(str(e)) 
+            print "<br/>Please check the <a href='instructions.html'>Instructions</a> and make sure the modifications you used are supported by the SRMCollider."
+            exit()
+        start = time.time()
+        main(par, controller, db, get_precursors)
+        print "<hr> <br/>This query took: %s s" % (time.time() - start)
+    else:
+
+      html_ions = get_html_ions()
+      textfield_peptides = ""
+
+      # Parse Skyline input and write it into the textfield
+      if form.has_key("SkylineReport"):
+        textfield_peptides = controller.parse_skyline(
+          cgi.escape(form.getvalue("SkylineReport")) )
+
+      print shared.toggleDisplay # Javascript function to toggle a div
+      print input_form_html % {'sample_peptides_html' : sample_peptides_html, 
+            'genome_select': genome_select, 
+            'ion_series' : html_ions, 
+            'form_action' : form_action, 
+            'textfield_peptides' : textfield_peptides} 
+
+    print "</div>"
+    print """
 </div>
 </body>
 </html>"""
+
+if __name__ == '__main__':
+    print 'Content-type: text/html\n\n'
+    db = MySQLdb.connect(read_default_file=default_mysql)
+    handle_form(cgi.FieldStorage(), db, create_controller())
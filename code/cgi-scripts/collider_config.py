@@ -62,6 +62,21 @@ myUIS_CSVFile_rel_ = '/../documents/uis_srmcollider_'
 myCSVFile_rel_ = '/../documents/srmcollider_'
 collider_script_name = "collider.py"
 
+# [Result cache]
+# Directory where the results for single peptides are cached between
+# requests. Leave empty to disable the cache. Entries expire after
+# result_cache_ttl seconds, the cache is kept below result_cache_maxsize bytes.
+result_cache_dir = '/var/websites/srmcollider/cache/'
+result_cache_ttl = 7*24*3600
+result_cache_maxsize = 500*1024*1024
+
+# [Service]
+# Settings for running the web interface as a service (collider_service.py).
+# Number of database connections that are shared by the request threads.
+service_db_connections = 4
+# Load the background of all genomes at startup (using the default options).
+service_warm_backgrounds = True
+
 # [Available genomes]
 # If you want to add additional genomes, edit the genome_select HTML and the
 # map_db_tables function
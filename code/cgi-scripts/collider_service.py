@@ -0,0 +1,172 @@
+#!/usr/bin/python
+# -*- coding: utf-8  -*-
+
+"""
+ *
+ * Program       : SRMCollider
+ * Author        : Hannes Roest <roest@imsb.biol.ethz.ch>
+ * Date          : 05.02.2011 
+ *
+ *
+ * Copyright (C) 2011 - 2012 Hannes Roest
+ *
+ * This library is free software; you can redistribute it and/or
+ * modify it under the terms of the GNU Lesser General Public
+ * License as published by the Free Software Foundation; either
+ * version 2.1 of the License, or (at your option) any later version.
+ *
+ * This library is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+ * Lesser General Public License for more details.
+ *
+ * You should have received a copy of the GNU Lesser General Public
+ * License along with this library; if not, write to the Free Software
+ * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307, USA
+ *
+"""
+
+
+"""
+Runs the SRMCollider web interface as a long-running WSGI service.
+
+The CGI script (collider.py) starts a new process for every request which
+imports all modules, connects to the database and selects the background
+peptides again. The service keeps the modules loaded, shares a pool of
+database connections between requests and holds the background peptides of
+all genomes in memory. Requests are handled concurrently in threads.
+
+It serves the same form and results as collider.py, the csv files with the
+UIS under /documents/ and plain-text request metrics under /metrics.
+
+Usage:
+    python collider_service.py [--host 0.0.0.0] [--port 8080]
+
+The service can also be used with any WSGI server through the
+``application`` object (call ``application.warm()`` to load the backgrounds
+at startup).
+"""
+
+# All changes that should be done by the user are in the collider_config.py
+from collider_config import *
+
+import os, sys, time, cgi, traceback
+from SocketServer import ThreadingMixIn
+from wsgiref.simple_server import make_server, WSGIServer
+
+import MySQLdb
+
+sys.path.append(SRMCOLLIDER_HOME)
+from srmcollider import service
+from srmcollider.srmcollider_website_helper import get_query_add
+
+# The CGI script, it only handles a request when executed directly
+import collider as collider_cgi
+
+class ColliderService(object):
+    """WSGI application that handles the requests of the web interface"""
+
+    def __init__(self):
+        self.pool = service.ConnectionPool(
+            lambda: MySQLdb.connect(read_default_file=default_mysql),
+            service_db_connections)
+        self.backgrounds = service.BackgroundIndices()
+        self.metrics = service.RequestMetrics()
+        self.output = service.ThreadLocalOutput.install()
+        self.documents = os.path.dirname(myUIS_CSVFile_)
+
+    def warm(self):
+        """Load the backgrounds of all genomes for the default options"""
+        db = self.pool.get()
+        try:
+            cursor = db.cursor()
+            for genome, table in db_tables_map.iteritems():
+                start = time.time()
+                self.backgrounds.load(cursor, db_used + default_org_prefix + table,
+                                      get_query_add(False, False, 0))
+                print >> sys.stderr, "Loaded background %s in %0.2fs" % (genome, time.time() - start)
+        finally:
+            self.pool.put(db)
+
+    def __call__(self, environ, start_response):
+        start = time.time()
+        path = environ.get('PATH_INFO', '')
+        if path == '/metrics':
+            kind = 'metrics'
+            handler = self.handle_metrics
+        elif path.startswith('/documents/'):
+            kind = 'download'
+            handler = self.handle_download
+        else:
+            kind = 'form'
+            handler = self.handle_form
+        try:
+            status, headers, body = handler(environ)
+        except Exception:
+            traceback.print_exc(file=environ['wsgi.errors'])
+            status, headers, body = ('500 Internal Server Error',
+                [('Content-type', 'text/plain')], 'Internal Server Error\n')
+        if kind == 'form' and environ.get('REQUEST_METHOD') == 'POST': kind = 'analysis'
+        self.metrics.record(kind, time.time() - start, error=not status.startswith('2'))
+        headers.append( ('Content-Length', str(len(body))) )
+        start_response(status, headers)
+        return [body]
+
+    def handle_metrics(self, environ):
+        return '200 OK', [('Content-type', 'text/plain')], self.metrics.format()
+
+    def handle_download(self, environ):
+        # only serve files from the documents directory
+        name = os.path.basename(environ['PATH_INFO'])
+        filename = os.path.join(self.documents, name)
+        if not name.endswith('.csv') or not os.path.isfile(filename):
+            return '404 Not Found', [('Content-type', 'text/plain')], 'Not Found\n'
+        f = open(filename, 'rb')
+        try: body = f.read()
+        finally: f.close()
+        return '200 OK', [('Content-type', 'text/csv'),
+            ('Content-Disposition', 'attachment; filename=%s' % name)], body
+
+    def handle_form(self, environ):
+        form = cgi.FieldStorage(fp=environ['wsgi.input'], environ=environ)
+        db = self.pool.get()
+        self.output.start()
+        try:
+            try:
+                collider_cgi.handle_form(form, db, collider_cgi.create_controller(),
+                                         self.backgrounds.get_all_precursors)
+            except SystemExit:
+                # the CGI script exits after printing an error message
+                pass
+        except MySQLdb.OperationalError:
+            # the connection may be broken, do not reuse it
+            self.output.stop()
+            self.pool.discard(db)
+            raise
+        except:
+            self.output.stop()
+            self.pool.put(db)
+            raise
+        body = self.output.stop()
+        self.pool.put(db)
+        return '200 OK', [('Content-type', 'text/html')], body
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+application = ColliderService()
+
+if __name__ == '__main__':
+    from optparse import OptionParser
+    parser = OptionParser(usage="%prog [options]")
+    parser.add_option("--host", dest="host", default='0.0.0.0',
+        help="Address to listen on (default 0.0.0.0)")
+    parser.add_option("--port", dest="port", default=8080, type="int",
+        help="Port to listen on (default 8080)")
+    options, args = parser.parse_args(sys.argv[1:])
+
+    if service_warm_backgrounds: application.warm()
+    server = make_server(options.host, options.port, application,
+                         server_class=ThreadingWSGIServer)
+    print >> sys.stderr, "Serving the SRMCollider on %s:%s" % (options.host, options.port)
+    server.serve_forever()
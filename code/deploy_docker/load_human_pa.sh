@@ -11,6 +11,6 @@ grep -c ">" APD_Hs_all.fasta
 grep -v ">" APD_Hs_all.fasta > APD_Hs_peptides.fasta
 perl /home/srmcollider/ssrcalc/SSRCalc3.pl --alg 3.0 --source_file APD_Hs_peptides.fasta  --output tsv --B 1 --A 0  > APD_Hs_peptides.ssrcalc
 grep -v Z APD_Hs_peptides.ssrcalc | grep -v B > APD_Hs_peptides.fix.ssrcalc
-python create_db.py --mysql_config=/home/srmcollider/.srm.cnf --peptide_table=srmcollider.srmPeptides_human_PeptideAtlas --tsv_file=APD_Hs_peptides.fix.ssrcalc
+python create_db.py --mysql_config=/home/srmcollider/.srm.cnf --peptide_table=srmcollider.srmPeptides_human_PeptideAtlas --tsv_file=APD_Hs_peptides.fix.ssrcalc --processes=4
 
 
@@ -0,0 +1,68 @@
+#!/usr/bin/python
+# -*- coding: utf-8  -*-
+"""
+Benchmark the rangetree of rangetree.py against the compiled c_rangetree
+module (if it is available) on a random set of precursors.
+
+    python internal_test/benchmark_rangetree.py --precursors 1000000 --queries 10000
+
+The results of all trees are compared to each other.
+"""
+
+import random, sys, time
+from optparse import OptionParser
+sys.path.extend(['.', '..'])
+
+from srmcollider import rangetree
+from srmcollider.Residues import Residues
+
+parser = OptionParser()
+parser.add_option("--precursors", dest="precursors", default=1000000, type="int",
+                  help="Number of random precursors (default 1000000)")
+parser.add_option("--queries", dest="queries", default=10000, type="int",
+                  help="Number of random queries (default 10000)")
+parser.add_option("--q1_window", dest="q1_window", default=0.7, type="float")
+parser.add_option("--ssrcalc_window", dest="ssrcalc_window", default=5.0, type="float")
+parser.add_option("--isotopes_up_to", dest="isotopes_up_to", default=3, type="int")
+parser.add_option("--python", dest="python", default=False, action="store_true",
+                  help="Also benchmark the pure Python tree (slow)")
+options, args = parser.parse_args(sys.argv[1:])
+
+random.seed(1)
+tuples = tuple([ (0, 0, i, random.choice([2, 3]), random.uniform(400, 1500),
+    random.uniform(-10, 100)) for i in xrange(options.precursors)])
+correction = options.isotopes_up_to * Residues.mass_diffC13 / 2
+queries = []
+for i in xrange(options.queries):
+    t = random.choice(tuples)
+    queries.append( (t[4] - options.q1_window/2, t[5] - options.ssrcalc_window/2,
+        t[4] + options.q1_window/2, t[5] + options.ssrcalc_window/2,
+        options.isotopes_up_to, correction) )
+
+trees = [('numpy', lambda: rangetree.Rangetree_Q1_RT())]
+try:
+    from srmcollider import c_rangetree
+    trees.append( ('c_rangetree', lambda: c_rangetree.Rangetree_Q1_RT.create()) )
+except ImportError:
+    print "Module c_rangetree is not available, only benchmarking rangetree.py"
+if options.python:
+    trees.append( ('python', lambda: rangetree.Rangetree_Q1_RT(use_numpy=False)) )
+
+print "%s precursors, %s queries" % (len(tuples), len(queries))
+results = {}
+for name, factory in trees:
+    start = time.time()
+    tree = factory()
+    tree.create_tree(tuples)
+    build = time.time() - start
+    start = time.time()
+    res = [sorted(tree.query_tree(*q)) for q in queries]
+    query = time.time() - start
+    results[name] = res
+    print "%-12s build %8.3f s, query %8.3f s (%.1f us per query, %.1f hits on average)" % (
+        name, build, query, query * 1e6 / len(queries),
+        sum([len(r) for r in res]) * 1.0 / len(queries))
+
+for name, factory in trees[1:]:
+    if results[name] != results['numpy']:
+        print "Results of %s differ from the numpy tree!" % name
@@ -0,0 +1,319 @@
+#!/usr/bin/python
+# -*- coding: utf-8  -*-
+"""
+Benchmark the expensive operations of the SRMCollider on a synthetic
+background which does not need a MySQL database.
+
+A random proteome is generated from a seed, digested in silico (see
+srmcollider/digest.py) and stored in a sqlite database with the same layout
+as the tables of scripts/misc/create_db.py. Thus the same seed and sizes
+always give the same background. The retention times are a simple function
+of the hydrophobicity of the peptides (there is no SSRCalc here).
+
+    python internal_test/benchmark_suite.py --output benchmark.json
+    python internal_test/benchmark_suite.py --compare benchmark.json
+
+All implementations (see srmcollider/backends.py) that are available are
+timed, the best time of --repeat runs is reported. With --compare the results
+are compared to a previous output and the script exits with status 1 if an
+operation got slower by more than --tolerance.
+"""
+
+import json, os, platform, random, subprocess, sys, tempfile, time
+from optparse import OptionParser
+sys.path.extend(['.', '..'])
+
+from srmcollider import backends, collider, uis_functions
+from srmcollider import DDB, Residues, Precursors
+from srmcollider.SRM_parameters import SRM_parameters
+from srmcollider.digest import trypsinize
+
+# The amino acid frequencies of UniProtKB/Swiss-Prot (in percent)
+aa_frequencies = [
+    ('A', 8.25), ('R', 5.53), ('N', 4.06), ('D', 5.45), ('C', 1.37),
+    ('Q', 3.93), ('E', 6.75), ('G', 7.07), ('H', 2.27), ('I', 5.96),
+    ('L', 9.66), ('K', 5.84), ('M', 2.42), ('F', 3.86), ('P', 4.70),
+    ('S', 6.56), ('T', 5.34), ('W', 1.08), ('Y', 2.92), ('V', 6.87),
+]
+
+usage = "usage: %prog [options]"
+parser = OptionParser(usage=usage)
+parser.add_option("--proteins", dest="proteins", default=300, type="int",
+                  help="Number of random proteins (default 300)")
+parser.add_option("--seed", dest="seed", default=1, type="int",
+                  help="Seed of the random proteome (default 1)")
+parser.add_option("--queries", dest="queries", default=200, type="int",
+                  help="Number of query precursors per operation (default 200)")
+parser.add_option("--repeat", dest="repeat", default=3, type="int",
+                  help="Repeat each measurement, the best time is used (default 3)")
+parser.add_option("--sqlite_database", dest="sqlite_database", default='',
+                  help="Keep the synthetic background in this file (default: a temporary file)")
+parser.add_option("--output", dest="output", default='',
+                  help="Write the results as JSON to this file")
+parser.add_option("--compare", dest="compare", default='',
+                  help="Compare the results to this (JSON) output of a previous run")
+parser.add_option("--tolerance", dest="tolerance", default=0.25, type="float",
+                  help="Allowed slowdown in --compare mode (default 0.25 = 25%)")
+parser.add_option("--skip_run_uis", dest="skip_run_uis", default=False, action="store_true",
+                  help="Do not time run_uis.py")
+
+peptide_table = 'srmPeptides_benchmark'
+
+def random_proteome(nr_proteins, rng, min_length=50, max_length=800):
+    """Generate random protein sequences with the natural amino acid
+    frequencies"""
+    cumulative = []
+    total = 0.0
+    for aa, freq in aa_frequencies:
+        total += freq
+        cumulative.append( (total, aa) )
+    def random_aa():
+        r = rng.random() * total
+        for c, aa in cumulative:
+            if r < c: return aa
+        return cumulative[-1][1]
+    for i in range(nr_proteins):
+        length = rng.randint(min_length, max_length)
+        yield 'M' + ''.join([random_aa() for k in range(length-1)])
+
+def synthetic_ssrcalc(sequence):
+    """A retention time that increases with the hydrophobicity and the length
+    of the peptide (a deterministic stand-in for SSRCalc)"""
+    hydrophobicity = Residues.Residues.hydrophobicity
+    return round(0.5 * sum([hydrophobicity[aa] for aa in sequence]) + 1.2 * len(sequence), 2)
+
+def create_background(cursor, proteins, charges=[2,3], min_length=6,
+    mass_cutoff=5000):
+    """Digest the proteins and insert all peptides (carbamidomethylated
+    cysteines, charge 2+ and 3+) into the peptide table as create_db.py
+    does. Peptides with missed cleavages are not used by run_uis.py, thus
+    they are not generated."""
+    residues = Residues.Residues('mono')
+    cursor.execute("drop table if exists %s" % peptide_table)
+    cursor.execute("""
+    create table %(table)s(
+        parent_id INT PRIMARY KEY,
+        peptide_key INT,
+        modified_sequence VARCHAR(255),
+        q1_charge TINYINT,
+        q1 DOUBLE,
+        ssrcalc DOUBLE,
+        modifications TINYINT UNSIGNED,
+        missed_cleavages TINYINT UNSIGNED,
+        isotopically_modified TINYINT UNSIGNED,
+        transition_group INT
+    ); """ % {'table' : peptide_table})
+    done_already = {}
+    rows = []
+    transition_group = 0
+    for protein in proteins:
+        for sequence in trypsinize(protein):
+            if len(sequence) < min_length or sequence in done_already: continue
+            done_already[sequence] = 0
+            peptide = DDB.Peptide()
+            peptide.set_sequence(sequence)
+            peptide.modify_cysteins()
+            transition_group += 1
+            for mycharge in charges:
+                peptide.charge = mycharge
+                peptide.create_fragmentation_pattern(residues)
+                if peptide.charged_mass > mass_cutoff: continue
+                rows.append( (len(rows) + 1, transition_group, peptide.get_modified_sequence(),
+                    mycharge, peptide.charged_mass, synthetic_ssrcalc(sequence), 0,
+                    peptide.missed_cleavages(), 0, transition_group) )
+    cursor.executemany("insert into %s" % peptide_table + """
+        (parent_id, peptide_key, modified_sequence, q1_charge, q1, ssrcalc,
+        modifications, missed_cleavages, isotopically_modified, transition_group)
+        values (?,?,?,?,?,?,?,?,?,?)""", rows)
+    cursor.execute("create index %(table)sq1 on %(table)s (q1)" % {'table' : peptide_table})
+    return len(rows)
+
+def get_parameters(sqlite_database):
+    """The parameters of the benchmark (as for run_uis.py with --q1_window=1
+    --q3_window=1 --ssrcalc_window=10 -i 3 --max_uis 5)"""
+    par = SRM_parameters()
+    par.q1_window = 1
+    par.q3_window = 1
+    par.ssrcalc_window = 10
+    par.isotopes_up_to = 3
+    par.max_uis = 5
+    par.peptide_tables = [peptide_table]
+    par.sqlite_database = sqlite_database
+    par.set_default_vars()
+    par.q3_range = [par.q3_low, par.q3_high]
+    par.q1_window /= 2.0
+    par.q3_window /= 2.0
+    par.ssrcalc_window /= 2.0
+    par.use_sqlite = True
+    par.eval()
+    return par
+
+def measure(results, name, function, n, repeat):
+    """Time function (best of repeat runs) and store the time in results"""
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        value = function()
+        elapsed = time.time() - start
+        if best is None or elapsed < best: best = elapsed
+    results[name] = {'seconds' : best, 'n' : n, 'per_item' : best / max(n, 1)}
+    print "%-45s %10.4f s  (%s items)" % (name, best, n)
+    return value
+
+def run_benchmarks(options, sqlite_database):
+    results = {}
+    rng = random.Random(options.seed)
+
+    # The synthetic background
+    ###########################################################################
+    import sqlite3
+    conn = sqlite3.connect(sqlite_database)
+    proteins = list(random_proteome(options.proteins, rng))
+    nr_precursors = measure(results, 'create_background',
+        lambda: create_background(conn.cursor(), proteins),
+        sum([len(p) for p in proteins]), 1)
+    conn.commit()
+    par = get_parameters(sqlite_database)
+    min_q1, max_q1 = 400, 1500
+
+    myprecursors = Precursors()
+    measure(results, 'getFromDB', lambda: myprecursors.getFromDB(par, conn.cursor(),
+        min_q1 - par.q1_window, max_q1 + par.q1_window), nr_precursors, options.repeat)
+    all_precursors = myprecursors.getPrecursorsToEvaluate(min_q1, max_q1)
+    queries = rng.sample(all_precursors, min(options.queries, len(all_precursors)))
+    q3_low, q3_high = par.get_q3range_transitions()
+    isotope_correction = par.isotopes_up_to * Residues.Residues.mass_diffC13 / min(par.parent_charges)
+
+    # The rangetree
+    ###########################################################################
+    tuples = myprecursors.precursors.get_rangetree_tuples()
+    for backend in backends.available('rangetree'):
+        create = backends.load('rangetree', backend)
+        def build():
+            tree = create()
+            tree.create_tree(tuples)
+            return tree
+        tree = measure(results, 'rangetree_build/%s' % backend, build, len(tuples), options.repeat)
+        measure(results, 'rangetree_query/%s' % backend, lambda: [ tree.query_tree(
+            p.q1 - par.q1_window, p.ssrcalc - par.ssrcalc_window, p.q1 + par.q1_window,
+            p.ssrcalc + par.ssrcalc_window, par.isotopes_up_to, isotope_correction)
+            for p in queries], len(queries), options.repeat)
+    rtree = myprecursors.build_rangetree()
+    neighbours = measure(results, 'rangetree_query_batch', lambda:
+        myprecursors.query_rangetree_batch(queries, par, rtree), len(queries), options.repeat)
+
+    # The operations on single precursors
+    ###########################################################################
+    for backend in backends.available('transitions'):
+        function = backends.load('transitions', backend)
+        measure(results, 'transitions/%s' % backend, lambda: [ function(
+            ((p.q1, p.modified_sequence, p.parent_id),), [1], q3_low, q3_high)
+            for p in queries], len(queries), options.repeat)
+    transitions = [p.calculate_transitions(q3_low, q3_high) for p in queries]
+
+    for backend in backends.available('collisions_per_peptide'):
+        function = backends.load('collisions_per_peptide', backend)
+        measure(results, 'collisions_per_peptide/%s' % backend, lambda: [ function(
+            transitions[k], myprecursors.get_neighbours(neighbours, k), par, q3_low, q3_high)
+            for k in range(len(queries))], len(queries), options.repeat)
+    collisions_per_peptide = [ myprecursors.get_collisions_per_peptide_from_neighbours(
+        p, transitions[k], par, neighbours, k) for k, p in enumerate(queries)]
+
+    for backend in backends.available('nonuis'):
+        function = backends.load('nonuis', backend)
+        measure(results, 'nonuis/%s' % backend, lambda: [ [ function(c, order)
+            for order in range(1, par.max_uis+1)] for c in collisions_per_peptide],
+            len(queries), options.repeat)
+    measure(results, 'get_nonuis_list', lambda: [ uis_functions.get_nonuis_list(c,
+        par.max_uis, par) for c in collisions_per_peptide], len(queries), options.repeat)
+    measure(results, 'get_nonuis_counts', lambda: [ uis_functions.get_nonuis_counts(c,
+        par.max_uis) for c in collisions_per_peptide], len(queries), options.repeat)
+
+    ssrcalcvalues = []
+    for k, c in enumerate(collisions_per_peptide):
+        ssrcalc = dict([ (p.transition_group, p.ssrcalc) for p in
+            myprecursors.get_neighbours(neighbours, k)])
+        values = [ [] for t in transitions[k]]
+        for transition_group, v in c.iteritems():
+            for tr in v: values[tr].append(ssrcalc[transition_group])
+        ssrcalcvalues.append( [sorted(v) for v in values] )
+    for backend in backends.available('euis'):
+        function = backends.load('euis', backend)
+        measure(results, 'euis/%s' % backend, lambda: [ function([len(v) for v in values],
+            values, 1.0) for values in ssrcalcvalues], len(queries), options.repeat)
+
+    mycollider = collider.SRMcollider()
+    measure(results, 'getMinNeededTransitions', lambda: [
+        mycollider._sub_getMinNeededTransitions(par, transitions[k], c)
+        for k, c in enumerate(collisions_per_peptide)], len(queries), options.repeat)
+
+    # The whole program
+    ###########################################################################
+    if not options.skip_run_uis:
+        code_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join([code_dir, env.get('PYTHONPATH', '')])
+        command = [sys.executable, os.path.join(code_dir, 'scripts', 'runscripts', 'run_uis.py'),
+            '1', str(min_q1), str(max_q1), '--peptide_tables=%s' % peptide_table,
+            '--sqlite_database=%s' % sqlite_database, '--max_uis=5', '-i', '3',
+            '--q1_window=1', '--q3_window=1', '--ssrcalc_window=10']
+        devnull = open(os.devnull, 'w')
+        def run_uis():
+            if subprocess.call(command, env=env, stdout=devnull) != 0:
+                raise Exception("run_uis.py failed: %s" % ' '.join(command))
+        measure(results, 'run_uis', run_uis, len(all_precursors), options.repeat)
+
+    conn.close()
+    return results
+
+def compare(results, baseline, tolerance):
+    """Print the change of each operation, returns the names of all
+    operations that got slower by more than the tolerance"""
+    slower = []
+    print "\n%-45s %10s %10s %8s" % ('operation', 'baseline', 'now', 'ratio')
+    for name in sorted(results):
+        if not name in baseline: continue
+        old, new = baseline[name]['per_item'], results[name]['per_item']
+        ratio = new / old if old > 0 else 1.0
+        flag = ''
+        if ratio > 1 + tolerance:
+            slower.append(name)
+            flag = ' SLOWER'
+        elif ratio < 1 - tolerance: flag = ' faster'
+        print "%-45s %10.4g %10.4g %8.2f%s" % (name, old, new, ratio, flag)
+    return slower
+
+if __name__ == '__main__':
+    options, args = parser.parse_args(sys.argv[1:])
+    settings = dict([ (k, getattr(options, k)) for k in
+        ['proteins', 'seed', 'queries', 'repeat']])
+
+    sqlite_database = options.sqlite_database
+    if sqlite_database == '':
+        fd, sqlite_database = tempfile.mkstemp(suffix='.db', prefix='srmcollider_benchmark')
+        os.close(fd)
+    try:
+        results = run_benchmarks(options, sqlite_database)
+    finally:
+        if options.sqlite_database == '': os.remove(sqlite_database)
+
+    output = {
+        'settings' : settings,
+        'machine' : {'python' : platform.python_version(), 'platform' : platform.platform(),
+            'backends' : backends.get_backends().report()},
+        'date' : time.strftime('%Y-%m-%d %H:%M:%S'),
+        'results' : results,
+    }
+    if options.output != '':
+        f = open(options.output, 'w')
+        json.dump(output, f, indent=2, sort_keys=True)
+        f.close()
+
+    if options.compare != '':
+        baseline = json.load(open(options.compare))
+        if baseline['settings'] != settings:
+            print "Warning: the baseline was created with different settings", baseline['settings']
+        slower = compare(results, baseline['results'], options.tolerance)
+        if len(slower) > 0:
+            print "\n%s operations are slower than in the baseline: %s" % (len(slower), ', '.join(slower))
+            sys.exit(1)
@@ -0,0 +1,60 @@
+#!/usr/bin/python
+# -*- coding: utf-8  -*-
+"""
+ *
+ * Program       : SRMCollider
+ * Author        : Hannes Roest <roest@imsb.biol.ethz.ch>
+ * Date          : 05.02.2011
+ *
+ *
+ * Copyright (C) 2011 - 2012 Hannes Roest
+ *
+ * This library is free software; you can redistribute it and/or
+ * modify it under the terms of the GNU Lesser General Public
+ * License as published by the Free Software Foundation; either
+ * version 2.1 of the License, or (at your option) any later version.
+ *
+ * This library is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+ * Lesser General Public License for more details.
+ *
+ * You should have received a copy of the GNU Lesser General Public
+ * License along with this library; if not, write to the Free Software
+ * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307, USA
+ *
+"""
+
+"""
+Build a precursor index file from one or more peptide tables. The index can
+then be used with the --precursor_index option instead of the database to
+select the background precursors, e.g.
+
+python build_precursor_index.py /tmp/srmPeptides_test.idx --peptide_table=srmPeptides_test --sqlite_database=/tmp/srmcollider_testdb
+python run_uis.py 123456789 400 1500 --peptide_table=srmPeptides_test --max_uis 5 -i 3 --q1_window=1 --q3_window=1 --ssrcalc_window=10 --sqlite_database=/tmp/srmcollider_testdb --precursor_index=/tmp/srmPeptides_test.idx
+"""
+
+import sys, time
+sys.path.extend(['..', '.', '../..'])
+from srmcollider import collider
+from srmcollider import precursor_index
+
+from optparse import OptionParser
+usage = "usage: %prog outfile [options]"
+parser = OptionParser(usage=usage)
+
+par = collider.SRM_parameters()
+par.parse_cmdl_args(parser)
+options, args = parser.parse_args(sys.argv[1:])
+par.parse_options(options)
+
+if len(args) != 1:
+    parser.print_help()
+    sys.exit(1)
+
+outfile = args[0]
+db = par.get_db()
+start = time.time()
+nr_precursors = precursor_index.build_index_from_db(outfile, db.cursor(), par.peptide_tables)
+print "Wrote %s precursors from %s to %s" % (nr_precursors, ", ".join(par.peptide_tables), outfile)
+print "It took %ss" % int(time.time() - start)
@@ -47,7 +47,7 @@ import sys, csv
 sys.path.append('external/')
 sys.path.append('.')
 import MySQLdb
-from srmcollider import Residues, DDB, collider
+from srmcollider import Residues, bulk_loader
 
 print "Script is deactivated, please edit if you want to use it."
 # Since this drops tables, we done want to run it by accident.
@@ -80,6 +80,10 @@ group.add_option("--deamidate_asparagine", dest="deamidate_asparagine", default=
                   help="Deamindate asparagines")
 group.add_option("--doN15", dest="doN15", default=False, action="store_true",
                   help="Modify all proteins with heavy Nitrogen (N15).")
+group.add_option("--processes", dest="processes", default=1, type="int",
+                  help="Number of processes to calculate the precursors (default 1)")
+group.add_option("--load_data_infile", dest="load_data_infile", default=False, action="store_true",
+                  help="Load the precursors into MySQL with LOAD DATA LOCAL INFILE (needs local_infile enabled on the server)")
 parser.add_option_group(group)
 
 options, args = parser.parse_args(sys.argv[1:])
@@ -106,203 +110,54 @@ if use_sqlite:
       import sqlite
     except ImportError:
       import sqlite3 as sqlite
-    conn = sqlite.connect(sqlite_database)
-    db = conn
-    c = conn.cursor()
-    c2 = conn.cursor()
+    db = sqlite.connect(sqlite_database)
+    writer = bulk_loader.SqliteWriter(db, peptide_table)
 
 else:
-    db = MySQLdb.connect(read_default_file=options.mysql_config)
-    c = db.cursor()
-    c2 = db.cursor()
-
-## fxn
-def get_peptide_from_table(t, row):
-    peptide = DDB.Peptide()
-    peptide.set_sequence( t.row(row, 'sequence')  )
-    peptide.genome_occurence = t.row( row, 'genome_occurence' )
-    peptide.ssr_calc         = t.row( row, 'ssrcalc' )
-    #peptide.gene_id          = t.row( row, 'gene_id' )
-    peptide.mw               = t.row( row, 'molecular_weight' )
-    peptide.id               = t.row( row, 'peptide_key' )
-    peptide.pairs            = []
-    peptide.non_unique = {}
-    return peptide
-
-def insert_peptide_in_db(self, db, peptide_table, transition_group):
-    c = db.cursor()
-    isotope_modification = Residues.NOISOTOPEMODIFICATION
-    if doN15:
-        isotope_modification = Residues.N15_ISOTOPEMODIFICATION
-    #insert peptide into db
-    vals = "peptide_key, q1_charge, q1, ssrcalc, modified_sequence, modifications, missed_cleavages, isotopically_modified, transition_group"
-    q = "insert into %s (%s) VALUES (%s,%s,%s,%s,'%s', %s, %s, %s, %s)" % (
-        peptide_table,
-        vals, 
-        self.id, self.charge, 
-        self.charged_mass, self.ssr_calc, 
-        self.get_modified_sequence(),
-        self.modifications, 
-        self.missed_cleavages(),
-        isotope_modification,
-        transition_group
-    )
-    if len( self.get_modified_sequence() ) > 255:
-        print "skip ", self.get_modified_sequence(), " due to length constraints"
-        return
-    c.execute(q)
-    if use_sqlite:
-        self.parent_id = c.lastrowid
+    if options.load_data_infile:
+        db = MySQLdb.connect(read_default_file=options.mysql_config, local_infile=1)
     else:
-        self.parent_id = db.insert_id()
-
-def get_all_modifications(this_sequence, to_modify, replace_with, max_nr_modifications):
-    import re
-    positions = [m.start() for m in re.finditer(to_modify, this_sequence)]
-    for i in range(1,min(max_nr_modifications,1+len(positions))):
-        to_replace = list(collider.combinations( positions, i))
-        for new_peptide in to_replace:
-            it = 0
-            curr_seq = ''
-            for pos in new_peptide:
-                curr_seq += this_sequence[it:pos] + replace_with
-                it = pos+1
-            curr_seq += this_sequence[it:]
-            pep = DDB.Peptide()
-            pep.set_sequence(curr_seq)
-            pep.modifications = i
-            yield pep
-
-def get_all_modified_peptides(peptide, oxidize_methionines, deamidate_asparagine, max_nr_modifications):
-    modified = []
-    if oxidize_methionines: 
-        modified = list(get_all_modifications(peptide.get_modified_sequence(), 'M', 'M[147]', max_nr_modifications))
-    ##for pep in modified:
-    ##    print pep.get_modified_sequence()
-    #continue
-    if deamidate_asparagine:
-        toappend = []
-        for pep in modified:
-            tmp_modified = get_all_modifications(pep.get_modified_sequence(), 'N', 'N[115]', max_nr_modifications)
-            for pep_new in tmp_modified:
-                pep_new.modifications += pep.modifications
-                toappend.append(pep_new)
-        modified.extend(toappend)
-        modified.extend( list(get_all_modifications(peptide.get_modified_sequence(), 'N', 'N[115]', max_nr_modifications) ) )
-    return modified
-
-
+        db = MySQLdb.connect(read_default_file=options.mysql_config)
+    writer = bulk_loader.MySQLWriter(db, peptide_table, options.load_data_infile)
+    if dotransitions: db.cursor().execute('truncate table ' + transition_table)
 
-residues = Residues.Residues('mono')
+isotope_modification = Residues.NOISOTOPEMODIFICATION
 if doN15:
-    residues.recalculate_monisotopic_data_for_N15()
+    isotope_modification = Residues.N15_ISOTOPEMODIFICATION
 
-###################################
-# A) store the transitions
-###################################
-
-# where to store the peptides (in MySQL or sqlite)
-if use_sqlite:
-    try:
-        c.execute( " drop table %(table)s;" % { 'table' : peptide_table} )
-    except Exception:
-        pass
-
-    c.executescript(
-    """
-    create table %(table)s(
-        parent_id INT PRIMARY KEY,
-        peptide_key INT,
-        modified_sequence VARCHAR(255),
-        q1_charge TINYINT,
-        q1 DOUBLE,
-        ssrcalc DOUBLE,
-        modifications TINYINT UNSIGNED,
-        missed_cleavages TINYINT UNSIGNED,
-        isotopically_modified TINYINT UNSIGNED,
-        transition_group INT
-    );
-    create index %(table)spepkey   on %(table)s (peptide_key);
-    create index %(table)sq1       on %(table)s (q1);
-    create index %(table)sssrcalc  on %(table)s (ssrcalc);
-    create index %(table)strgroup  on %(table)s (transition_group);
-        """ % {'table' : peptide_table}
-    )
-
-else:
-    c.execute( " drop table if exists %(table)s;" % { 'table' : peptide_table} )
-    c.execute( """
-    create table %(table)s(
-        parent_id INT PRIMARY KEY AUTO_INCREMENT,
-        peptide_key INT,
-        modified_sequence VARCHAR(255),
-        q1_charge TINYINT,
-        q1 DOUBLE,
-        ssrcalc DOUBLE,
-        modifications TINYINT UNSIGNED,
-        missed_cleavages TINYINT UNSIGNED,
-        isotopically_modified TINYINT UNSIGNED,
-        transition_group INT
-    );
-    """ % { 'table' : peptide_table} )
-    c.execute("alter table %(table)s add index(peptide_key);" % { 'table' : peptide_table} )
-    c.execute("alter table %(table)s add index(q1);" % { 'table' : peptide_table} )
-    c.execute("alter table %(table)s add index(ssrcalc);" % { 'table' : peptide_table} )
-    c.execute("alter table %(table)s add index(transition_group);" % { 'table' : peptide_table} )
-    #c.execute('truncate table ' + peptide_table)
-    if dotransitions: c.execute('truncate table ' + transition_table)
-
-transition_group = 0
 # which modifications:
 ## methionine oxidation
 ## de-amidation
 ## phospho? no
 ## N-terminal acetylation ?
 ## methylation
-charges = [2,3]  #precursor charge 2 and 3
+loader_options = bulk_loader.LoaderOptions(
+    charges = [2,3],  #precursor charge 2 and 3
+    mass_cutoff = mass_cutoff,
+    modify_cysteins = modify_cysteins,
+    oxidize_methionines = oxidize_methionines,
+    deamidate_asparagine = deamidate_asparagine,
+    max_nr_modifications = max_nr_modifications,
+    isotope_modification = isotope_modification)
+
+def read_tsv(tsv_file):
+    """Yield (peptide_key, sequence, ssrcalc) from the SSRCalc output"""
+    f = open(tsv_file)
+    reader = csv.reader(f, delimiter='\t')
+    for id, line in enumerate(reader):
+        if len(line[0]) < 2: continue
+        if line[0].startswith("<tr class="): continue
+        yield id, line[0], float(line[2])
+    f.close()
 
-f = open(tsv_file)
-reader = csv.reader(f, delimiter='\t')
-for id, line in enumerate(reader):
-    if len(line[0]) < 2: continue
-    if line[0].startswith("<tr class="): continue
-    peptide = DDB.Peptide()
-    peptide.set_sequence( line[0] )
-    peptide.ssr_calc = line[2] 
-    peptide.id = id
-
-    transition_group += 1 
-    if modify_cysteins: peptide.modify_cysteins()
-    #print transition_group, peptide.sequence
-    for mycharge in charges:
-        peptide.charge = mycharge
-        # calculate charged mass and insert peptide into db
-        peptide.create_fragmentation_pattern(residues)
-        if peptide.charged_mass > mass_cutoff: continue
-        peptide.modifications = 0
-        insert_peptide_in_db(peptide, db, peptide_table,
-                                      transition_group=transition_group)
-    #
-    # some heuristics to make the whole thing faster, if already the charged
-    # mass if twice as high as the cutoff, even with modifications we will
-    # never get into the allowed mass range.
-    if peptide.charged_mass / 2.0 > mass_cutoff: continue
-    #
-    modified = get_all_modified_peptides(peptide, oxidize_methionines, deamidate_asparagine, max_nr_modifications) 
-    for mod_peptide in modified:
-        if mod_peptide.modifications > max_nr_modifications: continue
-        transition_group += 1 
-        for mycharge in charges: 
-            mod_peptide.ssr_calc = peptide.ssr_calc
-            mod_peptide.id = peptide.id
-            mod_peptide.charge = mycharge
-            # calculate charged mass and insert peptide into db
-            mod_peptide.create_fragmentation_pattern(residues)
-            if mod_peptide.charged_mass > mass_cutoff: continue
-            insert_peptide_in_db(mod_peptide, db, peptide_table,
-                                          transition_group=transition_group)
-    del modified
-    del peptide
-
-db.commit()
+###################################
+# A) store the transitions
+###################################
 
+# The precursors are calculated on options.processes processes, the
+# transition groups and parent ids are assigned here in the order of the
+# input file and the secondary indices are created after the load.
+nr_rows, nr_skipped = bulk_loader.load_peptides(read_tsv(tsv_file), writer,
+    loader_options, processes=options.processes)
+print "Skipped %s precursors with sequences longer than 255 characters" % nr_skipped
+print "Loaded %s precursors into %s" % (nr_rows, peptide_table)
@@ -9,8 +9,8 @@
 import srmcollider_website_helper
 import DDB, collider, sys
 
-from Residues import Residues
-R = Residues('mono')
+from Residues import get_residues
+R = get_residues('mono')
 peptideparser = srmcollider_website_helper.PeptideParser(R)
 
 ###########################################################################
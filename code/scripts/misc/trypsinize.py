@@ -22,49 +22,98 @@ SWDLVK
 """
 from optparse import OptionParser, OptionGroup
 import sys; sys.path.extend(['..', '.'])
-from Bio import SeqIO
+from srmcollider import digest
 
-usage = 'A script to read a fasta file and output trypsinized peptides, one per line\n'
+usage = 'A script to read a fasta file and output digested peptides, one per line\n'
 usage += "usage: %prog fasta_file outputfile missed_cleavages min_len\nAfterwards run SSRcalc:\n" 
-usage += "perl SSRCalc3.pl --alg 3.0 --source_file peptide_file  --output tsv --B 1 --A 0  > ssrcalc.out"
+usage += "perl SSRCalc3.pl --alg 3.0 --source_file peptide_file  --output tsv --B 1 --A 0  > ssrcalc.out\n"
+usage += "or use --peptide_table to load the peptides directly (with GRAVY scores instead of SSRCalc)"
 parser = OptionParser(usage=usage)
+group = OptionGroup(parser, "Digestion Options", "") 
+group.add_option("--enzyme", dest="enzyme", default='trypsin', type="choice",
+                  choices=sorted(digest.ENZYMES.keys()),
+                  help="Enzyme to digest with: %s (default trypsin)" % ", ".join(sorted(digest.ENZYMES.keys())) )
+group.add_option("--semi", dest="semi", default=False, action="store_true",
+                  help="Also create the semi-specific peptides")
+group.add_option("--processes", dest="processes", default=1, type="int",
+                  help="Number of processes to digest the proteins (default 1)")
+group.add_option("--shards", dest="shards", default=64, type="int",
+                  help="Number of shard files to remove the duplicate peptides, " +
+                  "the memory use is about 1/shards of the unique peptides (default 64)")
+group.add_option("--tmpdir", dest="tmpdir", default=None,
+                  help="Directory for the shard files (default: system temporary directory)")
+parser.add_option_group(group)
+group = OptionGroup(parser, "Direct load Options",
+                    "Load the peptides into a peptide table (see create_db.py) instead of " + 
+                    "writing them into the outputfile ('-' to write no file)") 
+group.add_option("--peptide_table", dest="peptide_table", default='',
+                  help="Table to load the peptides into" )
+group.add_option("--sqlite_database", dest="sqlite_database", default='',
+                  help="Use specified sqlite database instead of MySQL database" )
+group.add_option("--mysql_config", dest="mysql_config", default='~/.my.cnf',
+                  help="Location of mysql config (.my.cnf) file" )
+group.add_option("--mass_cutoff", dest="mass_cutoff", default=5000, type="int",
+                  help="M/Z cutoff above which precursors will not be included in the database (default 5000)" )
+parser.add_option_group(group)
 options, args = parser.parse_args(sys.argv[1:])
 
-fasta_file = sys.argv[1]
-outfile = sys.argv[2]
+fasta_file = args[0]
+outfile = args[1]
 missed = 0
 min_len = 0
-if(len(sys.argv)>3):
-    missed = int(sys.argv[3])
+if(len(args)>2):
+    missed = int(args[2])
 
-if(len(sys.argv)>4):
-    min_len = int(sys.argv[4])
+if(len(args)>3):
+    min_len = int(args[3])
 
-records = list(SeqIO.parse(open(fasta_file,"r"), "fasta"))
+# The proteins are read and digested as a stream and the duplicates are
+# removed on disk, thus the whole proteome is never held in memory.
+sequences = (sequence for header, sequence in digest.read_fasta(open(fasta_file)))
+peptides = digest.unique(digest.digest_proteins(sequences, options.enzyme, missed,
+    options.semi, min_len, options.processes), options.shards, options.tmpdir)
 
-def trypsinize(sequence, missed=0):
-    import re
-    protein = re.sub(r'(?<=[RK])(?=[^P])',' ', sequence)
-    protein = protein.split()
-    for i,peptide in enumerate(protein):
-      yield peptide 
-      # do missed cleavages
-      current = peptide
-      k = 1
-      while(i+k<len(protein) and k<=missed):
-          current = current + protein[i+k]
-          yield current
-          k+=1
-
-done_already = {}
-f = open(outfile, 'w')
-for r in records:
-    peptides = trypsinize(r.seq.tostring(), missed)
+if options.peptide_table == '':
+    f = open(outfile, 'w')
     for p in peptides: 
-        if not done_already.has_key(p) and len(p) >= min_len:
-            f.write('%s\n' % p); done_already[p] = 0
+        f.write('%s\n' % p)
+    f.close()
+    sys.exit()
+
+from srmcollider import DDB, Residues, bulk_loader
+
+def get_peptides_to_load(peptides):
+    """Yield (peptide_key, sequence, GRAVY) for the loader and write the
+    peptides into the outputfile"""
+    f = None
+    if outfile != '-': f = open(outfile, 'w')
+    skipped = 0
+    for key, p in enumerate(peptides):
+        if f is not None: f.write('%s\n' % p)
+        if len(p) < 2 or not all([aa in Residues.Residues.Hydropathy_aa for aa in p]):
+            # ambiguous residues (B, Z, X, ...) have no mass
+            skipped += 1
+            continue
+        peptide = DDB.Peptide()
+        peptide.set_sequence(p)
+        yield key, p, peptide.get_GRAVY()
+    if f is not None: f.close()
+    print "Skipped %s peptides with unknown residues" % skipped
+
+if options.sqlite_database != '':
+    import sqlite3
+    db = sqlite3.connect(options.sqlite_database)
+    writer = bulk_loader.SqliteWriter(db, options.peptide_table)
+else:
+    import MySQLdb
+    db = MySQLdb.connect(read_default_file=options.mysql_config)
+    writer = bulk_loader.MySQLWriter(db, options.peptide_table)
 
-f.close()
+loader_options = bulk_loader.LoaderOptions(mass_cutoff=options.mass_cutoff)
+nr_rows, nr_skipped = bulk_loader.load_peptides(get_peptides_to_load(peptides), writer,
+    loader_options, processes=options.processes)
+print "Skipped %s precursors with sequences longer than 255 characters" % nr_skipped
+print "Loaded %s precursors into %s" % (nr_rows, options.peptide_table)
 
 """
 mysql -s -e "select protein.id,sequence from ddbMeta.sequence inner join \
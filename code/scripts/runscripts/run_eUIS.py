@@ -40,9 +40,7 @@ Average without strike 3 0.037328245859
 import time
 import sys 
 
-from srmcollider import c_rangetree, c_getnonuis
-from srmcollider import collider, progress
-from srmcollider.collider import thisthirdstrike
+from srmcollider import collider, progress, uis_functions, parallel, profiling
 from srmcollider import Precursors
 
 from optparse import OptionParser, OptionGroup
@@ -60,6 +58,11 @@ group.add_option("--allow_contamination", dest="allow_contamination", default=3,
                   help="Number of locally contaminated transitions to be allowed" )
 group.add_option("--GRAVY", action="store_true", dest="GRAVY", default=False,
                   help="Use GRAVY scores instead of SSRCalc values.")
+group.add_option("--processes", dest="processes", default=1, type="int",
+                  help="Number of processes to use (default 1)")
+group.add_option("--local_ssrcalc_window", dest="local_ssrcalc_window", default=None, type='float',
+                  help="Window in SSRCalc units for strike 2 (locally clean), " + 
+                  "strike 2 is skipped if it is not given.")
 parser.add_option_group(group)
 
 # Run the collider
@@ -84,18 +87,16 @@ myorder =options.myorder
 contamination_allow =options.allow_contamination
 par.eval()
 print par.get_common_filename()
-
-skip_strike2 = True
+implementations = par.get_backends()
+print implementations.report()
 
 # Get the precursors
 ###########################################################################
 myprecursors = Precursors()
-myprecursors.getFromDB(par, db.cursor(), min_q1 - par.q1_window, max_q1 + par.q1_window)
-if options.GRAVY: myprecursors.use_GRAVY_scores()
-rtree = myprecursors.build_rangetree()
+# also builds the rangetree and the lookups (or loads them from the cache)
+rtree = myprecursors.getFromDB_with_rangetree(par, db.cursor(), 
+    min_q1 - par.q1_window, max_q1 + par.q1_window, GRAVY=options.GRAVY)
 precursors_to_evaluate = myprecursors.getPrecursorsToEvaluate(min_q1, max_q1)
-myprecursors.build_parent_id_lookup()
-myprecursors.build_transition_group_lookup()
 
 print "Want to evaluate precursors", len(precursors_to_evaluate)
 
@@ -111,107 +112,57 @@ This is a 3 strikes rule to find good UIS combinations.
 
 print par.experiment_type
 progressm = progress.ProgressMeter(total=len(precursors_to_evaluate), unit='peptides')
-prepare  = []
-at_least_one = 0
 f = open(outfile, 'a')
 kk = len(precursors_to_evaluate) -1
-for precursor in precursors_to_evaluate:
+# the interfering precursors of all precursors, in one query
+neighbours = myprecursors.query_rangetree_batch(precursors_to_evaluate, par, rtree)
+
+def evaluate_precursors(start, end):
+  """Evaluate the precursors start to end, returns for each precursor the
+  row for prepare (or None) and whether at least one eUIS is left"""
+  result = []
+  for k in range(start, end):
+    precursor = precursors_to_evaluate[k]
     q3_low, q3_high = par.get_q3range_transitions()
     transitions = precursor.calculate_transitions(q3_low, q3_high)
     nr_transitions = len(transitions)
 
-    ###############################################################
-    #strike 1: it has to be global UIS
-
-    computed_collisions = myprecursors.get_collisions_per_peptide_from_rangetree(
-        precursor, precursor.q1 - par.q1_window, precursor.q1 + par.q1_window, 
-        transitions, par, rtree)
-
-    collisions_per_peptide = computed_collisions 
+    # The fragments of all interfering precursors are matched once, then
+    #   strike 1: it has to be global UIS
+    #   strike 2: it has to be locally clean (only with --local_ssrcalc_window)
+    #   strike 3: the transitions in the tuple shall not coelute elsewhere
+    # are derived from these interferences, see get_three_strike_nonuis.
+    strike1, strike2, strike3 = uis_functions.get_three_strike_nonuis(precursor,
+        transitions, myprecursors.get_neighbours(neighbours, k), par, myorder,
+        strike3_ssrcalcwindow, options.local_ssrcalc_window, contamination_allow)
 
-    # see SRMCollider::Combinatorics::get_non_uis
-    non_useable_combinations = c_getnonuis.get_non_uis( collisions_per_peptide, myorder)
-    srm_ids = [t[1] for t in transitions]
     tuples_strike1 = 0
     if not nr_transitions < myorder:
-      tuples_strike1 = collider.choose(nr_transitions, myorder ) - len(non_useable_combinations)
-
-    ###############################################################
-    #strike 2: it has to be locally clean
-    if not skip_strike2:
-      ssrcalc_low = ssrcalc - par.ssrcalc_window + 0.001
-      ssrcalc_high = ssrcalc + par.ssrcalc_window - 0.001
-      precursor_ids = tuple(c_rangetree.query_tree( q1_low, ssrcalc_low, 
-                                                   q1_high,  ssrcalc_high )  )
-      precursors = tuple([parentid_lookup[myid[0]] for myid in precursor_ids
-                          #dont select myself 
-                         if parentid_lookup[myid[0]][2]  != pep['transition_group']])
-
-      # collisions_per_peptide: dictionary, for each key the set of interfering transitions is stored
-      collisions_per_peptide = c_getnonuis.calculate_collisions_per_peptide_other_ion_series( 
-          transitions, precursors, par, q3_low, q3_high, par.q3_window, par.ppm, forceChargeCheck)
-      local_interferences = [t[0] for t in c_getnonuis.get_non_uis( collisions_per_peptide, 1).keys()]
-      tuples_2strike = []
-      for mytuple in tuples_strike1:
-          contaminated = 0.0
-          for dirty_t in local_interferences:
-              if dirty_t in mytuple: contaminated += 1.0
-          if contaminated <= contamination_allow: tuples_2strike.append(mytuple)
-
-    ###############################################################
-    #strike 3: the transitions in the tuple shall not coelute elsewhere
-    # Strike 3 takes usually over 90 % of the time
-    # 1. For each tuple that we found, find all peptides that collide with
-    #    each single transition and store their SSRCalc values. For a tuple of
-    #    n transitions, we get n vectors with a number of SSRCalc values.
-    # 2. Check whether there exists one retention time (SSRcalc value) that is
-    #    present in all vectors.
-
-    # ssrcalcvalues is a list of lists where the outer list has nr_tr elements.
-    # Thus, for each transition we have a list of RT values where an a peptide
-    # with an interfering transition will elute. 
-
-    # complexity: nr_tr * k 
-    # we get the list of ssrcalc-values for each transition 
-    ssrcalcvalues = [ [] for t in transitions]
-    for k,v in collisions_per_peptide.iteritems():
-        #ssrcalc = trgroup_lookup[k]
-        ssrcalc = myprecursors.lookup_by_transition_group(k).ssrcalc
-        for tr in v:
-            ssrcalcvalues[tr].append(ssrcalc)
-
-    # then sort the ssrcalc values 
-    # complexity: nr_tr * k * log(k) 
-    for i in range(len(ssrcalcvalues)):
-        ssrcalcvalues[i] = sorted(ssrcalcvalues[i])
-
-    # get the list of combinations that are not eUIS
-    N = [len(v) for v in ssrcalcvalues]
-    cont_comb_list = c_getnonuis.calculate_eUIS(N, ssrcalcvalues, strike3_ssrcalcwindow)
-    
-    if False:
-        #compare c++/python code
-        compare = thisthirdstrike(N, ssrcalcvalues, strike3_ssrcalcwindow)
-        cont3 = {}
-        for c in cont_comb_list:
-            cont3[ tuple(c)] = 0
-        assert compare == cont3
-
-    # the list of combinations has to be expanded for a specific order (e.g.
-    # for order 2, a combination of (1,2,3) has to be expanded into
-    # (1,2),(1,3),(2,3) to get all subcombinations.
-    newdic = dict([(i,list(v)) for i,v in enumerate(cont_comb_list)])
-    non_useable_combinations.update(c_getnonuis.get_non_uis( newdic, myorder))
+      tuples_strike1 = collider.choose(nr_transitions, myorder ) - len(strike1)
+    non_useable_combinations = strike1 | strike2 | strike3
 
     tuples_strike3 = 0
+    row = None
     if not nr_transitions < myorder:
       # We are mostly interested in how many tuples are left after strike 3
       tuples_strike3 = collider.choose(nr_transitions, myorder ) - len(non_useable_combinations)
-      prepare.append( [ tuples_strike3, collider.choose(nr_transitions, 
-        min(myorder, nr_transitions)), tuples_strike1-tuples_strike3 ] )
+      row = [ tuples_strike3, collider.choose(nr_transitions, 
+        min(myorder, nr_transitions)), tuples_strike1-tuples_strike3 ]
     # If we have at least one tuple left
-    if tuples_strike3 > 0: at_least_one += 1
+    result.append( (row, tuples_strike3 > 0) )
     progressm.update(1)
+  return result
+
+# The workers are forked after the background and the rangetree are built and
+# the results of the chunks are concatenated in order, thus the output is
+# identical to a serial run.
+prepare  = []
+at_least_one = 0
+for chunk in parallel.map_ranges(evaluate_precursors, 
+      len(precursors_to_evaluate), options.processes, progressm=progressm):
+    for row, has_euis in chunk:
+      if row is not None: prepare.append(row)
+      if has_euis: at_least_one += 1
 
 print "Analysed:", kk + 1
 print "At least one eUIS of order %s :" % myorder, at_least_one, " which is %s %%" % (at_least_one *100.0/(kk+1))
@@ -226,5 +177,7 @@ print  "Average lost in strike 3", sum_all*1.0/nr_peptides
 sum_all = sum([(p[0]+p[2])*1.0/p[1] for p in prepare]) 
 print  "Average without strike 3", 1-sum_all*1.0/nr_peptides
 
+profiling.finish(par)
+
 
 
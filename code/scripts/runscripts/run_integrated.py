@@ -44,13 +44,15 @@ Order 3, Average non useable UIS 0.000427182046582
 Order 4, Average non useable UIS 4.72421355715e-05
 Order 5, Average non useable UIS 3.86353977514e-06
 
+Use --processes N to distribute the peptides over N processes, the results are
+identical to the ones of a run with a single process.
 """
 
 import sys 
 from copy import copy
 from optparse import OptionParser, OptionGroup
 
-from srmcollider import c_integrated, collider, progress
+from srmcollider import c_integrated, collider, progress, parallel, profiling
 from srmcollider import Precursors
 
 usage = "usage: %prog experiment_key startQ1 endQ1 [options]"
@@ -60,6 +62,8 @@ group.add_option("--insert",
                   action="store_true", dest="insert_mysql", default=False,
                   help="Insert into mysql experiments table")
 group.add_option("--query_peptide_table", type="str", help="Peptide table to get query peptides from")
+group.add_option("--processes", dest="processes", default=1, type="int",
+                  help="Number of processes to use (default 1)")
 parser.add_option_group(group)
 
 # Run the collider
@@ -88,36 +92,49 @@ if par.max_uis ==0:
     print "Please change --max_uis option, 0 does not make sense here"
     sys.exit()
 
+# c_integrated only accepts the extended rangetree of c_rangetree
+if par.get_backends().name('rangetree') != 'cpp':
+    print "run_integrated.py needs the cpp backend (c_rangetree), please use --backend cpp"
+    sys.exit()
+
 # Get the precursors
 ###########################################################################
 myprecursors = Precursors()
-myprecursors.getFromDB(par, db.cursor(), min_q1 - par.q1_window, max_q1 + par.q1_window)
+# also builds the rangetree and the lookups (or loads them from the cache)
+r_tree = myprecursors.getFromDB_with_rangetree(par, db.cursor(), 
+    min_q1 - par.q1_window, max_q1 + par.q1_window, extended=True)
 if not options.query_peptide_table is None and not options.query_peptide_table == "":
   print "Using a different table for the query peptides than for the background peptides!"
   print "Will use table %s " % options.query_peptide_table
   query_precursors = Precursors()
   query_par = copy(par)
   query_par.peptide_tables = [options.query_peptide_table]
+  query_par.precursor_index = '' # the index only contains the background
   query_precursors.getFromDB(query_par, db.cursor(), min_q1 - par.q1_window, max_q1 + par.q1_window)
   precursors_to_evaluate = query_precursors.getPrecursorsToEvaluate(min_q1, max_q1)
 else:
   precursors_to_evaluate = myprecursors.getPrecursorsToEvaluate(min_q1, max_q1)
 isotope_correction = par.calculate_isotope_correction()
-r_tree = myprecursors.build_extended_rangetree ()
 
 print "Will evaluate %s precursors" % len(precursors_to_evaluate)
 progressm = progress.ProgressMeter(total=len(precursors_to_evaluate), unit='peptides')
-prepare  = []
-for precursor in precursors_to_evaluate:
+
+def evaluate_precursors(start, end):
+  """Evaluate the precursors start to end, returns the number of non-UIS per
+  order for each precursor"""
+  prepare  = []
+  for precursor in precursors_to_evaluate[start:end]:
     transitions = precursor.calculate_transitions_from_param(par)
     #correct rounding errors, s.t. we get the same results as before!
     ssrcalc_low = precursor.ssrcalc - par.ssrcalc_window + 0.001
     ssrcalc_high = precursor.ssrcalc + par.ssrcalc_window - 0.001
     try:
-        result = c_integrated.wrap_all_bitwise(transitions,
-            precursor.q1 - par.q1_window, ssrcalc_low, precursor.q1 + par.q1_window,  ssrcalc_high,
-            precursor.transition_group, min(par.max_uis,len(transitions)), par.q3_window, par.ppm,
-            par.isotopes_up_to, isotope_correction, par, r_tree)
+        # rangetree query, collisions and non-UIS in one C++ call
+        with profiling.timer('integrated'):
+            result = c_integrated.wrap_all_bitwise(transitions,
+                precursor.q1 - par.q1_window, ssrcalc_low, precursor.q1 + par.q1_window,  ssrcalc_high,
+                precursor.transition_group, min(par.max_uis,len(transitions)), par.q3_window, par.ppm,
+                par.isotopes_up_to, isotope_correction, par, r_tree)
     except ValueError:
         print "Too many transitions for %s", precursor
         continue
@@ -127,6 +144,15 @@ for precursor in precursors_to_evaluate:
             order), precursor.parent_id , order, exp_key)  )
     #//break;
     progressm.update(1)
+  return prepare
+
+# The workers are forked after the background and the rangetree are built and
+# the results of the chunks are concatenated in order, thus the output is
+# identical to a serial run.
+prepare  = []
+for chunk_prepare in parallel.map_ranges(evaluate_precursors, 
+      len(precursors_to_evaluate), options.processes, progressm=progressm):
+    prepare.extend(chunk_prepare)
 
 for order in range(1,6):
     sum_all = sum([p[0]*1.0/p[1] for p in prepare if p[3] == order]) 
@@ -143,6 +169,7 @@ for order in range(1,6):
         db.rollback()
 # disconnect from server
 db.close()
+profiling.finish(par)
 """
 
 create table srmcollider.result_completegraph_aggr (
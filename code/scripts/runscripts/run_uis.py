@@ -53,11 +53,13 @@ Order 3, Average non useable UIS 0.00329392829393
 Order 4, Average non useable UIS 0.0002035002035
 Order 5, Average non useable UIS 0.0
 
+Use --processes N to distribute the peptides over N processes, the results are
+identical to the ones of a run with a single process.
 """
 
 import sys 
 from copy import copy
-from srmcollider import collider, progress
+from srmcollider import collider, progress, parallel, profiling
 from srmcollider import Precursors
 
 # count the number of interfering peptides
@@ -77,6 +79,8 @@ group.add_option("--insert",
                   action="store_true", dest="insert_mysql", default=False,
                   help="Insert into mysql experiments table")
 group.add_option("--query_peptide_table", type="str", help="Peptide table to get query peptides from")
+group.add_option("--processes", dest="processes", default=1, type="int",
+                  help="Number of processes to use (default 1)")
 parser.add_option_group(group)
 
 # Run the collider
@@ -120,30 +124,32 @@ if options.insert_mysql:
 # Get the precursors
 ###########################################################################
 myprecursors = Precursors()
-myprecursors.getFromDB(par, db.cursor(), min_q1 - par.q1_window, max_q1 + par.q1_window)
+if use_db or swath_mode:
+  myprecursors.getFromDB(par, db.cursor(), min_q1 - par.q1_window, max_q1 + par.q1_window)
+  myprecursors.build_parent_id_lookup()
+  myprecursors.build_transition_group_lookup()
+else:
+  # also builds the rangetree and the lookups (or loads them from the cache)
+  rtree = myprecursors.getFromDB_with_rangetree(par, db.cursor(), 
+      min_q1 - par.q1_window, max_q1 + par.q1_window)
 if not options.query_peptide_table is None and not options.query_peptide_table == "":
   print "Using a different table for the query peptides than for the background peptides!"
   print "Will use table %s " % options.query_peptide_table
   query_precursors = Precursors()
   query_par = copy(par)
   query_par.peptide_tables = [options.query_peptide_table]
+  query_par.precursor_index = '' # the index only contains the background
   query_precursors.getFromDB(query_par, db.cursor(), min_q1 - par.q1_window, max_q1 + par.q1_window)
   precursors_to_evaluate = query_precursors.getPrecursorsToEvaluate(min_q1, max_q1)
 else:
   precursors_to_evaluate = myprecursors.getPrecursorsToEvaluate(min_q1, max_q1)
-myprecursors.build_parent_id_lookup()
-myprecursors.build_transition_group_lookup()
 
 # If we dont use the DB, we use the rangetree to query and get our list of
 # precursors that are interfering. In SWATH we dont include a +/- q1_window
 # around our range or precursors because the precursor window is fixed to
 # (min_q1,max_q1) and no other precursors are considered.
 if not use_db and swath_mode: 
-  myprecursors.getFromDB(par, cursor, min_q1, max_q1)
-  rtree = myprecursors.build_rangetree()
-elif not use_db:
-  #myprecursors.getFromDB(par, cursor, min_q1 - par.q1_window, max_q1 + par.q1_window)
-  rtree = myprecursors.build_rangetree()
+  rtree = myprecursors.getFromDB_with_rangetree(par, cursor, min_q1, max_q1)
 
 # In SWATH mode, select all precursors that are relevant for the background at
 # once. Select all precursors between min_q1 - correction and max_q1 and then
@@ -158,12 +164,26 @@ if swath_mode and use_db:
       if(p.included_in_isotopic_range(min_q1, max_q1, par) ): 
         all_swath_precursors.append(p)
 
-allintertr = []
 MAX_UIS = par.max_uis
 progressm = progress.ProgressMeter(total=len(precursors_to_evaluate), unit='peptides')
-prepare  = []
-print "analyzing %s peptides" % len(precursors_to_evaluate)
-for precursor in precursors_to_evaluate:
+# each process needs its own database connection
+dbcursor = parallel.PerProcess(lambda: par.get_db().cursor(), cursor)
+
+def evaluate_precursors(start, end):
+  """Evaluate the precursors start to end, returns the number of non-UIS per
+  order for each precursor and the number of interferences per transition"""
+  prepare  = []
+  allintertr = []
+  cursor = dbcursor.get()
+  chunk = precursors_to_evaluate[start:end]
+  if not use_db:
+    # Query the rangetree once for the interfering precursors of the whole chunk
+    if swath_mode:
+      neighbours = myprecursors.query_rangetree_batch(chunk, par, rtree,
+        [min_q1] * len(chunk), [max_q1] * len(chunk))
+    else:
+      neighbours = myprecursors.query_rangetree_batch(chunk, par, rtree)
+  for k, precursor in enumerate(chunk):
 
     transitions = precursor.calculate_transitions_from_param(par)
     nr_transitions = len(transitions)
@@ -185,17 +205,13 @@ for precursor in precursors_to_evaluate:
         collisions_per_peptide = collider.get_coll_per_peptide_from_precursors(mycollider, 
                 transitions, precursors_obj, par, precursor)
     elif not use_db:
-        if swath_mode:
         # Case 3: SRMCollider in SWATH mode, get transitions from the rangetree
-          collisions_per_peptide = myprecursors.get_collisions_per_peptide_from_rangetree(
-              precursor, min_q1, max_q1, transitions, par, rtree)
-        else:
-          # Case 4: regular SRMCollider, get transitions from the rangetree
-          collisions_per_peptide = myprecursors.get_collisions_per_peptide_from_rangetree(
-              precursor, precursor.q1 - par.q1_window, precursor.q1 + par.q1_window, 
-              transitions, par, rtree)
+        # Case 4: regular SRMCollider, get transitions from the rangetree
+        collisions_per_peptide = myprecursors.get_collisions_per_peptide_from_neighbours(
+            precursor, transitions, par, neighbours, k)
 
-    non_uis_list = collider.get_nonuis_list(collisions_per_peptide, MAX_UIS)
+    # we only need the number of non-UIS, not the combinations themselves
+    non_uis_counts = collider.get_nonuis_counts(collisions_per_peptide, MAX_UIS)
     ## 
     ## Lets count the number of peptides that interfere
     if count_avg_transitions:
@@ -207,9 +223,20 @@ for precursor in precursors_to_evaluate:
     ##
     #
     for order in range(1,min(MAX_UIS+1, nr_transitions+1)): 
-        prepare.append( (len(non_uis_list[order]), collider.choose(nr_transitions, 
+        prepare.append( (non_uis_counts[order], collider.choose(nr_transitions, 
             order), precursor.parent_id , order, exp_key) )
     progressm.update(1)
+  return prepare, allintertr
+
+print "analyzing %s peptides" % len(precursors_to_evaluate)
+# The results of the chunks are concatenated in order, thus the output is
+# identical to a serial run.
+prepare  = []
+allintertr = []
+for chunk_prepare, chunk_allintertr in parallel.map_ranges(evaluate_precursors, 
+      len(precursors_to_evaluate), options.processes, progressm=progressm):
+    prepare.extend(chunk_prepare)
+    allintertr.extend(chunk_allintertr)
 
 if count_avg_transitions:
     print "\n"
@@ -231,3 +258,5 @@ for order in range(1,MAX_UIS+1):
       print "Order %s, Average non useable UIS %s" % (order, sum_all *1.0/ nr_peptides)
     # cursor.execute("insert into hroest.result_completegraph_aggr (sum_nonUIS, nr_peptides, uisorder, experiment) VALUES (%s,%s,%s,'%s')" % (sum_all, nr_peptides, order, exp_key))
 
+profiling.finish(par)
+
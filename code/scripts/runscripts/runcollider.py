@@ -45,23 +45,13 @@ Example Workflow:
 }}}
 """
 
-import MySQLdb, sys, csv, time
+import MySQLdb, sys, csv
 from optparse import OptionParser, OptionGroup
 
-from srmcollider import collider, progress, precursor
-from srmcollider.Residues import Residues
+from srmcollider import collider, progress, precursor, profiling
+from srmcollider.Residues import get_residues
 from srmcollider.Fileparser import parse_srmatlas_file, parse_mprophet_resultfile, parse_mprophet_methodfile, parse_peptidelist
 
-# determine whether we have the C++ modules available or not
-try:
-    from srmcollider import c_getnonuis
-    from srmcollider import c_integrated
-    use_cpp = True
-    print "Imported the C++ libraries with success"
-except ImportError:
-    use_cpp = False
-    print "Could not import the C++ libraries, please compile them."
-
 # some options that can be changed locally for your convenience
 default_mysql = "~/.my.cnf.srmcollider"
 default_org_prefix = 'srmcollider.srmPeptides_'
@@ -146,6 +136,13 @@ parameters.parse_options(options)
 par = parameters
 parameters.eval()
 
+# the implementations were chosen when parsing the options (see --backend)
+implementations = par.get_backends()
+print implementations.report()
+use_cpp = implementations.name('collisions_per_peptide') == 'cpp'
+if use_cpp:
+    from srmcollider import c_integrated
+
 #local arguments
 safetytransitions = options.safetytransitions
 outfile = options.outfile
@@ -240,6 +237,9 @@ if use_experimental_height:
 ## First create the mapping of the SSRcalc values to the peptide sequences 
 ## {{{
 mycollider = collider.SRMcollider()
+if not use_cpp:
+    # the same background peptides are fragmented again for many query peptides
+    mycollider.enable_fragment_cache()
 pepmap = {}
 seqs = ''
 seqdic = {}
@@ -282,10 +282,7 @@ if len(seqdic) > len(pepmap):
 ## START the main loop
 ## {{{
 progressm = progress.ProgressMeter(total=icount+1, unit='peptides')
-get_precursor_time = 0
-get_min_tr_time = 0
 for counter,spectrum in enumerate(library):
-    tmp_time = time.time()
     spectrum.score = -99
     spectrum.min_needed = -1
     # Get the spectrum peaks, sort by intensity
@@ -320,7 +317,7 @@ for counter,spectrum in enumerate(library):
     # Get all interfering precursors, (w/o the current peptide)
     precursors = mycollider._get_all_precursors(par, peptide_obj, cursor)
 
-    R = Residues('mono')
+    R = get_residues('mono')
     q3_low, q3_high = par.get_q3range_collisions()
     #
     # check for q3_low and q3_high values, if the transitions are outside this
@@ -334,13 +331,12 @@ for counter,spectrum in enumerate(library):
             sys.stderr.write(err) 
             sys.exit()
 
-    get_precursor_time += time.time() - tmp_time; tmp_time = time.time()
-
     if not use_experimental_height and use_cpp:
         # We dont have experimental height data and use C++ code
         old_prec = [(0,p.modified_sequence) for p in precursors]
-        min_needed = c_integrated.getMinNeededTransitions(tuple(transitions), tuple(old_prec), 
-            par.max_uis, par.q3_window, par.ppm, par)
+        with profiling.timer('min_needed_transitions'):
+            min_needed = c_integrated.getMinNeededTransitions(tuple(transitions), tuple(old_prec), 
+                par.max_uis, par.q3_window, par.ppm, par)
     elif not use_experimental_height:
         # We dont have experimental height data and cannot use C++ code
         collisions_per_peptide = collider.get_coll_per_peptide(mycollider, 
@@ -357,11 +353,7 @@ for counter,spectrum in enumerate(library):
             transitions, par, pep, cursor)
         for order in range(1,nr_transitions+1): 
             mymax = collider.choose(nr_transitions, order)
-            if use_cpp: non_uis = c_getnonuis.get_non_uis(collisions_per_peptide, order)
-            else: 
-                non_uis = set()
-                for pepc in collisions_per_peptide.values():
-                    get_non_uis(pepc, non_uis, i)
+            non_uis = implementations.get('nonuis')(collisions_per_peptide, order)
             if len(non_uis) < mymax: break
         if len(non_uis) < mymax: min_needed  = order
         else: min_needed = -1
@@ -369,14 +361,10 @@ for counter,spectrum in enumerate(library):
     spectrum.min_needed = min_needed
     if min_needed != -1: spectrum.score = nr_transitions - min_needed
     if not par.quiet: progressm.update(1)
-    get_min_tr_time += time.time() - tmp_time; tmp_time = time.time()
 
 
 # }}}
 
-totaltime = get_precursor_time + get_min_tr_time
-print "Time for getting the precursors %0.2fs (%.0f%%) vs the time to calculate the minimal nr transitions %0.2fs (%.0f%%)" % (
-    get_precursor_time, 100*get_precursor_time/totaltime, get_min_tr_time, 100*get_min_tr_time/totaltime,)
 ##
 ## PRINT some statistics of our results
 ## For each precursor, peptide and protein print the necessary transitions
@@ -501,6 +489,7 @@ for spectrum in library:
 
 f.close()
 print "Wrote transition list into file ", outfile
+profiling.finish(par)
 
 #}}}
 
@@ -1,7 +1,15 @@
 import re
+import Residues
 
 class Peptide:
 
+    # caches of the encoded and the SEQUEST sequence, they are valid as long
+    # as _sequence is the same object they were computed from
+    _encoded = None
+    _encoded_from = None
+    _sequest = None
+    _sequest_from = None
+
     def __init__(self):
         self._raw_sequence  = None
 
@@ -48,17 +56,28 @@ class Peptide:
         return self._raw_sequence
     #sequence = property(  get_raw_sequence, set_sequence )
 
+    def get_encoded_sequence(self):
+        """Return the modified sequence as array of integer residue codes (see
+        Residues.encode_sequence). The sequence is only parsed once."""
+        if self._encoded_from is not self._sequence:
+            self._encoded = Residues.encode_sequence(self._sequence)
+            self._encoded_from = self._sequence
+        return self._encoded
+
     def get_modified_sequence(self, format = 'bracket' ):
         if format == 'bracket': return self._sequence 
         elif format == 'SEQUEST': 
-            return \
-            re.sub( '\[147\]', '@', 
-            re.sub( '\[160\]', '#', 
-            re.sub( 'c\[31\]', '#', 
-            re.sub( '\[167\]', '*', 
-            re.sub( '\[181\]', '*', 
-            re.sub( '\[243\]', '*', 
-                    self._sequence ))) )))
+            if self._sequest_from is not self._sequence:
+                self._sequest = \
+                re.sub( '\[147\]', '@', 
+                re.sub( '\[160\]', '#', 
+                re.sub( 'c\[31\]', '#', 
+                re.sub( '\[167\]', '*', 
+                re.sub( '\[181\]', '*', 
+                re.sub( '\[243\]', '*', 
+                        self._sequence ))) )))
+                self._sequest_from = self._sequence
+            return self._sequest
         else: raise ValueError, 'format %s not supported' % format
 
     def has_phospho(self):
@@ -99,7 +118,8 @@ class Peptide:
              bMinusH2O=False, bMinusNH3=False, bPlusH2O=False,
              yMinusH2O=False, yMinusNH3=False, cions=False, xions=False,
              zions=False, MMinusH2O=False, MMinusNH3=False ):
-        seq = self.get_modified_sequence('bracket')
+        encoded = self.get_encoded_sequence()
+        masses = Residues.get_mass_table(R)
         self.mass = 0
         fragment_series = []
         #each fragment mass is an element of this species:
@@ -133,9 +153,9 @@ class Peptide:
         # note that the b and y series only go up to y[n-1] and b[n-1] since
         # the last ion of the series would be the parent ion (y) or the parent
         # ion with a loss of water (b).
-        for q in re.finditer( '([A-Z]\[\d*\]|[A-Z])', seq):
-            element = q.group(0)
-            res_mass = R.residues[element][1]
+        for code in encoded:
+            res_mass = masses[code]
+            if res_mass is None: raise KeyError(Residues.residue_tokens[code])
             self.mass += res_mass
             fragment_series.append( self.mass )
 
@@ -183,9 +203,8 @@ class Peptide:
         return count
 
     def _get_modified_fragments(self):
-        seq = self.get_modified_sequence('bracket')
-        for q in re.finditer( '([A-Z]\[\d*\]|[A-Z])', seq):
-            yield q.group(0)
+        for code in self.get_encoded_sequence():
+            yield Residues.residue_tokens[code]
 
     def get_fragment_objects(self, fragments, series, charge, R, q3_low, q3_high):
 
@@ -208,7 +227,6 @@ class Peptide:
         Reference: J. Mol. Biol. 157:105-132(1982).
         """
 
-        import Residues
         return sum([ Residues.Residues.Hydropathy_aa[aa] for aa in self.sequence]) / len(self.sequence)
 
 class Fragment():
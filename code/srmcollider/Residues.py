@@ -24,6 +24,9 @@
 """
 
 import string
+import re
+import threading
+from array import array
 
 # Isotope Modification
 # 0 means no modification
@@ -31,6 +34,51 @@ import string
 NOISOTOPEMODIFICATION = 0
 N15_ISOTOPEMODIFICATION = 1
 
+# Modified sequences (in bracket format) are encoded as arrays of integer
+# residue codes, one per (modified) residue such as 'K' or 'C[160]'. The codes
+# are shared by all Residues objects, get_mass_table returns the
+# corresponding masses for a given Residues object.
+_residue_re = re.compile('([A-Z]\[\d*\]|[A-Z])')
+residue_codes = {}
+residue_tokens = []
+
+# new residues are added under a lock since the codes may be assigned from
+# several threads at the same time (e.g. in the web service)
+_residue_lock = threading.Lock()
+
+def _add_residue(element):
+    with _residue_lock:
+        code = residue_codes.get(element)
+        if code is None:
+            code = len(residue_tokens)
+            residue_tokens.append(element)
+            residue_codes[element] = code
+        return code
+
+def encode_sequence(sequence):
+    """Encode a modified sequence into an array of residue codes"""
+    result = array('H')
+    for element in _residue_re.findall(sequence):
+        code = residue_codes.get(element)
+        if code is None: code = _add_residue(element)
+        result.append(code)
+    return result
+
+def get_mass_table(R):
+    """Return a list with the mass of every residue code using the masses of
+    the Residues object R (None for residues unknown to R).
+
+    The table is cached in R and only recomputed when new residues were
+    encoded or the residue masses of R were recalculated.
+    """
+    cached = getattr(R, '_mass_table', None)
+    if cached is None or cached[0] is not R.residues or cached[1] is not residue_tokens \
+       or len(cached[2]) != len(residue_tokens):
+        residues = R.residues
+        table = [residues[t][1] if t in residues else None for t in residue_tokens]
+        R._mass_table = cached = (residues, residue_tokens, table)
+    return cached[2]
+
 class Residues:
 
     # http://www.sisweb.com/referenc/source/exactmaa.htm
@@ -436,23 +484,13 @@ class Residues:
         'H': 7.6
     }
 
+    # shared objects (see get_residues) cannot be recalculated
+    _frozen = False
+
     def __init__(self, type="mono"):
         """Set up the residue data structure."""
-        #add the phosphorylations
-        self.monoisotopic_data[ 's' ] = ('Phospho-S', 
-        self.monoisotopic_data[ 'S' ][1] + self.mass_H1PO3)
-        self.monoisotopic_data[ 't' ] = ('Phospho-T', 
-        self.monoisotopic_data[ 'T' ][1] + self.mass_H1PO3)
-        self.monoisotopic_data[ 'y' ] = ('Phospho-Y',
-        self.monoisotopic_data[ 'Y' ][1] + self.mass_H1PO3)
-
-        self.average_data[ 's' ] = ('Phospho-S', 
-        self.average_data[ 'S' ][1] + self.mass_H1PO3)
-        self.average_data[ 't' ] = ('Phospho-T', 
-        self.average_data[ 'T' ][1] + self.mass_H1PO3)
-        self.average_data[ 'y' ] = ('Phospho-Y',
-        self.average_data[ 'Y' ][1] + self.mass_H1PO3)
-
+        # the phosphorylations are added to the class-level tables when the
+        # module is loaded, see _add_phosphorylations
         if not type:
             self.residues = self.average_data
         elif type.startswith("mono"):
@@ -461,11 +499,26 @@ class Residues:
             self.residues = self.average_data
         else:
             raise ValueError("Type of residue must be one of: mono[isotopic], av[erage] (characters within [] are optional.")
-        keys = self.residues.keys()
-        self.res_pairs = [ string.join((r, s), '') for r in keys for s in keys ]
+
+    def __getattr__(self, name):
+        # the pairs of all residues are only computed when they are used
+        if name == 'res_pairs':
+            keys = self.residues.keys()
+            self.res_pairs = [ string.join((r, s), '') for r in keys for s in keys ]
+            return self.res_pairs
+        raise AttributeError(name)
+
+    def _check_not_frozen(self):
+        if self._frozen:
+            raise TypeError("Cannot modify a shared Residues object, create a new one with Residues()")
+
+    def get_mass_table(self):
+        """Return the masses of all residue codes (see encode_sequence)"""
+        return get_mass_table(self)
 
     def recalculate_monisotopic_data(self):
 
+        self._check_not_frozen()
         self.monoisotopic_data = {}
         for abbrev, formula in self.aa_sum_formulas.iteritems(): 
             mysum = 0.0
@@ -491,6 +544,7 @@ class Residues:
 
     def recalculate_monisotopic_data_for_N15(self):
 
+        self._check_not_frozen()
         self.monoisotopic_data = {}
         for abbrev, formula in self.aa_sum_formulas.iteritems(): 
             mysum = 0.0
@@ -523,3 +577,49 @@ class Residues:
             self.monoisotopic_data[ 'Y' ][1] + self.mass_H1PO3)
         self.residues = self.monoisotopic_data
 
+class _FrozenDict(dict):
+    """A dictionary that cannot be changed"""
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("The residue tables cannot be changed")
+
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = _readonly
+
+    def __reduce__(self):
+        return (_FrozenDict, (dict(self),))
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+def _add_phosphorylations(data):
+    data[ 's' ] = ('Phospho-S', data[ 'S' ][1] + Residues.mass_H1PO3)
+    data[ 't' ] = ('Phospho-T', data[ 'T' ][1] + Residues.mass_H1PO3)
+    data[ 'y' ] = ('Phospho-Y', data[ 'Y' ][1] + Residues.mass_H1PO3)
+    return _FrozenDict(data)
+
+Residues.monoisotopic_data = _add_phosphorylations(Residues.monoisotopic_data)
+Residues.average_data = _add_phosphorylations(Residues.average_data)
+
+_shared_residues = {}
+def get_residues(type="mono"):
+    """Return a shared, read-only Residues object.
+
+    The type is "mono" (monoisotopic), "average" or "N15" (monoisotopic with
+    heavy nitrogen). The objects are only created once per process. The
+    residue tables of Residues() objects are read-only as well, use their
+    recalculate_* methods to obtain an object with different masses.
+    """
+    R = _shared_residues.get(type)
+    if R is None:
+        if type == "N15":
+            R = Residues("mono")
+            R.recalculate_monisotopic_data_for_N15()
+            R.monoisotopic_data = R.residues = _FrozenDict(R.residues)
+        else:
+            R = Residues(type)
+        R._frozen = True
+        _shared_residues[type] = R
+    return R
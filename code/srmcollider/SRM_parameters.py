@@ -23,6 +23,8 @@
  *
 """
 import Residues
+import backends
+import profiling
 
 class SRM_parameters(object):
 
@@ -66,6 +68,11 @@ class SRM_parameters(object):
         self.mysql_config    = None
         self.sqlite_database = None
         self.use_sqlite      = None
+        self.precursor_index = None
+        self.rangetree_cache = None
+        self.backend         = None # one of "auto", "cpp", "numpy", "python"
+        self.profile         = None # file for the stage profile (see profiling.py)
+        self.cprofile        = None # file for the cProfile statistics
 
         self.max_mods        = None
         self.max_MC          = None # missed cleavages
@@ -75,7 +82,7 @@ class SRM_parameters(object):
         self.add_sql_select  = None 
         self.query2_add  = '' 
 
-        self.R = Residues.Residues('mono')
+        self.R = Residues.get_residues('mono')
 
 
     def __repr__(self):
@@ -96,6 +103,11 @@ class SRM_parameters(object):
         if self.mysql_config    is None: self.mysql_config = '~/.my.cnf'
         if self.sqlite_database is None: self.sqlite_database = ''
         if self.use_sqlite      is None: self.use_sqlite = False
+        if self.precursor_index is None: self.precursor_index = ''
+        if self.rangetree_cache is None: self.rangetree_cache = ''
+        if self.backend         is None: self.backend = 'auto'
+        if self.profile         is None: self.profile = ''
+        if self.cprofile        is None: self.cprofile = ''
         if self.quiet           is None: self.quiet = False
         if self.max_mods        is None: self.max_mods = 0
         if self.max_MC          is None: self.max_MC = 0
@@ -167,6 +179,26 @@ class SRM_parameters(object):
                           help="Use specified sqlite database instead of MySQL database" )
         group.add_option("--mysql_config", dest="mysql_config", 
                           help="Location of mysql config file, defaults to ~/.my.cnf" )
+        group.add_option("--precursor_index", dest="precursor_index", 
+                          help="Use the specified precursor index file (see " +
+                          "build_precursor_index.py) instead of the peptide tables " +
+                          "to select the background precursors" )
+        group.add_option("--rangetree_cache", dest="rangetree_cache", 
+                          help="Directory in which the background precursors " +
+                          "and their rangetree are stored, they are reused by " +
+                          "the next run with the same background (requires numpy)" )
+        group.add_option("--backend", dest="backend", type="choice",
+                          choices=['auto'] + list(backends.BACKENDS),
+                          help="Implementation to use for the calculations: " +
+                          "auto, cpp, numpy or python (defaults to auto, the " +
+                          "fastest one available)" )
+        group.add_option("--profile", dest="profile", 
+                          help="Measure the time spent in each stage (database, " +
+                          "fragments, collisions, non-UIS, ...) and write it to " +
+                          "this file (JSON or CSV if it ends with .csv)" )
+        group.add_option("--cprofile", dest="cprofile", 
+                          help="Profile the run with cProfile and write the " +
+                          "statistics to this file (see the pstats module)" )
         group.add_option("-q", "--quiet", dest="quiet", 
                           help="don't print status messages to stdout")
         parser.add_option_group(group)
@@ -196,6 +228,14 @@ class SRM_parameters(object):
 
         if self.sqlite_database != '': self.use_sqlite = True
 
+        # resolve the implementations once, also for code without access to
+        # the parameters
+        backends.set_default_backend(self.backend)
+        self.get_backends()
+
+        if self.profile or self.cprofile:
+            profiling.enable(cprofile=bool(self.cprofile))
+
     def read_parameter_file(self, thefile):
         parameter = self
         execfile(thefile)
@@ -335,6 +375,10 @@ class SRM_parameters(object):
           import MySQLdb
           return MySQLdb.connect(read_default_file=self.mysql_config)
 
+    def get_backends(self, allow_cpp=True):
+      """Return the implementations to use (see backends.get_backends)"""
+      return backends.get_backends(self, allow_cpp)
+
     def calculate_isotope_correction(self):
       return self.isotopes_up_to * self.R.mass_diffC13 / min(self.parent_charges)
 
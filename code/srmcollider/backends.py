@@ -0,0 +1,286 @@
+"""
+ *
+ * Program       : SRMCollider
+ * Author        : Hannes Roest <roest@imsb.biol.ethz.ch>
+ * Date          : 05.02.2011
+ *
+ *
+ * Copyright (C) 2011 - 2012 Hannes Roest
+ *
+ * This library is free software; you can redistribute it and/or
+ * modify it under the terms of the GNU Lesser General Public
+ * License as published by the Free Software Foundation; either
+ * version 2.1 of the License, or (at your option) any later version.
+ *
+ * This library is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+ * Lesser General Public License for more details.
+ *
+ * You should have received a copy of the GNU Lesser General Public
+ * License along with this library; if not, write to the Free Software
+ * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307, USA
+ *
+"""
+
+"""
+Registry of the implementations (backends) of the expensive operations.
+
+Most operations of the SRMCollider are implemented in C++ (the c_getnonuis
+and c_rangetree modules), some of them also with numpy and all of them in
+pure Python. Instead of trying to import the C++ modules wherever they are
+used, the implementation of each operation is chosen once (see
+get_backends) and can be reported to the user:
+
+    >>> print get_backends(par).report()
+
+The preferred backend is taken from par.backend (the --backend option):
+'auto' and 'cpp' use the fastest implementation available, 'numpy' and
+'python' skip the C++ code ('python' also skips numpy). If an operation is
+not implemented by the preferred backend, the next slower one is used.
+
+The operations and the signatures of their implementations are
+
+    transitions(peptides, charges, q3_low, q3_high)
+        the fragments of peptides (q1, sequence, key) as (q3, q1, 0, key)
+    collisions_per_peptide(transitions, precursors, par, q3_low, q3_high,
+                           forceFragmentChargeCheck=False)
+        dictionary with the interfered srm_ids for each colliding peptide
+    nonuis(collisions_per_peptide, order)
+        container of all non-UIS of the given order (sorted tuples)
+    rangetree(extended=False)
+        an empty rangetree over Q1 and retention time (see Precursors)
+    euis(N, ssrcalcvalues, strike3_ssrcalcwindow)
+        the combinations of transitions that coelute (third strike)
+"""
+
+OPERATIONS = ('transitions', 'collisions_per_peptide', 'nonuis', 'rangetree', 'euis')
+BACKENDS = ('cpp', 'numpy', 'python')
+
+class BackendError(Exception):
+    pass
+
+# (operation, backend) => function returning the implementation, it raises
+# ImportError if the backend is not available
+_loaders = {}
+
+def register(operation, backend):
+    """Decorator to register a loader for an implementation of operation"""
+    if not operation in OPERATIONS: raise BackendError("Unknown operation '%s'" % operation)
+    if not backend in BACKENDS: raise BackendError("Unknown backend '%s'" % backend)
+    def decorator(loader):
+        _loaders[(operation, backend)] = loader
+        return loader
+    return decorator
+
+def get_fallback_order(preferred, allow_cpp=True):
+    """The backends to try in this order for the preferred backend"""
+    if preferred in (None, 'auto'): preferred = 'cpp'
+    if not preferred in BACKENDS:
+        raise BackendError("Unknown backend '%s', choose one of auto, %s" % (
+            preferred, ", ".join(BACKENDS)))
+    order = list(BACKENDS[BACKENDS.index(preferred):])
+    if not allow_cpp and 'cpp' in order: order.remove('cpp')
+    return order
+
+class Backends(object):
+    """The implementations chosen for all operations
+
+    The implementations are resolved when the object is created, get(op)
+    returns the implementation and name(op) the name of the backend used
+    (None if no backend is available).
+    """
+
+    def __init__(self, preferred='auto', allow_cpp=True):
+        self.preferred = preferred
+        self.allow_cpp = allow_cpp
+        self._impl = {}
+        self._names = {}
+        order = get_fallback_order(preferred, allow_cpp)
+        for op in OPERATIONS:
+            self._impl[op] = None
+            self._names[op] = None
+            for backend in order:
+                impl = load(op, backend)
+                if impl is None: continue
+                self._impl[op] = impl
+                self._names[op] = backend
+                break
+        # a backend that was explicitly requested has to be available
+        if order[0] == preferred and not preferred in self._names.values():
+            raise BackendError("The backend '%s' was requested but it is not available" % preferred +
+                (preferred == 'cpp' and ", please compile the C++ modules." or "."))
+
+    def get(self, operation):
+        impl = self._impl[operation]
+        if impl is None:
+            raise BackendError("No implementation of '%s' is available (tried %s)" % (
+                operation, ", ".join(get_fallback_order(self.preferred, self.allow_cpp))))
+        return impl
+
+    def name(self, operation):
+        return self._names[operation]
+
+    def report(self):
+        lines = ["Backends (requested: %s)" % self.preferred]
+        for op in OPERATIONS:
+            lines.append("    %-24s %s" % (op, self._names[op] or 'not available'))
+        return "\n".join(lines)
+
+    def __repr__(self):
+        return "Backends(%s)" % ", ".join(["%s=%s" % (op, self._names[op]) for op in OPERATIONS])
+
+def load(operation, backend):
+    """Return the implementation of operation by backend or None if it is
+    not available"""
+    loader = _loaders.get((operation, backend))
+    if loader is None: return None
+    try:
+        return loader()
+    except ImportError:
+        return None
+
+def available(operation):
+    """The names of all backends that can run operation"""
+    return [b for b in BACKENDS if load(operation, b) is not None]
+
+# The backend to use if no parameters are given (set by
+# SRM_parameters.parse_options) and the already resolved backends
+default_backend = 'auto'
+_resolved = {}
+
+def set_default_backend(preferred):
+    global default_backend
+    get_fallback_order(preferred) # check the name
+    default_backend = preferred
+
+def get_backends(par=None, allow_cpp=True):
+    """Return the (cached) Backends for the backend selected in par (or the
+    default backend)"""
+    preferred = getattr(par, 'backend', None) or default_backend
+    key = (preferred, allow_cpp)
+    if not _resolved.has_key(key):
+        _resolved[key] = Backends(preferred, allow_cpp)
+    return _resolved[key]
+
+#
+## Implementations
+#
+
+def _get_cpp_module():
+    import c_getnonuis
+    return c_getnonuis
+
+def _require_numpy():
+    import fragments
+    if not fragments.have_numpy(): raise ImportError("numpy is not available")
+    return fragments
+
+@register('transitions', 'cpp')
+def _load_transitions_cpp():
+    return _get_cpp_module().calculate_transitions_ch
+
+@register('transitions', 'numpy')
+def _load_transitions_numpy():
+    fragments = _require_numpy()
+    import Residues
+    def calculate_transitions_ch(peptides, charges, q3_low, q3_high):
+        q3, q1, peptide_key = fragments.calculate_transitions_ch(
+            peptides, charges, q3_low, q3_high, Residues.get_residues('mono'))
+        return [ (q3_, q1_, 0, key_) for q3_, q1_, key_ in
+                zip(q3.tolist(), q1.tolist(), peptide_key.tolist())]
+    return calculate_transitions_ch
+
+@register('transitions', 'python')
+def _load_transitions_python():
+    import collider
+    def calculate_transitions_ch(peptides, charges, q3_low, q3_high):
+        return list(collider._calculate_transitions_ch(
+            peptides, charges, q3_low, q3_high))
+    return calculate_transitions_ch
+
+@register('collisions_per_peptide', 'cpp')
+def _load_collisions_cpp():
+    c_getnonuis = _get_cpp_module()
+    def calculate_collisions_per_peptide(transitions, precursors, par, q3_low,
+        q3_high, forceFragmentChargeCheck=False):
+        return c_getnonuis.calculate_collisions_per_peptide_other_ion_series(
+            transitions, precursors, par, q3_low, q3_high, par.q3_window,
+            par.ppm, forceFragmentChargeCheck)
+    return calculate_collisions_per_peptide
+
+@register('collisions_per_peptide', 'numpy')
+def _load_collisions_numpy():
+    fragments = _require_numpy()
+    import collider, Residues
+    def calculate_collisions_per_peptide(transitions, precursors, par, q3_low,
+        q3_high, forceFragmentChargeCheck=False):
+        q3_low, q3_high = collider.get_fragment_range(par, q3_low, q3_high)
+        q3, q1, peptide_key = fragments.calculate_fragment_masses(precursors,
+            par, Residues.get_residues('mono'), q3_low, q3_high,
+            Residues.get_residues('N15'), forceFragmentChargeCheck)
+        collisions = [ (q3_, q1_, 0, key_) for q3_, q1_, key_ in
+                zip(q3.tolist(), q1.tolist(), peptide_key.tolist())]
+        return collider.calculate_collisions_per_peptide(transitions, collisions, par)
+    return calculate_collisions_per_peptide
+
+@register('collisions_per_peptide', 'python')
+def _load_collisions_python():
+    import collider, Residues
+    mycollider = collider.SRMcollider()
+    def calculate_collisions_per_peptide(transitions, precursors, par, q3_low,
+        q3_high, forceFragmentChargeCheck=False):
+        q3_low, q3_high = collider.get_fragment_range(par, q3_low, q3_high)
+        collisions = list(mycollider._calculate_fragment_masses(precursors,
+            par, mycollider.R, q3_low, q3_high, mycollider.RN15,
+            forceFragmentChargeCheck))
+        return collider.calculate_collisions_per_peptide(transitions, collisions, par)
+    return calculate_collisions_per_peptide
+
+@register('nonuis', 'cpp')
+def _load_nonuis_cpp():
+    return _get_cpp_module().get_non_uis
+
+@register('nonuis', 'python')
+def _load_nonuis_python():
+    import uis_functions
+    def get_non_uis(collisions_per_peptide, order):
+        non_uis = set()
+        for pepc in collisions_per_peptide.values():
+            uis_functions.get_non_uis(pepc, non_uis, order)
+        return non_uis
+    return get_non_uis
+
+@register('rangetree', 'cpp')
+def _load_rangetree_cpp():
+    import c_rangetree
+    def create_rangetree(extended=False):
+        if extended: return c_rangetree.ExtendedRangetree_Q1_RT.create()
+        return c_rangetree.Rangetree_Q1_RT.create()
+    return create_rangetree
+
+@register('rangetree', 'numpy')
+def _load_rangetree_numpy():
+    import rangetree
+    if rangetree.numpy is None: raise ImportError("numpy is not available")
+    def create_rangetree(extended=False):
+        if extended: return rangetree.ExtendedRangetree_Q1_RT()
+        return rangetree.Rangetree_Q1_RT()
+    return create_rangetree
+
+@register('rangetree', 'python')
+def _load_rangetree_python():
+    import rangetree
+    def create_rangetree(extended=False):
+        if extended: return rangetree.ExtendedRangetree_Q1_RT(use_numpy=False)
+        return rangetree.Rangetree_Q1_RT(use_numpy=False)
+    return create_rangetree
+
+@register('euis', 'cpp')
+def _load_euis_cpp():
+    return _get_cpp_module().calculate_eUIS
+
+@register('euis', 'python')
+def _load_euis_python():
+    import uis_functions
+    return uis_functions.calculate_eUIS
@@ -0,0 +1,347 @@
+"""
+ *
+ * Program       : SRMCollider
+ * Author        : Hannes Roest <roest@imsb.biol.ethz.ch>
+ * Date          : 05.02.2011
+ *
+ *
+ * Copyright (C) 2011 - 2012 Hannes Roest
+ *
+ * This library is free software; you can redistribute it and/or
+ * modify it under the terms of the GNU Lesser General Public
+ * License as published by the Free Software Foundation; either
+ * version 2.1 of the License, or (at your option) any later version.
+ *
+ * This library is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+ * Lesser General Public License for more details.
+ *
+ * You should have received a copy of the GNU Lesser General Public
+ * License along with this library; if not, write to the Free Software
+ * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307, USA
+ *
+"""
+
+"""
+Bulk loading of peptide precursors into the peptide tables (see
+scripts/misc/create_db.py).
+
+The peptides are processed in chunks on a pool of worker processes: each
+worker creates the modified variants of its peptides and calculates their
+precursor m/z (without the fragment ions). The parent process assigns the
+transition_group and parent_id of the precursors in the order of the input,
+thus the result does not depend on the number of processes, and hands them
+to a writer:
+
+    SqliteWriter   all rows in a single transaction (executemany)
+    MySQLWriter    batches of executemany or LOAD DATA LOCAL INFILE
+
+The writers create the secondary indices only after all rows are loaded.
+"""
+
+import os, re, tempfile
+import multiprocessing
+
+import Residues
+from uis_functions import combinations
+
+# The columns of the peptide tables, in the order of the rows of the writers
+PEPTIDE_COLUMNS = ('parent_id', 'peptide_key', 'modified_sequence', 'q1_charge',
+                   'q1', 'ssrcalc', 'modifications', 'missed_cleavages',
+                   'isotopically_modified', 'transition_group')
+INDEXED_COLUMNS = ('peptide_key', 'q1', 'ssrcalc', 'transition_group')
+
+class LoaderOptions(object):
+    """How the precursors of each peptide are created"""
+
+    def __init__(self, charges=[2,3], mass_cutoff=5000, modify_cysteins=True,
+                 oxidize_methionines=False, deamidate_asparagine=False,
+                 max_nr_modifications=3, isotope_modification=Residues.NOISOTOPEMODIFICATION):
+        self.charges = list(charges)
+        self.mass_cutoff = mass_cutoff
+        self.modify_cysteins = modify_cysteins
+        self.oxidize_methionines = oxidize_methionines
+        self.deamidate_asparagine = deamidate_asparagine
+        self.max_nr_modifications = max_nr_modifications
+        self.isotope_modification = isotope_modification
+
+    def get_residues(self):
+        if self.isotope_modification == Residues.N15_ISOTOPEMODIFICATION:
+            return Residues.get_residues('N15')
+        return Residues.get_residues('mono')
+
+def get_peptide_mass(modified_sequence, R):
+    """The (uncharged) mass of a peptide, as DDB.Peptide.create_fragmentation_pattern"""
+    encoded = Residues.encode_sequence(modified_sequence)
+    masses = Residues.get_mass_table(R)
+    mass = 0
+    for code in encoded:
+        res_mass = masses[code]
+        if res_mass is None: raise KeyError(Residues.residue_tokens[code])
+        mass += res_mass
+    return mass + (R.mass_OH + R.mass_H)
+
+def get_charged_mass(mass, charge, R):
+    return (mass + charge * R.mass_H) / charge
+
+def count_missed_cleavages(sequence):
+    """Number of K and R (not followed by P) before the C-terminus of the
+    sequence, as DDB.Peptide.missed_cleavages"""
+    sequence = re.sub('[^A-Z]', '', sequence)
+    count = 0
+    for i in range(len(sequence)-1):
+        if (sequence[i] == 'K' or sequence[i] == 'R') and not sequence[i+1] == 'P':
+            count += 1
+    return count
+
+# The variable modifications, as (residue, modified residue)
+OXIDATION = ('M', 'M[147]')
+DEAMIDATION = ('N', 'N[115]')
+
+def get_modification_delta(modification, R):
+    """The mass difference between the modified and the unmodified residue"""
+    residue, modified = modification
+    codes = Residues.encode_sequence(residue + modified)
+    masses = Residues.get_mass_table(R)
+    return masses[codes[1]] - masses[codes[0]]
+
+def iterate_modifications(tokens, options):
+    """Enumerate the modified variants of a peptide, given as list of residue
+    tokens (e.g. ['M', 'C[160]', 'K']).
+
+    Yields tuples (modifications, replacements) with the replacements as
+    list of (position, modification). Each set of modified positions is
+    enumerated exactly once, thus no variant is produced twice, and the
+    variants with more than max_nr_modifications are never created. The
+    order is the one of the original create_db.py: first the oxidized
+    variants, then the oxidized and deamidated and last the deamidated ones
+    (each with at most max_nr_modifications-1 of one kind).
+    """
+    max_nr = options.max_nr_modifications
+    oxidized = []
+    if options.oxidize_methionines:
+        positions = [i for i, t in enumerate(tokens) if t == OXIDATION[0]]
+        for nr in range(1, min(max_nr, 1+len(positions))):
+            for comb in combinations(positions, nr):
+                replaced = [(pos, OXIDATION) for pos in comb]
+                oxidized.append( (nr, replaced) )
+                yield nr, replaced
+    if options.deamidate_asparagine:
+        positions = [i for i, t in enumerate(tokens) if t == DEAMIDATION[0]]
+        for nr_oxidized, oxidized_replaced in oxidized:
+            for nr in range(1, min(max_nr - nr_oxidized, len(positions)) + 1):
+                for comb in combinations(positions, nr):
+                    yield nr_oxidized + nr, oxidized_replaced + [(pos, DEAMIDATION) for pos in comb]
+        for nr in range(1, min(max_nr, 1+len(positions))):
+            for comb in combinations(positions, nr):
+                yield nr, [(pos, DEAMIDATION) for pos in comb]
+
+def get_variants(sequence, options):
+    """Return the variants of a peptide that are loaded, each as a tuple
+    (modified_sequence, modifications, missed_cleavages, [(charge, q1), ...]).
+    The charge states above the mass cutoff are left out, a variant without
+    any charge state is still returned (it uses a transition_group).
+
+    The mass of the unmodified peptide is only calculated once, the mass of
+    each variant is derived from it with the mass differences of its
+    modifications.
+    """
+    R = options.get_residues()
+    mass_cutoff = options.mass_cutoff
+    charges = options.charges
+    missed_cleavages = count_missed_cleavages(sequence)
+    if options.modify_cysteins:
+        #Alkylate Cysteins with CAM
+        if sequence.find('C[') != -1: 
+            raise AssertionError('already modified cysteins here!')
+        sequence = sequence.replace('C', 'C[160]')
+    mass = get_peptide_mass(sequence, R)
+    precursors = [ (ch, get_charged_mass(mass, ch, R)) for ch in charges]
+    result = [ (sequence, 0, missed_cleavages,
+                [p for p in precursors if not p[1] > mass_cutoff]) ]
+    # some heuristics to make the whole thing faster, if already the charged
+    # mass if twice as high as the cutoff, even with modifications we will
+    # never get into the allowed mass range.
+    if precursors[-1][1] / 2.0 > mass_cutoff: return result
+    if not (options.oxidize_methionines or options.deamidate_asparagine): return result
+
+    tokens = [Residues.residue_tokens[code] for code in Residues.encode_sequence(sequence)]
+    deltas = dict([ (m, get_modification_delta(m, R)) for m in (OXIDATION, DEAMIDATION)])
+    for modifications, replaced in iterate_modifications(tokens, options):
+        modified_tokens = tokens[:]
+        mod_mass = mass
+        for pos, modification in replaced:
+            modified_tokens[pos] = modification[1]
+            mod_mass += deltas[modification]
+        result.append( (''.join(modified_tokens), modifications, missed_cleavages,
+                        [ (ch, q1) for ch, q1 in [ (ch, get_charged_mass(mod_mass, ch, R)) 
+                          for ch in charges] if not q1 > mass_cutoff]) )
+    return result
+
+# The options of the worker processes, set before they are forked
+_worker_options = None
+
+def _get_variants_chunk(chunk):
+    return [ (peptide_key, ssrcalc, get_variants(sequence, _worker_options))
+            for peptide_key, sequence, ssrcalc in chunk]
+
+def _chunks(iterable, chunksize):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= chunksize:
+            yield chunk
+            chunk = []
+    if chunk: yield chunk
+
+def create_rows(peptides, options, processes=1, chunksize=1000,
+                first_parent_id=1, first_transition_group=1, stats=None):
+    """Create the rows of the peptide table (see PEPTIDE_COLUMNS) for the
+    peptides, given as tuples (peptide_key, sequence, ssrcalc).
+
+    Each variant of a peptide gets the next transition_group and each of its
+    charge states the next parent_id. With more than one process, the
+    variants are computed in chunks of chunksize peptides on a process
+    pool, the rows are the same as with a single process.
+
+    The precursors with a modified sequence longer than 255 characters are
+    skipped, their number is counted in stats['skipped'] (if a dictionary
+    stats is given).
+    """
+    global _worker_options
+    if stats is None: stats = {}
+    stats['skipped'] = 0
+    _worker_options = options
+    chunks = _chunks(peptides, chunksize)
+    pool = None
+    if processes > 1:
+        pool = multiprocessing.Pool(processes)
+        results = pool.imap(_get_variants_chunk, chunks)
+    else:
+        results = (_get_variants_chunk(c) for c in chunks)
+    parent_id = first_parent_id
+    transition_group = first_transition_group
+    try:
+        for chunk in results:
+            for peptide_key, ssrcalc, variants in chunk:
+                for modified_sequence, modifications, missed_cleavages, precursors in variants:
+                    for charge, q1 in precursors:
+                        if len(modified_sequence) > 255:
+                            # too long for the modified_sequence column
+                            stats['skipped'] += 1
+                            continue
+                        yield (parent_id, peptide_key, modified_sequence, charge, q1, ssrcalc,
+                               modifications, missed_cleavages, options.isotope_modification,
+                               transition_group)
+                        parent_id += 1
+                    transition_group += 1
+        if pool is not None: pool.close()
+    except:
+        if pool is not None: pool.terminate()
+        raise
+    finally:
+        if pool is not None: pool.join()
+
+def get_create_table(table):
+    """SQL to create an (empty) peptide table without secondary indices"""
+    return """
+    create table %(table)s(
+        parent_id INT PRIMARY KEY,
+        peptide_key INT,
+        modified_sequence VARCHAR(255),
+        q1_charge TINYINT,
+        q1 DOUBLE,
+        ssrcalc DOUBLE,
+        modifications TINYINT UNSIGNED,
+        missed_cleavages TINYINT UNSIGNED,
+        isotopically_modified TINYINT UNSIGNED,
+        transition_group INT
+    )""" % {'table' : table}
+
+class SqliteWriter(object):
+    """Write all rows into a new sqlite table in a single transaction"""
+
+    def __init__(self, conn, table):
+        self.conn = conn
+        self.table = table
+        self.cursor = conn.cursor()
+        try:
+            self.cursor.execute("drop table %s" % table)
+        except Exception:
+            pass
+        self.cursor.execute(get_create_table(table))
+
+    def write(self, rows):
+        self.cursor.executemany("insert into %s (%s) values (%s)" % (self.table,
+            ', '.join(PEPTIDE_COLUMNS), ', '.join(['?'] * len(PEPTIDE_COLUMNS))), rows)
+
+    def finish(self):
+        # the table name may contain a database ('db.table'), the index not
+        name = self.table.split('.')[-1]
+        for column in INDEXED_COLUMNS:
+            self.cursor.execute("create index %s%s on %s (%s)" % (name, column, self.table, column))
+        self.conn.commit()
+
+def format_infile_row(row):
+    """Format a row as line for LOAD DATA INFILE. The floats are written with
+    repr, str would round them to 12 significant digits."""
+    return '\t'.join([repr(r) if isinstance(r, float) else str(r) for r in row]) + '\n'
+
+class MySQLWriter(object):
+    """Write the rows into a new MySQL table, either with executemany in
+    batches or by writing them into a file that is loaded with LOAD DATA
+    LOCAL INFILE (the connection needs local_infile=1)"""
+
+    def __init__(self, db, table, load_data_infile=False, batchsize=10000):
+        self.db = db
+        self.table = table
+        self.cursor = db.cursor()
+        self.batchsize = batchsize
+        self.cursor.execute("drop table if exists %s" % table)
+        self.cursor.execute(get_create_table(table))
+        self.infile = None
+        if load_data_infile:
+            fd, self.infile = tempfile.mkstemp(suffix='.tsv', prefix='srmcollider_load')
+            self.f = os.fdopen(fd, 'w')
+
+    def write(self, rows):
+        if self.infile is not None:
+            for row in rows:
+                self.f.write(format_infile_row(row))
+            return
+        batch = []
+        insert = "insert into %s (%s) values (%s)" % (self.table,
+            ', '.join(PEPTIDE_COLUMNS), ', '.join(['%s'] * len(PEPTIDE_COLUMNS)))
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= self.batchsize:
+                self.cursor.executemany(insert, batch)
+                batch = []
+        if batch: self.cursor.executemany(insert, batch)
+
+    def finish(self):
+        if self.infile is not None:
+            self.f.close()
+            try:
+                self.cursor.execute("load data local infile '%s' into table %s (%s)" % (
+                    self.infile, self.table, ', '.join(PEPTIDE_COLUMNS)))
+            finally:
+                os.remove(self.infile)
+        self.cursor.execute("alter table %s %s" % (self.table, 
+            ', '.join(["add index(%s)" % c for c in INDEXED_COLUMNS])))
+        self.db.commit()
+
+def load_peptides(peptides, writer, options, processes=1, chunksize=1000):
+    """Create the rows for the peptides (see create_rows) and load them with
+    the writer, returns the number of rows and the number of precursors that
+    were skipped since their sequence is too long"""
+    count = [0]
+    stats = {}
+    def counted(rows):
+        for row in rows:
+            count[0] += 1
+            yield row
+    writer.write(counted(create_rows(peptides, options, processes, chunksize, stats=stats)))
+    writer.finish()
+    return count[0], stats['skipped']
@@ -26,30 +26,46 @@
  *
 """
 
-import sys, os, time
+import sys, os, time, bisect
 import progress
 import DDB
 import Residues
+import fragments
+import backends
+import profiling
 
 from SRM_parameters import *
 from precursor import Precursor
 
 class SRMcollider(object):
 
-    def __init__(self):
-      self.R = Residues.Residues('mono')
-      self.RN15 = Residues.Residues('mono')
-      self.RN15.recalculate_monisotopic_data_for_N15()
+    def __init__(self, fragment_cache=None):
+      self.R = Residues.get_residues('mono')
+      self.RN15 = Residues.get_residues('N15')
+      self.fragment_cache = fragment_cache
 
+    def enable_fragment_cache(self, maxsize=100000, filename=None):
+      """Cache the fragment series of the background peptides (see
+      fragment_cache.FragmentCache), optionally also in an sqlite file"""
+      import fragment_cache
+      self.fragment_cache = fragment_cache.FragmentCache(maxsize, filename)
+      return self.fragment_cache
+
+    @profiling.profiled('db_fetch')
     def _get_all_precursors(self, par, precursor, cursor):
-      precursors = []
-      R = Residues.Residues('mono')
-      pep = precursor.to_old_pep()
-      for res in self._get_all_precursors_sub(par, pep, cursor):
-        p = Precursor()
-        p.initialize(*res)
-        if(p.included_in_isotopic_range(precursor.q1 - par.q1_window, precursor.q1 + par.q1_window, par) ): 
-          precursors.append(p)
+      if par.precursor_index:
+        # use the on-disk precursor index instead of the database
+        import precursor_index
+        precursors = precursor_index.get_all_precursors(par, precursor)
+      else:
+        precursors = []
+        pep = precursor.to_old_pep()
+        for res in self._get_all_precursors_sub(par, pep, cursor):
+          p = Precursor()
+          p.initialize(*res)
+          if(p.included_in_isotopic_range(precursor.q1 - par.q1_window, precursor.q1 + par.q1_window, par) ): 
+            precursors.append(p)
+      profiling.observe('background_size', len(precursors))
       return precursors
 
     def _get_all_precursors_sub(self, par, pep, cursor):
@@ -70,8 +86,7 @@ class SRMcollider(object):
             #
             # calculate how much lower we need to select to get all potential isotopes:
             #  to get all isotopes = lower_winow - nr_isotopes_to_consider * mass_difference_of_C13 / minimal_parent_charge
-            R = Residues.Residues('mono')
-            vdict['isotope_correction'] = par.isotopes_up_to * R.mass_diffC13 / min(par.parent_charges)
+            vdict['isotope_correction'] = par.isotopes_up_to * Residues.Residues.mass_diffC13 / min(par.parent_charges)
             query2 = """
             select %(values)s
             from %(pep)s
@@ -114,7 +129,89 @@ class SRMcollider(object):
 
     # For a given set of precursors, returns the precursors fragments as tuples
     # of type (q3, q1, 0, peptide_key)
+    @profiling.profiled('fragments')
     def calculate_fragment_masses(self, precursors, par, R, q3_low, q3_high, 
+        RN15=None, forceFragmentChargeCheck=False):
+        if self.fragment_cache is not None:
+            return self._calculate_fragment_masses_cached(precursors, par, R,
+                q3_low, q3_high, RN15, forceFragmentChargeCheck)
+        if _use_numpy_fragments(par):
+            # compute all fragments of all precursors at once
+            q3, q1, peptide_key = fragments.calculate_fragment_masses(precursors,
+                par, R, q3_low, q3_high, RN15, forceFragmentChargeCheck)
+            return [ (q3_, q1_, 0, key_) for q3_, q1_, key_ in
+                    zip(q3.tolist(), q1.tolist(), peptide_key.tolist())]
+        return self._calculate_fragment_masses(precursors, par, R, q3_low,
+            q3_high, RN15, forceFragmentChargeCheck)
+
+    def _calculate_fragment_masses_cached(self, precursors, par, R, q3_low, q3_high, 
+        RN15=None, forceFragmentChargeCheck=False):
+        # Look up the fragment series of all precursors in the cache and
+        # calculate the missing ones at once
+        ion_series = fragments.get_ion_series(par)
+        fields = [fragments.precursor_fields(c) for c in precursors]
+        allseries = {}
+        missing = {}
+        for q1, sequence, peptide_key, isotopically_modified in fields:
+            key = self.fragment_cache.get_key(sequence, isotopically_modified, ion_series)
+            if allseries.has_key(key) or missing.has_key(key): continue
+            series = self.fragment_cache.get(key)
+            if series is None: missing[key] = 1
+            else: allseries[key] = series
+        missing = missing.keys()
+        if _use_numpy_fragments(par):
+            computed = fragments.calculate_uncharged_series([k[0] for k in missing],
+                [k[1] for k in missing], R, RN15, ion_series)
+        else:
+            computed = []
+            for sequence, isotopically_modified, dummy in missing:
+                peptide = DDB.Peptide()
+                peptide.set_sequence(sequence)
+                peptide.charge = 2 #dummy, wont need it later
+                computed.append( self._create_fragmentation_pattern(peptide,
+                    par, R, RN15, isotopically_modified).allseries)
+        for key, series in zip(missing, computed):
+            allseries[key] = self.fragment_cache.put(key, series)
+        self.fragment_cache.sync()
+
+        result = []
+        for q1, sequence, peptide_key, isotopically_modified in fields:
+            charges_to_hold = [1,2]
+            if forceFragmentChargeCheck:
+                peptide = DDB.Peptide()
+                peptide.set_sequence(sequence)
+                if peptide.get_maximal_charge() == 2: charges_to_hold = [1]
+            series = allseries[self.fragment_cache.get_key(sequence, isotopically_modified, ion_series)]
+            for ch in charges_to_hold:
+                for pred in series:
+                    q3 = ( pred + (ch -1)*R.mass_H)/ch
+                    if q3 < q3_low or q3 > q3_high: continue
+                    result.append( (q3, q1, 0, peptide_key) )
+        return result
+
+    def _create_fragmentation_pattern(self, peptide, par, R, RN15, isotopically_modified):
+        if isotopically_modified == Residues.NOISOTOPEMODIFICATION:
+          R_used = R
+        elif isotopically_modified == Residues.N15_ISOTOPEMODIFICATION:
+          R_used = RN15
+        peptide.create_fragmentation_pattern( R_used, 
+            aions      =  par.aions    ,
+            aMinusNH3  =  par.aMinusNH3,
+            bions      =  par.bions    ,
+            bMinusH2O  =  par.bMinusH2O,
+            bMinusNH3  =  par.bMinusNH3,
+            bPlusH2O   =  par.bPlusH2O ,
+            yions      =  par.yions    ,
+            yMinusH2O  =  par.yMinusH2O,
+            yMinusNH3  =  par.yMinusNH3,
+            cions      =  par.cions    ,
+            xions      =  par.xions    ,
+            zions      =  par.zions    ,
+            MMinusH2O  =  par.MMinusH2O,
+            MMinusNH3  =  par.MMinusNH3)
+        return peptide
+
+    def _calculate_fragment_masses(self, precursors, par, R, q3_low, q3_high, 
         RN15=None, forceFragmentChargeCheck=False):
         for c in precursors:
             # keep the list around for some of the tests
@@ -125,31 +222,12 @@ class SRMcollider(object):
                 peptide.set_sequence(c[1])
                 peptide.charge = c[3]
                 isotopically_modified = c[4] 
-            elif type(c).__name__ == "instance":
+            else:
                 peptide = c.to_peptide()
                 q1 = c.q1
                 peptide_key = c.transition_group
                 isotopically_modified = c.isotopically_modified
-            if isotopically_modified == Residues.NOISOTOPEMODIFICATION:
-              R_used = R
-            # TODO test
-            elif isotopically_modified == Residues.N15_ISOTOPEMODIFICATION:
-              R_used = RN15
-            peptide.create_fragmentation_pattern( R_used, 
-                aions      =  par.aions    ,
-                aMinusNH3  =  par.aMinusNH3,
-                bions      =  par.bions    ,
-                bMinusH2O  =  par.bMinusH2O,
-                bMinusNH3  =  par.bMinusNH3,
-                bPlusH2O   =  par.bPlusH2O ,
-                yions      =  par.yions    ,
-                yMinusH2O  =  par.yMinusH2O,
-                yMinusNH3  =  par.yMinusNH3,
-                cions      =  par.cions    ,
-                xions      =  par.xions    ,
-                zions      =  par.zions    ,
-                MMinusH2O  =  par.MMinusH2O,
-                MMinusNH3  =  par.MMinusNH3)
+            self._create_fragmentation_pattern(peptide, par, R, RN15, isotopically_modified)
             charges_to_hold = [1,2]
             if(forceFragmentChargeCheck and peptide.get_maximal_charge() == 2):
                 charges_to_hold = [1]
@@ -167,22 +245,13 @@ class SRMcollider(object):
         nr_transitions = len( transitions )
         nr_used_tr = min(par.max_uis+1, nr_transitions)
         mytransitions = transitions[:nr_used_tr]
-        collisions_per_peptide = {}
-        q3_window_used = par.q3_window
-        for t in mytransitions:
-            if par.ppm: q3_window_used = par.q3_window * 10**(-6) * t[0]
-            for c in collisions:
-                if abs( t[0] - c[0] ) <= q3_window_used:
-                    #gets all collisions
-                    if collisions_per_peptide.has_key(c[3]):
-                        if not t[1] in collisions_per_peptide[c[3]]:
-                            collisions_per_peptide[c[3]].append( t[1] )
-                    else: collisions_per_peptide[c[3]] = [ t[1] ] 
+        collisions_per_peptide = calculate_collisions_per_peptide(mytransitions, collisions, par)
         return self._sub_getMinNeededTransitions(par, transitions, collisions_per_peptide)
 
     # calculates the minimally needed number of transitions for a peptide to be
     # uniquely identifiable in a background given a list of transitions sorted
     # by priority (intensity)
+    @profiling.profiled('min_needed_transitions')
     def getMinNeededTransitions_direct(self, par, transitions, precursors):
       q3_low, q3_high = par.get_q3range_collisions()
       collisions = self.calculate_fragment_masses(precursors, par, self.R, q3_low, q3_high, self.RN15)
@@ -190,19 +259,10 @@ class SRMcollider(object):
       nr_transitions = len( transitions )
       nr_used_tr = min(par.max_uis+1, nr_transitions)
       mytransitions = transitions[:nr_used_tr]
-      collisions_per_peptide = {}
-      q3_window_used = par.q3_window
-      for t in mytransitions:
-          if par.ppm: q3_window_used = par.q3_window * 10**(-6) * t[0]
-          for c in collisions:
-              if abs( t[0] - c[0] ) <= q3_window_used:
-                  #gets all collisions
-                  if collisions_per_peptide.has_key(c[3]):
-                      if not t[1] in collisions_per_peptide[c[3]]:
-                          collisions_per_peptide[c[3]].append( t[1] )
-                  else: collisions_per_peptide[c[3]] = [ t[1] ] 
+      collisions_per_peptide = calculate_collisions_per_peptide(mytransitions, collisions, par)
       return self._sub_getMinNeededTransitions(par, transitions, collisions_per_peptide)
 
+    @profiling.profiled('min_needed_transitions')
     def _sub_getMinNeededTransitions(self, par, transitions, collisions_per_peptide):
         #take the top j transitions and see whether they, as a tuple, are
         #shared
@@ -277,86 +337,132 @@ class SRMcollider(object):
         cursor.execute( query1 )
         return cursor.fetchall()
 
+def _use_numpy_fragments(par):
+    # numpy may also be switched off at runtime (see fragments.have_numpy)
+    return backends.get_backends(par, allow_cpp=False).name('collisions_per_peptide') == 'numpy' \
+            and fragments.have_numpy()
+
+@profiling.profiled('collisions')
 def get_coll_per_peptide_from_precursors(self, transitions, precursors, par, pep, 
         forceNonCpp=False, forceFragmentChargeCheck=False):
     q3_low, q3_high = par.get_q3range_transitions()
-    try: 
-        #try to use C++ libraries
-        if forceNonCpp: import somedummymodulethatwillneverexist
-        import c_getnonuis
-        return c_getnonuis.calculate_collisions_per_peptide_other_ion_series(
-            transitions, precursors, par, q3_low, q3_high, par.q3_window, par.ppm, forceFragmentChargeCheck)
-    except ImportError:
-        # if we dont have any C++ code compiled, calculate fragments 
-        R = Residues.Residues('mono')
-        RN15 = Residues.Residues('mono')
-        RN15.recalculate_monisotopic_data_for_N15()
-        collisions = self._get_all_collisions_calculate_sub(precursors,
-            par, R, q3_low, q3_high, RN15, forceFragmentChargeCheck=forceFragmentChargeCheck)
-
-    collisions = list(collisions)
-    collisions_per_peptide = {}
+    impl = backends.get_backends(par, allow_cpp=not forceNonCpp)
+    if impl.name('collisions_per_peptide') == 'cpp':
+        return impl.get('collisions_per_peptide')(transitions, precursors, par,
+            q3_low, q3_high, forceFragmentChargeCheck)
+
+    # calculate the fragments here (this uses the fragment cache if enabled)
+    R = Residues.get_residues('mono')
+    RN15 = Residues.get_residues('N15')
+    q3_low, q3_high = get_fragment_range(par, q3_low, q3_high)
+    collisions = self._get_all_collisions_calculate_sub(precursors,
+        par, R, q3_low, q3_high, RN15, forceFragmentChargeCheck=forceFragmentChargeCheck)
+    return calculate_collisions_per_peptide(transitions, collisions, par)
+
+def get_fragment_range(par, q3_low, q3_high):
+    """Return the range of fragments that can interfere with transitions
+    between q3_low and q3_high (the C++ code does not restrict the fragments
+    at all)"""
+    if par.ppm:
+        return q3_low - par.q3_window * 10**(-6) * q3_low, \
+               q3_high + par.q3_window * 10**(-6) * q3_high
+    return q3_low - par.q3_window, q3_high + par.q3_window
+
+def _find_collision_range(q3s, q3, q3_window_used):
+    """Return the first and last+1 position in the sorted list q3s of all
+    values with abs(q3 - value) <= q3_window_used.
+
+    The positions found by bisection are corrected with the exact comparison,
+    since the matches of abs(q3 - value) <= window form a contiguous block.
+    """
+    n = len(q3s)
+    lo = bisect.bisect_left(q3s, q3 - q3_window_used)
+    while lo > 0 and abs(q3 - q3s[lo-1]) <= q3_window_used: lo -= 1
+    while lo < n and q3s[lo] < q3 and abs(q3 - q3s[lo]) > q3_window_used: lo += 1
+    hi = bisect.bisect_right(q3s, q3 + q3_window_used, lo)
+    while hi < n and abs(q3 - q3s[hi]) <= q3_window_used: hi += 1
+    while hi > lo and q3s[hi-1] > q3 and abs(q3 - q3s[hi-1]) > q3_window_used: hi -= 1
+    return lo, hi
+
+def calculate_collision_pairs(transitions, collisions, par):
+    """Find all pairs of a transition and a colliding peptide.
+
+    Transitions are tuples (q3, srm_id) and collisions are tuples (q3, q1, 0,
+    peptide_key). The q3 values of the collisions are sorted once and the
+    window of each transition (in Th or ppm, see par.ppm) is found by binary
+    search.
+
+    Returns two columns: the peptide_keys and the indices of the transitions
+    (in transitions). Each pair is reported once, ordered by transition.
+    """
+    # the python fragment calculation returns a generator
+    if not isinstance(collisions, (list, tuple)): collisions = list(collisions)
+    order = sorted(range(len(collisions)), key=lambda i: collisions[i][0])
+    q3s = [collisions[i][0] for i in order]
+    keys = [collisions[i][3] for i in order]
+    peptide_keys = []
+    transition_indices = []
     q3_window_used = par.q3_window
-    for t in transitions:
+    for i, t in enumerate(transitions):
         if par.ppm: q3_window_used = par.q3_window * 10**(-6) * t[0]
-        for c in collisions:
-            if abs( t[0] - c[0] ) <= q3_window_used:
-                #gets all collisions
-                if collisions_per_peptide.has_key(c[3]):
-                    if not t[1] in collisions_per_peptide[c[3]]:
-                        collisions_per_peptide[c[3]].append( t[1] )
-                else: collisions_per_peptide[c[3]] = [ t[1] ] 
-    return collisions_per_peptide 
+        lo, hi = _find_collision_range(q3s, t[0], q3_window_used)
+        seen = set()
+        for key in keys[lo:hi]:
+            if key in seen: continue
+            seen.add(key)
+            peptide_keys.append(key)
+            transition_indices.append(i)
+    return peptide_keys, transition_indices
+
+def calculate_collisions_per_peptide(transitions, collisions, par):
+    """Return a dictionary with the list of interfered transitions (srm_id)
+    for each peptide in the background that collides with any transition.
+
+    The result is the same as comparing every transition with every collision
+    but it only needs O((T+C) log C) time (see calculate_collision_pairs).
+    """
+    collisions_per_peptide = {}
+    for key, i in zip(*calculate_collision_pairs(transitions, collisions, par)):
+        srm_id = transitions[i][1]
+        if collisions_per_peptide.has_key(key):
+            if not srm_id in collisions_per_peptide[key]:
+                collisions_per_peptide[key].append( srm_id )
+        else: collisions_per_peptide[key] = [ srm_id ]
+    return collisions_per_peptide
 
 # return a dictionary that contains the list of collisions for each peptide in the background (if there are any)
+@profiling.profiled('collisions')
 def get_coll_per_peptide(self, transitions, par, pep, cursor,
         do_not_calculate=False, forceNonCpp=False, forceFragmentChargeCheck=False):
     if do_not_calculate:
         assert False # not supported any more
-    else:
-        try: 
-            #try to use C++ libraries, really fast 50ms or less
-            if forceNonCpp or forceFragmentChargeCheck: import somedummymodulethatwillneverexist
-            return _get_coll_per_peptide_sub(self, transitions, par, pep, cursor, forceFragmentChargeCheck)
-        except ImportError:
-            collisions = list(self._get_all_collisions_calculate_new(par, pep, cursor,
-                forceFragmentChargeCheck=forceFragmentChargeCheck))
-    collisions_per_peptide = {}
-    q3_window_used = par.q3_window
-    for t in transitions:
-        if par.ppm: q3_window_used = par.q3_window * 10**(-6) * t[0]
-        for c in collisions:
-            if abs( t[0] - c[0] ) <= q3_window_used:
-                #gets all collisions
-                if collisions_per_peptide.has_key(c[3]):
-                    if not t[1] in collisions_per_peptide[c[3]]:
-                        collisions_per_peptide[c[3]].append( t[1] )
-                else: collisions_per_peptide[c[3]] = [ t[1] ] 
-    return collisions_per_peptide 
+    elif not (forceNonCpp or forceFragmentChargeCheck) and \
+      backends.get_backends(par).name('collisions_per_peptide') == 'cpp':
+        #use the C++ libraries, really fast 50ms or less
+        return _get_coll_per_peptide_sub(self, transitions, par, pep, cursor, forceFragmentChargeCheck)
+    collisions = list(self._get_all_collisions_calculate_new(par, pep, cursor,
+        forceFragmentChargeCheck=forceFragmentChargeCheck))
+    return calculate_collisions_per_peptide(transitions, collisions, par)
 
 def _get_coll_per_peptide_sub(self, transitions, par, pep, cursor, forceFragmentChargeCheck=False):
 
         q3_low, q3_high = par.get_q3range_collisions()
         transitions = tuple([ (t[0], i) for i,t in enumerate(transitions)])
         # fast = 100 
-        import c_getnonuis
         precursors = self._get_all_precursors(par, pep, cursor)
-        return c_getnonuis.calculate_collisions_per_peptide_other_ion_series( 
-            transitions, precursors, par, q3_low, q3_high, par.q3_window, par.ppm, forceFragmentChargeCheck)
-
-# Calculate the transitions of a peptide with a given charge (using c++ if possible)
-def calculate_transitions_ch(peptides, charges, q3_low, q3_high):
-    try: 
-        import c_getnonuis
-        return c_getnonuis.calculate_transitions_ch(
-            peptides, charges, q3_low, q3_high)
-    except ImportError:
-        return list(_calculate_transitions_ch(
-            peptides, charges, q3_low, q3_high))
+        return backends.get_backends(par).get('collisions_per_peptide')(
+            transitions, precursors, par, q3_low, q3_high, forceFragmentChargeCheck)
+
+# Calculate the transitions of a peptide with a given charge (using c++ if
+# possible, see backends.py)
+@profiling.profiled('transitions')
+def calculate_transitions_ch(peptides, charges, q3_low, q3_high, par=None):
+    return backends.get_backends(par).get('transitions')(
+        peptides, charges, q3_low, q3_high)
 
 def _calculate_transitions_ch(peptides, charges, q3_low, q3_high):
     import DDB 
-    R = Residues.Residues('mono')
+    R = Residues.get_residues('mono')
     for p in peptides:
         q1 = p[0]
         peptide_key = p[2]
@@ -394,6 +500,9 @@ from uis_functions import _combinationsDiffLen
 #
 # Output a dictionary whose keys are all the "forbidden" tuples, e.g. tuples of
 # transitions that are interfering and can thus not be used for an eUIS.
+#
+# This is the original implementation, uis_functions.calculate_eUIS computes
+# the maximal forbidden tuples much faster (it is used by the python backend).
 def thisthirdstrike(N, ssrcalcvalues, strike3_ssrcalcwindow, verbose=False):
     if verbose: print "Started Python function thisthirdstrike"
     M = len(ssrcalcvalues)
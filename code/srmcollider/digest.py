@@ -0,0 +1,158 @@
+"""
+ *
+ * Program       : SRMCollider
+ * Author        : Hannes Roest <roest@imsb.biol.ethz.ch>
+ * Date          : 05.02.2011
+ *
+ *
+ * Copyright (C) 2011 - 2012 Hannes Roest
+ *
+ * This library is free software; you can redistribute it and/or
+ * modify it under the terms of the GNU Lesser General Public
+ * License as published by the Free Software Foundation; either
+ * version 2.1 of the License, or (at your option) any later version.
+ *
+ * This library is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+ * Lesser General Public License for more details.
+ *
+ * You should have received a copy of the GNU Lesser General Public
+ * License along with this library; if not, write to the Free Software
+ * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307, USA
+ *
+"""
+
+"""
+In silico digestion of protein sequences (see scripts/misc/trypsinize.py).
+
+The proteins are read one by one from a FASTA file (read_fasta), digested on
+a pool of worker processes (digest_proteins) and the duplicate peptides are
+removed with a bounded amount of memory (unique): the peptides are
+distributed by their hash over shard files on disk and only one shard is
+deduplicated in memory at a time.
+"""
+
+import os, re, heapq, shutil, tempfile, zlib
+import itertools
+import multiprocessing
+
+# The cleavage rules, a site is between two residues
+ENZYMES = {
+    # after K and R, but not before P
+    'trypsin' : re.compile(r'(?<=[RK])(?=[^P])'),
+    # after K, but not before P
+    'lysc'    : re.compile(r'(?<=K)(?=[^P])'),
+    # after E, but not before P (in bicarbonate buffer)
+    'gluc'    : re.compile(r'(?<=E)(?=[^P])'),
+}
+
+def trypsinize(sequence, missed=0):
+    """Cleave a protein sequence after K and R (but not before P) and yield
+    the peptides, each followed by its peptides with up to the given number
+    of missed cleavages"""
+    return digest(sequence, 'trypsin', missed)
+
+def digest(sequence, enzyme='trypsin', missed=0, semi=False, min_len=0):
+    """Cleave a protein sequence with the enzyme (see ENZYMES) and yield the
+    peptides, each followed by its peptides with up to the given number of
+    missed cleavages. With semi, each of these peptides is followed by its
+    semi-specific peptides (only one end is a cleavage site), shortest first.
+    Only peptides of at least min_len residues are yielded."""
+    protein = ENZYMES[enzyme].sub(' ', sequence).split()
+    for i,peptide in enumerate(protein):
+      current = peptide
+      k = 0
+      # do missed cleavages
+      while True:
+          if len(current) >= min_len: yield current
+          if semi:
+              for l in range(max(min_len, 1), len(current)):
+                  yield current[:l]
+                  yield current[-l:]
+          k+=1
+          if not (i+k<len(protein) and k<=missed): break
+          current = current + protein[i+k]
+
+def read_fasta(f):
+    """Read the records of a FASTA file one by one, yields (header, sequence)"""
+    header = None
+    sequence = []
+    for line in f:
+        line = line.strip()
+        if line.startswith('>'):
+            if header is not None: yield header, ''.join(sequence)
+            header = line[1:]
+            sequence = []
+        elif header is not None:
+            sequence.append(line.replace(' ', ''))
+    if header is not None: yield header, ''.join(sequence)
+
+def _digest_chunk(args):
+    sequences, enzyme, missed, semi, min_len = args
+    result = []
+    for sequence in sequences:
+        result.extend(digest(sequence, enzyme, missed, semi, min_len))
+    return result
+
+def digest_proteins(sequences, enzyme='trypsin', missed=0, semi=False, min_len=0,
+                    processes=1, chunksize=100):
+    """Digest the protein sequences (see digest) and yield the peptides in
+    the order of the proteins. With more than one process, chunks of
+    chunksize proteins are digested on a process pool."""
+    sequences = iter(sequences)
+    chunks = iter(lambda: list(itertools.islice(sequences, chunksize)), [])
+    tasks = ( (chunk, enzyme, missed, semi, min_len) for chunk in chunks)
+    pool = None
+    if processes > 1:
+        pool = multiprocessing.Pool(processes)
+        results = pool.imap(_digest_chunk, tasks)
+    else:
+        results = itertools.imap(_digest_chunk, tasks)
+    try:
+        for peptides in results:
+            for peptide in peptides: yield peptide
+        if pool is not None: pool.close()
+    except:
+        if pool is not None: pool.terminate()
+        raise
+    finally:
+        if pool is not None: pool.join()
+
+def _read_shard(filename):
+    for line in open(filename):
+        index, peptide = line.split()
+        yield int(index), peptide
+
+def unique(peptides, shards=64, tmpdir=None):
+    """Yield each of the peptides once, in the order of their first
+    occurrence.
+
+    The peptides (with their position) are written into shard files by
+    their hash, then the duplicates are removed from one shard after the
+    other and the shards are merged by position. Thus, only the peptides of
+    one shard are held in memory. The shard files are created in a
+    temporary directory in tmpdir and removed afterwards.
+    """
+    directory = tempfile.mkdtemp(prefix='srmcollider_unique', dir=tmpdir)
+    try:
+        filenames = [os.path.join(directory, 'shard%s' % i) for i in range(shards)]
+        files = [open(fname, 'w') for fname in filenames]
+        for index, peptide in enumerate(peptides):
+            files[(zlib.crc32(peptide) & 0xffffffff) % shards].write('%s\t%s\n' % (index, peptide))
+        for f in files: f.close()
+        # keep the first occurrence in each shard
+        for fname in filenames:
+            seen = set()
+            out = open(fname + '.unique', 'w')
+            for index, peptide in _read_shard(fname):
+                if peptide in seen: continue
+                seen.add(peptide)
+                out.write('%s\t%s\n' % (index, peptide))
+            out.close()
+            del seen
+            os.remove(fname)
+        for index, peptide in heapq.merge(*[_read_shard(fname + '.unique') for fname in filenames]):
+            yield peptide
+    finally:
+        shutil.rmtree(directory)
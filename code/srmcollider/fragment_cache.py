@@ -0,0 +1,146 @@
+"""
+ *
+ * Program       : SRMCollider
+ * Author        : Hannes Roest <roest@imsb.biol.ethz.ch>
+ * Date          : 05.02.2011
+ *
+ *
+ * Copyright (C) 2011 - 2012 Hannes Roest
+ *
+ * This library is free software; you can redistribute it and/or
+ * modify it under the terms of the GNU Lesser General Public
+ * License as published by the Free Software Foundation; either
+ * version 2.1 of the License, or (at your option) any later version.
+ *
+ * This library is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+ * Lesser General Public License for more details.
+ *
+ * You should have received a copy of the GNU Lesser General Public
+ * License along with this library; if not, write to the Free Software
+ * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307, USA
+ *
+"""
+
+"""
+A size-bounded cache for the (uncharged) fragment ion series of peptides.
+
+The same background peptides are fragmented again for every query peptide
+they interfere with. The FragmentCache keeps the fragment series of the most
+recently used peptides in memory (as compact arrays of doubles) and can
+optionally be backed by an sqlite file which is shared between runs and
+between processes.
+
+The entries are keyed by the modified sequence, the isotopic modification
+and the ion series that are enabled (see fragments.get_ion_series).
+"""
+
+from array import array
+from collections import OrderedDict
+
+class FragmentCache(object):
+    """LRU cache of fragment series
+
+    The cache holds at most maxsize peptides in memory, the least recently
+    used ones are evicted first. If a filename is given, all fragment series
+    are also stored in an sqlite database with this name and are looked up
+    there before they are recomputed.
+    """
+
+    def __init__(self, maxsize=100000, filename=None):
+        self.maxsize = maxsize
+        self.filename = filename
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.disk_hits = 0
+        self._db = None
+        if filename is not None:
+            self._open_db()
+
+    def _open_db(self):
+        import sqlite3
+        # allow several processes to write to the same file
+        self._db = sqlite3.connect(self.filename, timeout=60)
+        self._db.execute("""create table if not exists fragment_series (
+            cachekey TEXT PRIMARY KEY, series BLOB)""")
+        self._db.commit()
+
+    @staticmethod
+    def get_key(modified_sequence, isotopically_modified, ion_series):
+        return (modified_sequence, isotopically_modified, ion_series)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key):
+        """Return the fragment series stored under key or None"""
+        try:
+            value = self._data.pop(key)
+        except KeyError:
+            value = self._get_from_disk(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._insert(key, value)
+            return value
+        # re-insert to mark as most recently used
+        self._data[key] = value
+        self.hits += 1
+        return value
+
+    def put(self, key, series):
+        """Store the fragment series (a sequence of floats) under key, returns
+        the stored array"""
+        value = array('d', series)
+        if key in self._data: del self._data[key]
+        self._insert(key, value)
+        if self._db is not None:
+            self._db.execute("insert or ignore into fragment_series values (?,?)",
+                             (self._disk_key(key), buffer(value.tostring())))
+        return value
+
+    def sync(self):
+        """Write all pending entries to the disk store"""
+        if self._db is not None: self._db.commit()
+
+    def close(self):
+        if self._db is not None:
+            self._db.commit()
+            self._db.close()
+            self._db = None
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self):
+        return {'size' : len(self._data), 'maxsize' : self.maxsize,
+                'hits' : self.hits, 'misses' : self.misses,
+                'evictions' : self.evictions, 'disk_hits' : self.disk_hits}
+
+    def __repr__(self):
+        return "FragmentCache with %(size)s/%(maxsize)s entries, %(hits)s hits, %(misses)s misses, %(evictions)s evictions" % self.stats()
+
+    def _insert(self, key, value):
+        self._data[key] = value
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def _disk_key(self, key):
+        return "%s|%s|%s" % (key[0], key[1], ",".join(key[2]))
+
+    def _get_from_disk(self, key):
+        if self._db is None: return None
+        res = self._db.execute("select series from fragment_series where cachekey = ?",
+                               (self._disk_key(key),)).fetchone()
+        if res is None: return None
+        value = array('d')
+        value.fromstring(str(res[0]))
+        return value
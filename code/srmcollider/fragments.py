@@ -0,0 +1,285 @@
+"""
+ *
+ * Program       : SRMCollider
+ * Author        : Hannes Roest <roest@imsb.biol.ethz.ch>
+ * Date          : 05.02.2011
+ *
+ *
+ * Copyright (C) 2011 - 2012 Hannes Roest
+ *
+ * This library is free software; you can redistribute it and/or
+ * modify it under the terms of the GNU Lesser General Public
+ * License as published by the Free Software Foundation; either
+ * version 2.1 of the License, or (at your option) any later version.
+ *
+ * This library is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+ * Lesser General Public License for more details.
+ *
+ * You should have received a copy of the GNU Lesser General Public
+ * License along with this library; if not, write to the Free Software
+ * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307, USA
+ *
+"""
+
+"""
+Vectorized fragment ion calculation for many precursors at once (using numpy).
+
+This is the batched equivalent of DDB.Peptide.create_fragmentation_pattern
+followed by the charge state loop in SRMcollider.calculate_fragment_masses.
+All sequences of a batch are encoded into an integer residue matrix once, the
+residue masses are looked up for the whole matrix and the ion series are
+computed with cumulative sums. The operations are carried out in the same
+order as in the pure Python code, thus the results are identical (not only
+within some epsilon) and are also returned in the same order.
+"""
+
+import re
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import Residues
+
+# All ion series in the order in which create_fragmentation_pattern appends
+# them to peptide.allseries together with the name of the flag in
+# SRM_parameters. The M-H2O and M-NH3 series only have a single ion.
+ION_SERIES = [
+    ('b',         'bions'),
+    ('y',         'yions'),
+    ('a',         'aions'),
+    ('c',         'cions'),
+    ('x',         'xions'),
+    ('z',         'zions'),
+    ('aMinusNH3', 'aMinusNH3'),
+    ('bMinusH2O', 'bMinusH2O'),
+    ('bMinusNH3', 'bMinusNH3'),
+    ('bPlusH2O',  'bPlusH2O'),
+    ('yMinusH2O', 'yMinusH2O'),
+    ('yMinusNH3', 'yMinusNH3'),
+    ('MMinusH2O', 'MMinusH2O'),
+    ('MMinusNH3', 'MMinusNH3'),
+]
+_SINGLE_ION_SERIES = ('MMinusH2O', 'MMinusNH3')
+
+# number of precursors that are processed in one block (bounds the memory)
+DEFAULT_BATCHSIZE = 5000
+
+_residue_re = re.compile('([A-Z]\[\d*\]|[A-Z])')
+
+def have_numpy():
+    return numpy is not None
+
+def get_ion_series(par):
+    """Return the names of the ion series enabled in the parameter object (in
+    the order of DDB.Peptide.allseries)."""
+    return tuple([name for name, flag in ION_SERIES if getattr(par, flag)])
+
+class ResidueEncoder(object):
+    """Encodes modified sequences (bracket format) into integer residue codes.
+
+    The vocabulary is shared by all sequences encoded with the same object,
+    the corresponding masses are obtained with mass_table for each Residues
+    object (e.g. monoisotopic and N15 masses).
+    """
+
+    def __init__(self):
+        self.codes = {}
+        self.tokens = []
+
+    def encode(self, sequence):
+        result = []
+        for element in _residue_re.findall(sequence):
+            code = self.codes.get(element)
+            if code is None:
+                code = len(self.tokens)
+                self.codes[element] = code
+                self.tokens.append(element)
+            result.append(code)
+        return result
+
+    def encode_matrix(self, sequences):
+        """Encode a list of sequences into a (padded) code matrix.
+
+        Returns the code matrix and the number of residues for each row.
+        """
+        encoded = [self.encode(s) for s in sequences]
+        lengths = numpy.array([len(e) for e in encoded], dtype=numpy.intp)
+        maxlen = max(1, lengths.max()) if len(encoded) > 0 else 1
+        codes = numpy.zeros( (len(encoded), maxlen), dtype=numpy.int32)
+        for i, e in enumerate(encoded):
+            codes[i, :len(e)] = e
+        return codes, lengths
+
+    def mass_table(self, R):
+        # Unknown residues raise a KeyError just like in create_fragmentation_pattern
+        return numpy.array([R.residues[t][1] for t in self.tokens], dtype=numpy.float64)
+
+def _maximal_charge(sequence):
+    raw = re.sub( '[^A-Z]', '', sequence )
+    return raw.count('R') + raw.count('H') + raw.count('K') + 1
+
+def calculate_fragment_series(masses, lengths, series, R):
+    """Calculate the uncharged fragment ion series for a matrix of residue
+    masses (one peptide per row, padded with zeros).
+
+    Returns a matrix with one row per peptide which contains all requested
+    ion series after each other (analogous to DDB.Peptide.allseries) and a
+    boolean matrix that is True for all valid entries.
+    """
+    nr_rows, maxlen = masses.shape
+    nr_frag = max(maxlen - 1, 0)
+    # the padding is zero, thus the last column holds the total residue mass
+    cumulative = numpy.cumsum(masses, axis=1)
+    prefix = cumulative[:, :nr_frag]
+    mass = cumulative[:, -1]
+    position_valid = numpy.arange(nr_frag)[None, :] < (lengths - 1)[:, None]
+
+    b_series = prefix + R.mass_H
+    y_series = mass[:, None] - prefix + 2*R.mass_H + R.mass_OH
+
+    blocks = []
+    valid = []
+    for name in series:
+        if name == 'b':           block = b_series
+        elif name == 'y':         block = y_series
+        elif name == 'a':         block = b_series - R.mass_CO
+        elif name == 'c':         block = b_series + R.mass_NH3
+        elif name == 'x':         block = y_series + R.mass_CO - 2*R.mass_H
+        elif name == 'z':         block = y_series - R.mass_NH3
+        elif name == 'aMinusNH3': block = b_series - R.mass_CO - R.mass_NH3
+        elif name == 'bMinusH2O': block = b_series - R.mass_H2O
+        elif name == 'bMinusNH3': block = b_series - R.mass_NH3
+        elif name == 'bPlusH2O':  block = b_series + R.mass_H2O
+        elif name == 'yMinusH2O': block = y_series - R.mass_H2O
+        elif name == 'yMinusNH3': block = y_series - R.mass_NH3
+        elif name == 'MMinusH2O': block = mass[:, None]
+        elif name == 'MMinusNH3': block = (mass + R.mass_H2O - R.mass_NH3)[:, None]
+        else: raise ValueError("Unknown ion series %s" % name)
+        blocks.append(block)
+        if name in _SINGLE_ION_SERIES:
+            valid.append(numpy.ones( (nr_rows, 1), dtype=bool))
+        else:
+            valid.append(position_valid)
+
+    if len(blocks) == 0:
+        return numpy.zeros( (nr_rows, 0) ), numpy.zeros( (nr_rows, 0), dtype=bool)
+    return numpy.hstack(blocks), numpy.hstack(valid)
+
+def precursor_fields(c):
+    """Get (q1, sequence, peptide_key, isotopically_modified) from either an
+    old-style tuple (q1, sequence, peptide_key, charge, isotopically_modified)
+    or a Precursor object."""
+    if isinstance(c, (list, tuple)):
+        return c[0], c[1], c[2], c[4]
+    return c.q1, c.modified_sequence, c.transition_group, c.isotopically_modified
+
+def calculate_fragment_masses(precursors, par, R, q3_low, q3_high, RN15=None,
+    forceFragmentChargeCheck=False, series=None, charges=(1,2),
+    batchsize=DEFAULT_BATCHSIZE):
+    """Calculate the charged fragment masses of all given precursors.
+
+    Returns the three columns (q3, q1, peptide_key) as numpy arrays. The rows
+    are in the same order as the tuples (q3, q1, 0, peptide_key) generated by
+    SRMcollider.calculate_fragment_masses.
+
+    The precursors may either be Precursor objects or tuples of the form (q1,
+    sequence, peptide_key, charge, isotopically_modified).
+    """
+    if series is None: series = get_ion_series(par)
+    q3_res = []
+    q1_res = []
+    key_res = []
+    encoder = ResidueEncoder()
+    precursors = list(precursors)
+    for start in range(0, len(precursors), batchsize):
+        q3, q1, key = _calculate_fragment_masses_batch(precursors[start:start+batchsize],
+            R, RN15, q3_low, q3_high, forceFragmentChargeCheck, series, charges, encoder)
+        q3_res.append(q3)
+        q1_res.append(q1)
+        key_res.append(key)
+
+    if len(q3_res) == 0:
+        return numpy.zeros(0), numpy.zeros(0), numpy.zeros(0, dtype=numpy.int64)
+    return numpy.concatenate(q3_res), numpy.concatenate(q1_res), numpy.concatenate(key_res)
+
+def _calculate_series_matrix(sequences, isotopically_modified, R, RN15, series, encoder):
+    codes, lengths = encoder.encode_matrix(sequences)
+
+    # Look up the residue masses, N15 labelled peptides use a different table
+    isotope_mod = numpy.array(isotopically_modified)
+    is_n15 = isotope_mod == Residues.N15_ISOTOPEMODIFICATION
+    if not numpy.all(is_n15 | (isotope_mod == Residues.NOISOTOPEMODIFICATION)):
+        raise ValueError("Unknown isotopic modification")
+    masses = encoder.mass_table(R)[codes]
+    if is_n15.any():
+        masses[is_n15] = encoder.mass_table(RN15)[codes[is_n15]]
+    masses[numpy.arange(codes.shape[1])[None, :] >= lengths[:, None]] = 0.0
+
+    return calculate_fragment_series(masses, lengths, series, R)
+
+def calculate_uncharged_series(sequences, isotopically_modified, R, RN15, series):
+    """Calculate the uncharged fragment series (DDB.Peptide.allseries) of
+    the given modified sequences.
+
+    Returns a list with one array of fragment masses per sequence.
+    """
+    result = []
+    encoder = ResidueEncoder()
+    for start in range(0, len(sequences), DEFAULT_BATCHSIZE):
+        allseries, valid = _calculate_series_matrix(sequences[start:start+DEFAULT_BATCHSIZE],
+            isotopically_modified[start:start+DEFAULT_BATCHSIZE], R, RN15, series, encoder)
+        result.extend([row[v] for row, v in zip(allseries, valid)])
+    return result
+
+def _calculate_fragment_masses_batch(precursors, R, RN15, q3_low, q3_high,
+    forceFragmentChargeCheck, series, charges, encoder):
+
+    fields = [precursor_fields(c) for c in precursors]
+    q1s = numpy.asarray([f[0] for f in fields])
+    keys = numpy.asarray([f[2] for f in fields])
+    sequences = [f[1] for f in fields]
+    allseries, valid = _calculate_series_matrix(sequences, [f[3] for f in fields],
+        R, RN15, series, encoder)
+
+    # For each charge state, compute the charged masses and check the ranges.
+    # The result is ordered by precursor, then charge, then fragment.
+    nr_charges = len(charges)
+    charged = numpy.empty( (len(fields), nr_charges, allseries.shape[1]) )
+    keep = numpy.empty( charged.shape, dtype=bool)
+    if forceFragmentChargeCheck:
+        singly_only = numpy.array([_maximal_charge(s) == 2 for s in sequences], dtype=bool)
+    for i, ch in enumerate(charges):
+        q3 = ( allseries + (ch -1)*R.mass_H)/ch
+        charged[:, i, :] = q3
+        keep[:, i, :] = valid & (q3 >= q3_low) & (q3 <= q3_high)
+        if forceFragmentChargeCheck and ch != 1:
+            keep[singly_only, i, :] = False
+
+    row_index = numpy.nonzero(keep)[0]
+    return charged[keep], q1s[row_index], keys[row_index]
+
+def calculate_transitions_ch(peptides, charges, q3_low, q3_high, R):
+    """Batched version of collider._calculate_transitions_ch, peptides are
+    tuples of the form (q1, sequence, peptide_key).
+
+    Returns the three columns (q3, q1, peptide_key) as numpy arrays.
+    """
+    precursors = [ (p[0], p[1], p[2], 0, Residues.NOISOTOPEMODIFICATION) for p in peptides]
+    encoder = ResidueEncoder()
+    q3_res = []
+    q1_res = []
+    key_res = []
+    for start in range(0, len(precursors), DEFAULT_BATCHSIZE):
+        # each charge state lists first the y then the b series
+        q3, q1, key = _calculate_fragment_masses_batch(precursors[start:start+DEFAULT_BATCHSIZE],
+            R, None, q3_low, q3_high, False, ('y', 'b'), charges, encoder)
+        q3_res.append(q3)
+        q1_res.append(q1)
+        key_res.append(key)
+    if len(q3_res) == 0:
+        return numpy.zeros(0), numpy.zeros(0), numpy.zeros(0, dtype=numpy.int64)
+    return numpy.concatenate(q3_res), numpy.concatenate(q1_res), numpy.concatenate(key_res)
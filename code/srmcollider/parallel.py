@@ -0,0 +1,140 @@
+"""
+ *
+ * Program       : SRMCollider
+ * Author        : Hannes Roest <roest@imsb.biol.ethz.ch>
+ * Date          : 05.02.2011
+ *
+ *
+ * Copyright (C) 2011 - 2012 Hannes Roest
+ *
+ * This library is free software; you can redistribute it and/or
+ * modify it under the terms of the GNU Lesser General Public
+ * License as published by the Free Software Foundation; either
+ * version 2.1 of the License, or (at your option) any later version.
+ *
+ * This library is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+ * Lesser General Public License for more details.
+ *
+ * You should have received a copy of the GNU Lesser General Public
+ * License along with this library; if not, write to the Free Software
+ * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307, USA
+ *
+"""
+
+"""
+Helper functions to distribute the evaluation of many precursors over
+several processes.
+
+The worker processes are forked after all the expensive data structures (the
+background precursors, the rangetree) have been built, thus they are shared
+copy-on-write and never need to be pickled. Only the ranges of items to
+process are sent to the workers and only the (small) results are sent back.
+The results are returned in the order of the ranges, so merging them gives
+exactly the same result as a serial run.
+"""
+
+import os
+import multiprocessing
+import profiling
+
+# The function to call in the worker processes and the progress meter. They
+# are set before the workers are forked and thus inherited by them.
+_worker_function = None
+_worker_progressm = None
+
+def _run_range(r):
+    if not profiling.enabled:
+        return _run_range_progress(r), None
+    # only send the measurements of this range (not the ones inherited from
+    # the parent process) back
+    profiling.take_profile()
+    result = _run_range_progress(r)
+    return result, profiling.take_profile()
+
+def _run_range_progress(r):
+    progressm = _worker_progressm
+    if progressm is None:
+        return _worker_function(r[0], r[1])
+    if not progressm._worker: progressm.start_worker()
+    reported = progressm.worker_count
+    result = _worker_function(r[0], r[1])
+    # count the items that the function did not report itself
+    missing = (r[1] - r[0]) - (progressm.worker_count - reported)
+    if missing > 0: progressm.update(missing)
+    progressm.flush()
+    return result
+
+def get_ranges(nr_items, nr_chunks):
+    """Split range(nr_items) into (at most) nr_chunks consecutive ranges of
+    similar size"""
+    nr_chunks = max(1, min(nr_chunks, nr_items))
+    ranges = []
+    for i in range(nr_chunks):
+        start = nr_items * i / nr_chunks
+        end = nr_items * (i+1) / nr_chunks
+        if end > start: ranges.append( (start, end) )
+    return ranges
+
+def map_ranges(function, nr_items, processes, chunks_per_process=16, progressm=None):
+    """Call function(start, end) on consecutive ranges covering all items.
+
+    If processes is larger than one, the ranges are processed on a pool of
+    forked processes. The results are returned as a list in the order of the
+    ranges. If a ProgressMeter is given, the updates of function in the
+    workers are sent to it (see ProgressMeter.share), items that function did
+    not report are counted when their range is finished. If profiling is
+    enabled, the measurements of the workers are added to the ones of this
+    process.
+    """
+    global _worker_function, _worker_progressm
+    if processes <= 1:
+        return [function(0, nr_items)]
+
+    ranges = get_ranges(nr_items, processes * chunks_per_process)
+    _worker_function = function
+    _worker_progressm = progressm
+    if progressm is not None: progressm.share()
+    pool = multiprocessing.Pool(processes)
+    try:
+        results = []
+        it = pool.imap(_run_range, ranges)
+        for r in ranges:
+            # wake up regularly to show the progress of the workers
+            while True:
+                try:
+                    if progressm is None: res, profile = it.next()
+                    else: res, profile = it.next(timeout=progressm.rate_refresh)
+                    break
+                except multiprocessing.TimeoutError:
+                    progressm.poll()
+            results.append(res)
+            if profile is not None: profiling.merge(profile)
+            if progressm is not None: progressm.poll()
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+        _worker_function = None
+        _worker_progressm = None
+    return results
+
+class PerProcess(object):
+    """Lazily creates an object once per process, e.g. a database connection
+    which cannot be shared between forked processes."""
+
+    def __init__(self, factory, initial=None):
+        self.factory = factory
+        self.pid = None
+        self.obj = initial
+        # the initial object belongs to the current process
+        if initial is not None: self.pid = os.getpid()
+
+    def get(self):
+        if self.pid != os.getpid():
+            self.obj = self.factory()
+            self.pid = os.getpid()
+        return self.obj
@@ -1,8 +1,23 @@
+from array import array
 import Residues
 import DDB
+import backends
+import profiling
 
-R = Residues.Residues('mono')
-class Precursor:
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# number of rows fetched from the database at once
+FETCH_BATCHSIZE = 10000
+
+R = Residues.get_residues('mono')
+class Precursor(object):
+
+  __slots__ = ('modified_sequence', 'transition_group', 'parent_id',
+               'q1_charge', 'q1', 'ssrcalc', 'modifications',
+               'missed_cleavages', 'isotopically_modified')
 
   def __init__(self,
       modified_sequence     = None,
@@ -25,6 +40,13 @@ class Precursor:
     self.missed_cleavages       = missed_cleavages       
     self.isotopically_modified  = isotopically_modified  
 
+  def __getstate__(self):
+      return tuple([getattr(self, attr) for attr in self.__slots__])
+
+  def __setstate__(self, state):
+      for attr, value in zip(self.__slots__, state):
+          setattr(self, attr, value)
+
   def get_tr(self):
       return self.transition_group
 
@@ -45,21 +67,21 @@ class Precursor:
     self.missed_cleavages       = missed_cleavages       
     self.isotopically_modified  = isotopically_modified  
 
-  def calculate_transitions(self, q3_low, q3_high, charges=[1]):
-    import c_getnonuis
-    transitions = c_getnonuis.calculate_transitions_ch(
+  @profiling.profiled('transitions')
+  def calculate_transitions(self, q3_low, q3_high, charges=[1], par=None):
+    transitions = backends.get_backends(par).get('transitions')(
         ((self.q1, self.modified_sequence, self.parent_id),), charges, q3_low, q3_high)
+    profiling.observe('transitions_per_precursor', len(transitions))
     # fake some srm_id for the transitions, so that the returned transitions will be tuples of (q1, id)
     return tuple([ (t[0], i) for i,t in enumerate(transitions)])
 
   def calculate_transitions_from_param(self, par, charges=[1]):
     q3_low, q3_high = par.get_q3range_transitions()
-    return self.calculate_transitions(q3_low, q3_high)
+    return self.calculate_transitions(q3_low, q3_high, par=par)
 
   def included_in_isotopic_range(self, range_low, range_high, par):
-    for iso in range(par.isotopes_up_to+1):
-      if (self.q1 + (R.mass_diffC13 * iso)/self.q1_charge > range_low and 
-          self.q1 + (R.mass_diffC13 * iso)/self.q1_charge < range_high): return True
+    if included_in_isotopic_range(self.q1, self.q1_charge, range_low, range_high, par):
+      return True
 
   def __repr__(self):
       return "Precursor object '%s': %s with transition_gr %s and parent_id %s" % (self.modified_sequence, self.q1, self.transition_group, self.parent_id)
@@ -83,35 +105,273 @@ class Precursor:
   def fix_mprophet_sequence_bug(self):
     self.modified_sequence = self.modified_sequence.replace('[C160]', 'C[160]').replace('C[+57]', 'C[160]')
 
+def included_in_isotopic_range(q1, q1_charge, range_low, range_high, par):
+  """Check whether any isotope of a precursor lies within the given range"""
+  for iso in range(par.isotopes_up_to+1):
+    if (q1 + (R.mass_diffC13 * iso)/q1_charge > range_low and 
+        q1 + (R.mass_diffC13 * iso)/q1_charge < range_high): return True
+  return False
+
+class PrecursorTable(object):
+  """A compact, column-oriented container of precursors.
+
+  Each attribute of the Precursor class is stored in its own array and all
+  sequences are packed into a single character buffer. Precursor objects are
+  only created when they are accessed (by index or when iterating), thus the
+  table uses a fraction of the memory of a list of Precursor objects.
+  Changes to these objects are not stored back in the table.
+
+  A table can also be created from numpy arrays (e.g. memory-mapped from a
+  file, see from_arrays), such a table is read-only.
+  """
+
+  _columns = ('transition_group', 'parent_id', 'q1_charge', 'q1', 'ssrcalc',
+              'modifications', 'missed_cleavages', 'isotopically_modified',
+              'sequence_offset')
+
+  def __init__(self):
+    self.transition_group       = array('l')
+    self.parent_id              = array('l')
+    self.q1_charge              = array('i')
+    self.q1                     = array('d')
+    self.ssrcalc                = array('d')
+    self.modifications          = array('i')
+    self.missed_cleavages       = array('i')
+    self.isotopically_modified  = array('i')
+    self.sequence_data          = array('c')
+    self.sequence_offset        = array('l', [0])
+
+  def append_row(self, row):
+    """Append a precursor given as a row (in the order of Precursor.initialize)"""
+    (modified_sequence, transition_group, parent_id, q1_charge, q1, ssrcalc,
+      modifications, missed_cleavages, isotopically_modified) = row
+    if isinstance(modified_sequence, unicode):
+        modified_sequence = modified_sequence.encode("utf8")
+    self.sequence_data.fromstring(modified_sequence)
+    self.sequence_offset.append(len(self.sequence_data))
+    self.transition_group.append(transition_group)
+    self.parent_id.append(parent_id)
+    self.q1_charge.append(q1_charge)
+    self.q1.append(q1)
+    self.ssrcalc.append(ssrcalc)
+    self.modifications.append(modifications)
+    self.missed_cleavages.append(missed_cleavages)
+    self.isotopically_modified.append(isotopically_modified)
+
+  def append(self, p):
+    """Append a Precursor object"""
+    self.append_row( (p.modified_sequence, p.transition_group, p.parent_id,
+      p.q1_charge, p.q1, p.ssrcalc, p.modifications, p.missed_cleavages,
+      p.isotopically_modified) )
+
+  def get_sequence(self, i):
+    return self.sequence_data[self.sequence_offset[i]:self.sequence_offset[i+1]].tostring()
+
+  def __len__(self):
+    return len(self.q1)
+
+  def __getitem__(self, i):
+    if i < 0: i += len(self)
+    if i < 0 or i >= len(self): raise IndexError("PrecursorTable index out of range")
+    # convert numpy scalars (from a table created by from_arrays)
+    return Precursor(
+      modified_sequence     = self.get_sequence(i),
+      transition_group      = int(self.transition_group[i]),
+      parent_id             = int(self.parent_id[i]),
+      q1_charge             = int(self.q1_charge[i]),
+      q1                    = float(self.q1[i]),
+      ssrcalc               = float(self.ssrcalc[i]),
+      modifications         = int(self.modifications[i]),
+      missed_cleavages      = int(self.missed_cleavages[i]),
+      isotopically_modified = int(self.isotopically_modified[i]))
+
+  def __iter__(self):
+    for i in xrange(len(self)):
+      yield self[i]
+
+  def get_column(self, column):
+    """Return a column as numpy array that shares the memory of the table.
+
+    The array is only valid until the next precursor is appended (the
+    underlying buffer may be reallocated), thus do not keep it around.
+    Without numpy, the column itself is returned.
+    """
+    data = getattr(self, column)
+    if numpy is None or isinstance(data, numpy.ndarray): return data
+    if len(data) == 0: return numpy.zeros(0, dtype=data.typecode)
+    return numpy.frombuffer(data, dtype=data.typecode)
+
+  def get_arrays(self):
+    """Return all data of the table as a dictionary of numpy arrays (see
+    from_arrays)"""
+    arrays = dict([ (c, self.get_column(c)) for c in self._columns])
+    if isinstance(self.sequence_data, numpy.ndarray) or len(self.sequence_data) == 0:
+      arrays['sequence_data'] = numpy.asarray(self.sequence_data, dtype='S1')
+    else:
+      arrays['sequence_data'] = numpy.frombuffer(self.sequence_data, dtype='S1')
+    return arrays
+
+  @staticmethod
+  def from_arrays(arrays):
+    """Create a read-only table from the arrays returned by get_arrays.
+    The arrays are used as they are (e.g. memory-mapped) and are not copied."""
+    table = PrecursorTable()
+    for c in PrecursorTable._columns + ('sequence_data',):
+      setattr(table, c, arrays[c])
+    return table
+
+  def get_sequences(self):
+    """Return a list of all modified sequences"""
+    data = self.sequence_data.tostring()
+    o = self.sequence_offset
+    return [data[o[i]:o[i+1]] for i in xrange(len(self))]
+
+  def get_rangetree_tuples(self):
+    """Return the tuples for Precursors.build_rangetree without creating
+    Precursor objects"""
+    n = len(self)
+    return tuple(zip([0]*n, [0]*n, self.parent_id, self.q1_charge,
+                     self.q1, self.ssrcalc))
+
+  def get_extended_rangetree_tuples(self):
+    """Return the tuples for Precursors.build_extended_rangetree without
+    creating Precursor objects"""
+    n = len(self)
+    return tuple(zip(self.get_sequences(), self.transition_group,
+                     self.parent_id, self.q1_charge, self.q1, self.ssrcalc,
+                     [0]*n, [0]*n, self.isotopically_modified))
+
+  def index_by(self, column):
+    """Return a mapping from the values of a column (e.g. parent_id) to the
+    precursors. If a value occurs more than once, the last precursor wins."""
+    if numpy is not None:
+      return _SortedPrecursorTableLookup(self, self.get_column(column))
+    return _PrecursorTableLookup(self, dict([ (v, i) for i, v in enumerate(getattr(self, column))]))
+
+class _PrecursorTableLookup(object):
+
+  def __init__(self, table, rows):
+    self.table = table
+    self.rows = rows
+
+  def __getitem__(self, key):
+    return self.table[self.rows[key]]
+
+  def __contains__(self, key):
+    return key in self.rows
+
+  def __len__(self):
+    return len(self.rows)
+
+class _SortedPrecursorTableLookup(object):
+  """Lookup of precursors by the value of a column using binary search in a
+  sorted copy of the column (needs much less memory than a dictionary)"""
+
+  def __init__(self, table, values, order=None):
+    self.table = table
+    # a stable sort keeps equal values in table order
+    if order is None: order = numpy.argsort(values, kind='mergesort')
+    self.order = order
+    self.keys = values[self.order]
+
+  def _find(self, key):
+    pos = numpy.searchsorted(self.keys, key, side='right') - 1
+    if pos < 0 or self.keys[pos] != key: return None
+    return int(self.order[pos])
+
+  def __getitem__(self, key):
+    row = self._find(key)
+    if row is None: raise KeyError(key)
+    return self.table[row]
+
+  def __contains__(self, key):
+    return self._find(key) is not None
+
+  def __len__(self):
+    return len(numpy.unique(self.keys))
+
 class PrecursorAccess:
   """A class that abstracts getting and receiving precursors from the db"""
 
   def __init__(self):
     self.precursors = []
-
+    # the last rangetree built by build_rangetree and its precursors
+    self._rangetree = None
+    self._rangetree_precursors = None
+    # the position of each parent_id in self.precursors (see _get_positions)
+    self._positions = None
+    self._positions_precursors = None
+
+  @profiling.profiled('db_fetch')
   def getFromDB(self, par, cursor, lower_q1, upper_q1):
     # Get all precursors from the DB within a window of Q1
-    self.precursors = []
-    for table in par.peptide_tables:
-        isotope_correction = par.isotopes_up_to * R.mass_diffC13 / min(par.parent_charges)
-        q =  """
-        select modified_sequence, transition_group, parent_id, q1_charge, q1, ssrcalc, modifications, missed_cleavages, isotopically_modified
-        from %(peptide_table)s where q1 between %(lowq1)s - %(isotope_correction)s and %(highq1)s
-        %(query_add)s
-        """ % {'peptide_table' : table,
-                      'lowq1'  : lower_q1,  # min_q1 - par.q1_window
-                      'highq1' : upper_q1, # max_q1 + par.q1_window,
-                      'isotope_correction' : isotope_correction,
-                      'query_add' : par.query2_add
-        } 
-        #print "Selecting peptides from the background table %s using the query:" % table, q
-        cursor.execute(q)
-        for res in cursor.fetchall():
-          p = Precursor()
-          p.initialize(*res)
-          # Only include those precursors that are actually have isotopes in the specified range
-          if(p.included_in_isotopic_range(lower_q1, upper_q1, par) ): 
-            self.precursors.append(p)
+    self.precursors = PrecursorTable()
+    if par.precursor_index:
+        # use the on-disk precursor index instead of the database
+        import precursor_index
+        for row in precursor_index.get_rows_in_range(par, lower_q1, upper_q1):
+          self.precursors.append_row(row)
+        return
+    streaming = _get_streaming_cursor(cursor)
+    try:
+      for table in par.peptide_tables:
+          isotope_correction = par.isotopes_up_to * R.mass_diffC13 / min(par.parent_charges)
+          q =  """
+          select modified_sequence, transition_group, parent_id, q1_charge, q1, ssrcalc, modifications, missed_cleavages, isotopically_modified
+          from %(peptide_table)s where q1 between %(lowq1)s - %(isotope_correction)s and %(highq1)s
+          %(query_add)s
+          """ % {'peptide_table' : table,
+                        'lowq1'  : lower_q1,  # min_q1 - par.q1_window
+                        'highq1' : upper_q1, # max_q1 + par.q1_window,
+                        'isotope_correction' : isotope_correction,
+                        'query_add' : par.query2_add
+          } 
+          #print "Selecting peptides from the background table %s using the query:" % table, q
+          streaming.execute(q)
+          # Fetch the rows in batches and only keep those precursors that
+          # actually have isotopes in the specified range
+          while True:
+            rows = streaming.fetchmany(FETCH_BATCHSIZE)
+            if not rows: break
+            for res in rows:
+              if included_in_isotopic_range(res[4], res[3], lower_q1, upper_q1, par):
+                self.precursors.append_row(res)
+    finally:
+      # a server-side cursor has to be closed before the connection can be
+      # used again, the cursor of the caller is left open
+      if streaming is not cursor: streaming.close()
+
+  def getFromDB_with_rangetree(self, par, cursor, lower_q1, upper_q1,
+    extended=False, GRAVY=False):
+    """Get all precursors from the DB within a window of Q1 (see getFromDB),
+    optionally replace their retention times by GRAVY scores and build the
+    rangetree (or the extended rangetree) as well as the parent_id and
+    transition_group lookups. Returns the rangetree.
+
+    If par.rangetree_cache is set, all of this is stored in a file in this
+    directory and memory-mapped again in the next run with the same
+    background (see rangetree_cache.py).
+    """
+    use_cache = par.rangetree_cache and numpy is not None
+    if use_cache:
+      import rangetree_cache
+      fingerprint = rangetree_cache.get_fingerprint(par, cursor, lower_q1, upper_q1,
+                                                    'GRAVY' if GRAVY else '')
+      filename = rangetree_cache.get_filename(par.rangetree_cache, fingerprint)
+      with profiling.timer('rangetree_cache'):
+        rtree = rangetree_cache.load_precursors(filename, fingerprint, self, extended)
+      if rtree is not None: return rtree
+
+    self.getFromDB(par, cursor, lower_q1, upper_q1)
+    if GRAVY: self.use_GRAVY_scores()
+    if extended: rtree = self.build_extended_rangetree()
+    else: rtree = self.build_rangetree()
+    self.build_parent_id_lookup()
+    self.build_transition_group_lookup()
+    if use_cache:
+      with profiling.timer('rangetree_cache'):
+        rangetree_cache.save_precursors(filename, fingerprint, self, rtree)
+    return rtree
 
   def getPrecursorsToEvaluate(self, min_q1, max_q1):
     """
@@ -120,6 +380,23 @@ class PrecursorAccess:
     max/min range.
     """
     print "Selecting query peptides: 2+ charged, no mods / MC and between %s - %s Da." % (min_q1, max_q1)
+    if isinstance(self.precursors, PrecursorTable):
+      # only create the Precursor objects that are selected
+      t = self.precursors
+      if numpy is not None:
+        selected = numpy.flatnonzero((t.get_column('q1_charge') == 2) 
+                      & (t.get_column('modifications') == 0)
+                      & (t.get_column('missed_cleavages') == 0)
+                      & (t.get_column('q1') >= min_q1)
+                      & (t.get_column('q1') <= max_q1))
+        return [t[int(i)] for i in selected]
+      return [t[i] for i in xrange(len(t))
+                       if t.q1_charge[i] == 2 
+                       and t.modifications[i] == 0
+                       and t.missed_cleavages[i] == 0 
+                       and t.q1[i] >= min_q1
+                       and t.q1[i] <= max_q1
+                       ]
     return [p for p in self.precursors 
                        if p.q1_charge == 2 
                        and p.modifications == 0
@@ -129,17 +406,37 @@ class PrecursorAccess:
                        ]
 
   def build_parent_id_lookup(self):
+    if isinstance(self.precursors, PrecursorTable):
+      self.parentid_lookup = self.precursors.index_by('parent_id')
+      return
     self.parentid_lookup = dict([ [ p.parent_id, p] for p in self.precursors])
 
   def lookup_by_parent_id(self, parent_id):
     return self.parentid_lookup[parent_id]
 
+  def _get_positions(self):
+    """Return a mapping from parent_id to the position in self.precursors,
+    it is only built once for the current precursors"""
+    if self._positions is None or self._positions_precursors is not self.precursors \
+       or len(self._positions) != len(self.precursors):
+      if isinstance(self.precursors, PrecursorTable):
+        parent_ids = self.precursors.get_column('parent_id')
+      else:
+        parent_ids = [p.parent_id for p in self.precursors]
+      self._positions = dict([ (parent_id, i) for i, parent_id in enumerate(parent_ids)])
+      self._positions_precursors = self.precursors
+    return self._positions
+
   def build_transition_group_lookup(self):
+    if isinstance(self.precursors, PrecursorTable):
+      self.transition_group_lookup = self.precursors.index_by('transition_group')
+      return
     self.transition_group_lookup = dict([ [ p.transition_group, p] for p in self.precursors])
 
   def lookup_by_transition_group(self, transition_group):
     return self.transition_group_lookup[transition_group]
 
+  @profiling.profiled('rangetree_build')
   def build_rangetree(self):
     """
     * The tuples have the following structure:
@@ -152,12 +449,28 @@ class PrecursorAccess:
 
     This is useful for most cases
     """
-    import c_rangetree
-    alltuples = [ (0,0, p.parent_id, p.q1_charge, p.q1, p.ssrcalc) for p in self.precursors]
-    r = c_rangetree.Rangetree_Q1_RT.create()
-    r.create_tree(tuple(alltuples))
+    r = backends.get_backends().get('rangetree')()
+    if hasattr(r, 'create_tree_from_columns'):
+      # the rangetree of rangetree.py can be fed directly from the columns
+      if isinstance(self.precursors, PrecursorTable):
+        t = self.precursors
+        r.create_tree_from_columns(t.get_column('parent_id'), t.get_column('q1_charge'),
+          t.get_column('q1'), t.get_column('ssrcalc'), t.get_column('transition_group'))
+      else:
+        r.create_tree_from_columns([p.parent_id for p in self.precursors],
+          [p.q1_charge for p in self.precursors], [p.q1 for p in self.precursors],
+          [p.ssrcalc for p in self.precursors], [p.transition_group for p in self.precursors])
+      self._rangetree = r
+      self._rangetree_precursors = self.precursors
+      return r
+    if isinstance(self.precursors, PrecursorTable):
+      alltuples = self.precursors.get_rangetree_tuples()
+    else:
+      alltuples = tuple([ (0,0, p.parent_id, p.q1_charge, p.q1, p.ssrcalc) for p in self.precursors])
+    r.create_tree(alltuples)
     return r
 
+  @profiling.profiled('rangetree_build')
   def build_extended_rangetree(self):
     """
     * The tuples have the following structure:
@@ -171,19 +484,26 @@ class PrecursorAccess:
     *   7 
     *   8 isotopically modified
 
-    This is useful for the integrated run, see run_integrated.py
+    This is useful for the integrated run, see run_integrated.py (which
+    needs the tree of the cpp backend).
     """
-    import c_rangetree
     alltuples = self.get_alltuples_extended_rangetree()
-    r = c_rangetree.ExtendedRangetree_Q1_RT.create()
+    r = backends.get_backends().get('rangetree')(extended=True)
     r.create_tree(tuple(alltuples))
     return r
 
   def get_alltuples_extended_rangetree(self):
+    if isinstance(self.precursors, PrecursorTable):
+      return self.precursors.get_extended_rangetree_tuples()
     return tuple([ (p.modified_sequence, p.transition_group, p.parent_id, p.q1_charge, p.q1, p.ssrcalc,0,0,p.isotopically_modified) 
                  for p in self.precursors])
 
   def use_GRAVY_scores(self):
+    if isinstance(self.precursors, PrecursorTable):
+      # the precursor objects are only views, store the scores in the table
+      for i, p in enumerate(self.precursors):
+        self.precursors.ssrcalc[i] = p.to_peptide().get_GRAVY()
+      return
     for p in self.precursors:
         p.ssrcalc = p.to_peptide().get_GRAVY()
 
@@ -192,28 +512,85 @@ class PrecursorAccess:
     """Get the collisions per peptide, e.g. a dictionary that contains the
     interfered transitions for a given precursor with given transitions.
     """
-    import c_rangetree
-    import c_getnonuis
-    q3_low, q3_high = par.get_q3range_transitions()
+    neighbours = self.query_rangetree_batch([precursor], par, rtree, q1_low, q1_high)
+    return self.get_collisions_per_peptide_from_neighbours(precursor, transitions,
+        par, neighbours, 0, forceFragmentChargeCheck)
+
+  @profiling.profiled('rangetree_query')
+  def query_rangetree_batch(self, precursors, par, rtree, q1_low=None, q1_high=None):
+    """Find the interfering precursors of many precursors at once.
+
+    The Q1 window is precursor.q1 +/- par.q1_window unless q1_low and q1_high
+    are given (e.g. a fixed SWATH window). The precursors themselves (their
+    transition group) are excluded. Returns a compressed sparse row structure
+    (offsets, indices): the interfering precursors of precursors[k] are
+    self.precursors[i] for i in indices[offsets[k]:offsets[k+1]], see
+    get_neighbours.
+    """
+    if q1_low is None:
+      q1_low = [p.q1 - par.q1_window for p in precursors]
+      q1_high = [p.q1 + par.q1_window for p in precursors]
+    elif not hasattr(q1_low, '__len__'):
+      q1_low, q1_high = [q1_low] * len(precursors), [q1_high] * len(precursors)
     #correct rounding errors, s.t. we get the same results as before!
-    ssrcalc_low  = precursor.ssrcalc - par.ssrcalc_window + 0.001
-    ssrcalc_high = precursor.ssrcalc + par.ssrcalc_window - 0.001
+    ssrcalc_low  = [p.ssrcalc - par.ssrcalc_window + 0.001 for p in precursors]
+    ssrcalc_high = [p.ssrcalc + par.ssrcalc_window - 0.001 for p in precursors]
+    transition_groups = [p.transition_group for p in precursors]
     isotope_correction = par.isotopes_up_to * R.mass_diffC13 / min(par.parent_charges)
 
-    # Get the precursor ids of the interfering precursors from the rangetree
-    precursor_ids = rtree.query_tree(
-        q1_low, #precursor.q1 - par.q1_window,
-        ssrcalc_low, 
-        q1_high, #precursor.q1 + par.q1_window,
-        ssrcalc_high,
-        par.isotopes_up_to, isotope_correction)  
-
-    # Now deselect the myself (the precursor passed as argument) and reformat
-    globalprecursors = [self.lookup_by_parent_id(myid[0]) for myid in precursor_ids
-      #dont select myself 
-      if self.lookup_by_parent_id(myid[0]).transition_group != precursor.transition_group]
-
-    return c_getnonuis.calculate_collisions_per_peptide_other_ion_series( 
-        transitions, globalprecursors, par, q3_low, q3_high, par.q3_window, par.ppm, forceFragmentChargeCheck)
+    if rtree is self._rangetree and self.precursors is self._rangetree_precursors:
+      offsets, indices = rtree.query_batch(q1_low, ssrcalc_low, q1_high, ssrcalc_high,
+        par.isotopes_up_to, isotope_correction, transition_groups)
+    else:
+      # Other rangetrees (e.g. c_rangetree) only return the parent_ids of the
+      # precursors, thus query them one by one and look up the parent_ids
+      positions = self._get_positions()
+      offsets = [0]
+      indices = []
+      for k in range(len(precursors)):
+        for myid in rtree.query_tree(q1_low[k], ssrcalc_low[k], q1_high[k],
+            ssrcalc_high[k], par.isotopes_up_to, isotope_correction):
+          i = positions[myid[0]]
+          #dont select myself 
+          if self.precursors[i].transition_group != transition_groups[k]:
+            indices.append(i)
+        offsets.append(len(indices))
+    if profiling.enabled:
+      for k in range(len(precursors)):
+        profiling.observe('background_size', offsets[k+1] - offsets[k])
+    return offsets, indices
+
+  def get_neighbours(self, neighbours, k):
+    """Return the interfering precursors of query k from the result of
+    query_rangetree_batch"""
+    offsets, indices = neighbours
+    return [self.precursors[i] for i in indices[offsets[k]:offsets[k+1]]]
+
+  @profiling.profiled('collisions')
+  def get_collisions_per_peptide_from_neighbours(self, precursor, transitions,
+    par, neighbours, k, forceFragmentChargeCheck=False):
+    """Get the collisions per peptide of query k of the result of
+    query_rangetree_batch"""
+    q3_low, q3_high = par.get_q3range_transitions()
+    collisions_per_peptide = backends.get_backends(par).get('collisions_per_peptide')(
+        transitions, self.get_neighbours(neighbours, k), par, q3_low,
+        q3_high, forceFragmentChargeCheck)
+    profiling.observe('collisions_per_query', len(collisions_per_peptide))
+    return collisions_per_peptide
+
+def _get_streaming_cursor(cursor):
+  """Return a cursor that does not keep the whole result set in memory.
+
+  MySQLdb stores the complete result on the client unless a server-side
+  cursor is used, sqlite cursors fetch the rows on demand anyway.
+  """
+  try:
+    import MySQLdb.cursors
+  except ImportError:
+    return cursor
+  if isinstance(cursor, MySQLdb.cursors.BaseCursor) and not isinstance(
+    cursor, MySQLdb.cursors.SSCursor):
+    return cursor.connection.cursor(MySQLdb.cursors.SSCursor)
+  return cursor
 
 Precursors = PrecursorAccess
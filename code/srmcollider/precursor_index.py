@@ -0,0 +1,309 @@
+"""
+ *
+ * Program       : SRMCollider
+ * Author        : Hannes Roest <roest@imsb.biol.ethz.ch>
+ * Date          : 05.02.2011
+ *
+ *
+ * Copyright (C) 2011 - 2012 Hannes Roest
+ *
+ * This library is free software; you can redistribute it and/or
+ * modify it under the terms of the GNU Lesser General Public
+ * License as published by the Free Software Foundation; either
+ * version 2.1 of the License, or (at your option) any later version.
+ *
+ * This library is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+ * Lesser General Public License for more details.
+ *
+ * You should have received a copy of the GNU Lesser General Public
+ * License along with this library; if not, write to the Free Software
+ * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307, USA
+ *
+"""
+
+"""
+A persistent, memory-mappable index of precursors sorted by Q1.
+
+The index is built once from one or more peptide tables (see
+scripts/misc/build_precursor_index.py) and can then be queried with a binary
+search on Q1 instead of sending an SQL query to the database for every query
+peptide. It is used by SRMcollider._get_all_precursors and
+PrecursorAccess.getFromDB if par.precursor_index is set.
+
+File layout (all little endian):
+
+    header: magic (8 bytes), version (uint32), padding (uint32),
+            number of precursors N (uint64), length of sequence data (uint64)
+    columns, each N entries (except seq_offset with N+1 entries):
+        q1 (float64), ssrcalc (float64), transition_group (int64),
+        parent_id (int64), seq_offset (int64), q1_charge (int32),
+        modifications (int32), missed_cleavages (int32),
+        isotopically_modified (int32)
+    sequence data: all modified sequences concatenated (ascii)
+
+The rows are sorted by Q1 (ties are broken by parent_id).
+"""
+
+import os
+import struct
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import Residues
+from precursor import Precursor
+
+MAGIC = 'SRMPIDX\0'
+VERSION = 1
+_header = struct.Struct('<8sIIQQ')
+
+# name, dtype and whether the column has an additional entry (seq_offset)
+COLUMNS = [
+    ('q1',                    '<f8', False),
+    ('ssrcalc',               '<f8', False),
+    ('transition_group',      '<i8', False),
+    ('parent_id',             '<i8', False),
+    ('seq_offset',            '<i8', True),
+    ('q1_charge',             '<i4', False),
+    ('modifications',         '<i4', False),
+    ('missed_cleavages',      '<i4', False),
+    ('isotopically_modified', '<i4', False),
+]
+
+# The columns selected from the peptide tables, this is the same order that
+# Precursor.initialize expects.
+PRECURSOR_VALUES = "modified_sequence, transition_group, parent_id, q1_charge, q1, ssrcalc, modifications, missed_cleavages, isotopically_modified"
+
+class PrecursorIndexError(Exception):
+    pass
+
+def _prepare_columns(rows):
+    # sort the rows by q1 and split them into the columns of the index
+    rows = sorted(rows, key=lambda r: (r[4], r[2]))
+    sequences = []
+    for r in rows:
+        if isinstance(r[0], unicode): sequences.append(r[0].encode("utf8"))
+        else: sequences.append(r[0])
+    offsets = numpy.zeros(len(rows) + 1, dtype='<i8')
+    offsets[1:] = numpy.cumsum([len(s) for s in sequences])
+    data = {
+        'q1'                    : [r[4] for r in rows],
+        'ssrcalc'               : [r[5] for r in rows],
+        'transition_group'      : [r[1] for r in rows],
+        'parent_id'             : [r[2] for r in rows],
+        'seq_offset'            : offsets,
+        'q1_charge'             : [r[3] for r in rows],
+        'modifications'         : [r[6] for r in rows],
+        'missed_cleavages'      : [r[7] for r in rows],
+        'isotopically_modified' : [r[8] for r in rows],
+    }
+    return data, ''.join(sequences)
+
+def write_index(filename, rows):
+    """Write a precursor index file.
+
+    The rows are tuples in the order of PRECURSOR_VALUES, e.g. as they are
+    returned from the peptide tables. Returns the number of precursors written.
+    """
+    data, seqdata = _prepare_columns(rows)
+    nrows = len(data['q1'])
+
+    tmpfile = filename + '.tmp'
+    f = open(tmpfile, 'wb')
+    f.write(_header.pack(MAGIC, VERSION, 0, nrows, len(seqdata)))
+    for name, dtype, extra in COLUMNS:
+        numpy.asarray(data[name], dtype=dtype).tofile(f)
+    f.write(seqdata)
+    f.close()
+    # only replace an existing index once the new one is complete
+    os.rename(tmpfile, filename)
+    return nrows
+
+def build_index_from_db(filename, cursor, peptide_tables):
+    """Build a precursor index from one or more peptide tables"""
+    rows = []
+    for table in peptide_tables:
+        cursor.execute("select %s from %s" % (PRECURSOR_VALUES, table))
+        rows.extend(cursor.fetchall())
+    return write_index(filename, rows)
+
+class PrecursorIndex(object):
+    """A read-only precursor index backed by a memory-mapped file."""
+
+    def __init__(self, filename):
+        if numpy is None:
+            raise ImportError("The precursor index requires numpy")
+        self.filename = filename
+        f = open(filename, 'rb')
+        header = f.read(_header.size)
+        f.close()
+        if len(header) != _header.size:
+            raise PrecursorIndexError("File %s is not a precursor index" % filename)
+        magic, version, dummy, self.size, seqlen = _header.unpack(header)
+        if magic != MAGIC:
+            raise PrecursorIndexError("File %s is not a precursor index" % filename)
+        if version != VERSION:
+            raise PrecursorIndexError("Precursor index %s has version %s, expected %s. Please rebuild it." % (
+                filename, version, VERSION))
+
+        offset = _header.size
+        for name, dtype, extra in COLUMNS:
+            n = self.size + 1 if extra else self.size
+            setattr(self, name, self._map(dtype, offset, n))
+            offset += n * numpy.dtype(dtype).itemsize
+        self.sequence_data = self._map('S1', offset, seqlen)
+
+    def _map(self, dtype, offset, n):
+        # mmap cannot map empty regions
+        if n == 0: return numpy.zeros(0, dtype=dtype)
+        return numpy.memmap(self.filename, dtype=dtype, mode='r', offset=offset, shape=(n,))
+
+    def __len__(self):
+        return self.size
+
+    def get_sequence(self, i):
+        return self.sequence_data[self.seq_offset[i]:self.seq_offset[i+1]].tostring()
+
+    def get_row(self, i):
+        """Get a single row in the order of PRECURSOR_VALUES"""
+        return (self.get_sequence(i), int(self.transition_group[i]),
+                int(self.parent_id[i]), int(self.q1_charge[i]),
+                float(self.q1[i]), float(self.ssrcalc[i]),
+                int(self.modifications[i]), int(self.missed_cleavages[i]),
+                int(self.isotopically_modified[i]))
+
+    def get_precursor(self, i):
+        p = Precursor()
+        p.initialize(*self.get_row(i))
+        return p
+
+    def q1_range(self, q1_low, q1_high, inclusive=True):
+        """Return the first and last+1 row with q1 between q1_low and q1_high"""
+        if inclusive:
+            return (self.q1.searchsorted(q1_low, 'left'),
+                    self.q1.searchsorted(q1_high, 'right'))
+        return (self.q1.searchsorted(q1_low, 'right'),
+                self.q1.searchsorted(q1_high, 'left'))
+
+    def query(self, q1_low, q1_high, isotope_range, par, ssrcalc_low=None,
+              ssrcalc_high=None, inclusive=True, restrict_modifications=True):
+        """Return the row numbers of the precursors in the given Q1 window.
+
+        First all precursors with q1_low <= q1 <= q1_high are selected (or
+        strictly between the bounds if inclusive is False) as well as with
+        ssrcalc_low < ssrcalc < ssrcalc_high. Then the restrictions on
+        modifications and missed cleavages from par are applied (unless
+        restrict_modifications is False) and finally only those precursors
+        are kept that have an isotope within the isotope_range (see
+        Precursor.included_in_isotopic_range).
+        """
+        start, end = self.q1_range(q1_low, q1_high, inclusive)
+        q1 = numpy.asarray(self.q1[start:end])
+        keep = numpy.ones(len(q1), dtype=bool)
+        if restrict_modifications:
+            keep &= (numpy.asarray(self.modifications[start:end]) <= int(par.max_mods)) & \
+                    (numpy.asarray(self.missed_cleavages[start:end]) <= int(par.max_MC))
+        if ssrcalc_low is not None:
+            ssrcalc = numpy.asarray(self.ssrcalc[start:end])
+            keep &= (ssrcalc > ssrcalc_low) & (ssrcalc < ssrcalc_high)
+
+        charge = numpy.asarray(self.q1_charge[start:end])
+        in_range = numpy.zeros(len(q1), dtype=bool)
+        for iso in range(par.isotopes_up_to+1):
+            q1_iso = q1 + (Residues.Residues.mass_diffC13 * iso)/charge
+            in_range |= (q1_iso > isotope_range[0]) & (q1_iso < isotope_range[1])
+        keep &= in_range
+        return numpy.nonzero(keep)[0] + start
+
+class InMemoryPrecursorIndex(PrecursorIndex):
+    """A precursor index that is held in memory instead of a file.
+
+    It is built from rows in the order of PRECURSOR_VALUES and supports the
+    same queries as PrecursorIndex.
+    """
+
+    def __init__(self, rows):
+        if numpy is None:
+            raise ImportError("The precursor index requires numpy")
+        self.filename = None
+        data, seqdata = _prepare_columns(rows)
+        self.size = len(data['q1'])
+        for name, dtype, extra in COLUMNS:
+            setattr(self, name, numpy.asarray(data[name], dtype=dtype))
+        self.sequence_data = numpy.frombuffer(seqdata, dtype='S1') if seqdata else numpy.zeros(0, dtype='S1')
+
+def check_parameters(par):
+    """Check that the parameters do not use any SQL restrictions that the
+    index cannot evaluate"""
+    if par.do_vs1 or (par.add_sql_select is not None and par.add_sql_select.strip() != ''):
+        raise PrecursorIndexError("Additional SQL restrictions cannot be used with a precursor index")
+
+_open_indices = {}
+def get_index(filename):
+    """Return the (cached) index stored in the file"""
+    mtime = os.path.getmtime(filename)
+    if filename not in _open_indices or _open_indices[filename][0] != mtime:
+        _open_indices[filename] = (mtime, PrecursorIndex(filename))
+    return _open_indices[filename][1]
+
+def get_all_precursors(par, precursor):
+    """Get all interfering precursors of a precursor from the index.
+
+    This is equivalent to SRMcollider._get_all_precursors without using the
+    database.
+    """
+    check_parameters(par)
+    return get_interfering_precursors(get_index(par.precursor_index), par, precursor)
+
+def get_interfering_precursors(index, par, precursor, restrict_modifications=True):
+    """Get all interfering precursors of a precursor from the given index
+    (see get_all_precursors)"""
+    isotope_correction = par.isotopes_up_to * Residues.Residues.mass_diffC13 / min(par.parent_charges)
+    rows = index.query(precursor.q1 - par.q1_window - isotope_correction,
+        precursor.q1 + par.q1_window,
+        (precursor.q1 - par.q1_window, precursor.q1 + par.q1_window), par,
+        precursor.ssrcalc - par.ssrcalc_window, precursor.ssrcalc + par.ssrcalc_window,
+        inclusive=False, restrict_modifications=restrict_modifications)
+
+    result = []
+    raw_sequence = filter(str.isalpha, precursor.modified_sequence)
+    for i in rows:
+        if par.select_by == "id":
+            if index.transition_group[i] == precursor.transition_group: continue
+        p = index.get_precursor(i)
+        if par.select_by == "modified_sequence":
+            if p.modified_sequence == precursor.modified_sequence: continue
+        elif par.select_by == "sequence":
+            if filter(str.isalpha, p.modified_sequence) == raw_sequence: continue
+        elif par.select_by not in ("id", "none"): assert False
+        result.append(p)
+    return result
+
+def get_rows_in_range(par, lower_q1, upper_q1):
+    """Get all precursors that have an isotope in the given Q1 range from the
+    index (as rows in the order of PRECURSOR_VALUES).
+
+    This is equivalent to PrecursorAccess.getFromDB without using the
+    database.
+    """
+    check_parameters(par)
+    index = get_index(par.precursor_index)
+    isotope_correction = par.isotopes_up_to * Residues.Residues.mass_diffC13 / min(par.parent_charges)
+    rows = index.query(lower_q1 - isotope_correction, upper_q1,
+                       (lower_q1, upper_q1), par)
+    for i in rows:
+        yield index.get_row(i)
+
+def get_precursors_in_range(par, lower_q1, upper_q1):
+    """Get all precursors that have an isotope in the given Q1 range from the
+    index, see get_rows_in_range"""
+    result = []
+    for row in get_rows_in_range(par, lower_q1, upper_q1):
+        p = Precursor()
+        p.initialize(*row)
+        result.append(p)
+    return result
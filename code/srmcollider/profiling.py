@@ -0,0 +1,264 @@
+"""
+ *
+ * Program       : SRMCollider
+ * Author        : Hannes Roest <roest@imsb.biol.ethz.ch>
+ * Date          : 05.02.2011
+ *
+ *
+ * Copyright (C) 2011 - 2012 Hannes Roest
+ *
+ * This library is free software; you can redistribute it and/or
+ * modify it under the terms of the GNU Lesser General Public
+ * License as published by the Free Software Foundation; either
+ * version 2.1 of the License, or (at your option) any later version.
+ *
+ * This library is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+ * Lesser General Public License for more details.
+ *
+ * You should have received a copy of the GNU Lesser General Public
+ * License along with this library; if not, write to the Free Software
+ * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307, USA
+ *
+"""
+
+"""
+Lightweight instrumentation of the stages of a run (see --profile).
+
+The expensive functions of the SRMCollider are wrapped in timers which
+record how often a stage was entered and how long it took, both including
+and excluding the time of the nested stages (e.g. the fragment generation
+inside the collision matching). Counters and histograms record the size of
+the background of each query, the number of colliding peptides per query and
+the number of transitions per precursor.
+
+    profiling.enable()
+    with profiling.timer('db_fetch'):
+        ...
+    profiling.observe('background_size', len(precursors))
+    print profiling.report()
+    profiling.write('profile.json')
+
+While profiling is disabled (the default) timer returns a shared object
+that does nothing and count/observe return immediately, thus the overhead is
+a single test of the module variable enabled.
+
+Worker processes (see parallel.py) send their measurements back to the
+parent process with their results where they are merged.
+"""
+
+import time
+
+enabled = False
+_cprofile = None
+
+class Profile(object):
+    """Timers, counters and histograms of one run (or one worker)"""
+
+    def __init__(self):
+        self.timers = {}     # name -> [calls, seconds, self_seconds]
+        self.counters = {}   # name -> count
+        self.histograms = {} # name -> [sum, {bucket : count}]
+        self.start = time.time()
+        self.merged = False  # contains measurements of other processes
+
+    def add_time(self, name, seconds, self_seconds):
+        t = self.timers.get(name)
+        if t is None: self.timers[name] = [1, seconds, self_seconds]
+        else:
+            t[0] += 1
+            t[1] += seconds
+            t[2] += self_seconds
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def observe(self, name, value):
+        """Add value to the histogram name, the buckets are powers of two
+        (bucket b holds the values from 2**(b-1) to 2**b - 1)"""
+        h = self.histograms.get(name)
+        if h is None: h = self.histograms[name] = [0, {}]
+        h[0] += value
+        b = int(value).bit_length()
+        h[1][b] = h[1].get(b, 0) + 1
+
+    def merge(self, other):
+        self.merged = True
+        for name, t in other.timers.iteritems():
+            mine = self.timers.setdefault(name, [0, 0.0, 0.0])
+            for i in range(3): mine[i] += t[i]
+        for name, n in other.counters.iteritems(): self.count(name, n)
+        for name, h in other.histograms.iteritems():
+            mine = self.histograms.setdefault(name, [0, {}])
+            mine[0] += h[0]
+            for b, n in h[1].iteritems(): mine[1][b] = mine[1].get(b, 0) + n
+
+    def get_histogram(self, name):
+        """Return the number of values, their sum and the counts of the
+        buckets as a list of (low, high, count)"""
+        total, h = self.histograms[name]
+        buckets = [ (b and 1 << (b-1), (1 << b) - 1, h[b]) for b in sorted(h)]
+        return sum(h.values()), total, buckets
+
+    def as_dict(self):
+        result = {
+            'wallclock' : time.time() - self.start,
+            'timers' : dict([ (name, {'calls' : t[0], 'seconds' : t[1], 'self_seconds' : t[2]})
+                for name, t in self.timers.iteritems()]),
+            'counters' : dict(self.counters),
+            'histograms' : {},
+        }
+        for name in self.histograms:
+            nr, total, buckets = self.get_histogram(name)
+            result['histograms'][name] = {'count' : nr, 'sum' : total,
+                'mean' : total * 1.0 / nr, 'buckets' : [list(b) for b in buckets]}
+        return result
+
+    def report(self):
+        """A human readable table of the stages, sorted by their own time"""
+        wallclock = time.time() - self.start
+        lines = ["%-30s %10s %12s %12s %7s" % ('stage', 'calls', 'total (s)', 'self (s)', 'self %')]
+        for name, t in sorted(self.timers.iteritems(), key=lambda x: -x[1][2]):
+            lines.append("%-30s %10d %12.3f %12.3f %6.1f%%" % (name, t[0], t[1], t[2],
+                100.0 * t[2] / wallclock if wallclock > 0 else 0.0))
+        lines.append("%-30s %10s %12.3f" % ('wallclock', '', wallclock))
+        if self.merged:
+            lines.append("(the stages are summed over all processes)")
+        for name in sorted(self.histograms):
+            nr, total, buckets = self.get_histogram(name)
+            lines.append("%s: %s values, mean %.1f, max below %s" % (name, nr,
+                total * 1.0 / nr, buckets[-1][1] + 1))
+        for name, n in sorted(self.counters.iteritems()):
+            lines.append("%s: %s" % (name, n))
+        return '\n'.join(lines)
+
+    def write(self, filename):
+        """Write the profile as JSON or, if filename ends with .csv, as one
+        row per timer, counter and histogram bucket"""
+        if filename.endswith('.csv'):
+            import csv
+            f = open(filename, 'wb')
+            writer = csv.writer(f)
+            writer.writerow(['type', 'name', 'count', 'seconds', 'self_seconds', 'low', 'high'])
+            for name, t in sorted(self.timers.iteritems()):
+                writer.writerow(['timer', name, t[0], t[1], t[2], '', ''])
+            for name, n in sorted(self.counters.iteritems()):
+                writer.writerow(['counter', name, n, '', '', '', ''])
+            for name in sorted(self.histograms):
+                for low, high, n in self.get_histogram(name)[2]:
+                    writer.writerow(['histogram', name, n, '', '', low, high])
+            f.close()
+        else:
+            import json
+            f = open(filename, 'w')
+            json.dump(self.as_dict(), f, indent=2, sort_keys=True)
+            f.close()
+
+_profile = Profile()
+_stack = []
+
+class _Timer(object):
+
+    __slots__ = ['name', 'start', 'children']
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.children = 0.0
+        _stack.append(self)
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *args):
+        elapsed = time.time() - self.start
+        _stack.pop()
+        if _stack: _stack[-1].children += elapsed
+        _profile.add_time(self.name, elapsed, elapsed - self.children)
+        return False
+
+class _NoTimer(object):
+
+    def __enter__(self): return self
+    def __exit__(self, *args): return False
+
+_no_timer = _NoTimer()
+
+def _running(name):
+    for t in _stack:
+        if t.name == name: return True
+    return False
+
+def timer(name):
+    """Context manager that measures the time spent in the stage name. If
+    the stage is already being measured (e.g. a profiled function calls
+    another one of the same stage), the time is only counted once."""
+    if not enabled or _running(name): return _no_timer
+    return _Timer(name)
+
+def profiled(name):
+    """Decorator that measures the time spent in a function as stage name"""
+    def decorator(function):
+        def wrapper(*args, **kwargs):
+            if not enabled or _running(name): return function(*args, **kwargs)
+            with _Timer(name):
+                return function(*args, **kwargs)
+        wrapper.__name__ = function.__name__
+        wrapper.__doc__ = function.__doc__
+        wrapper.__module__ = function.__module__
+        return wrapper
+    return decorator
+
+def count(name, n=1):
+    if enabled: _profile.count(name, n)
+
+def observe(name, value):
+    if enabled: _profile.observe(name, value)
+
+def get_profile():
+    return _profile
+
+def enable(cprofile=False):
+    """Start profiling (discarding all previous measurements), optionally
+    also with cProfile"""
+    global enabled, _profile, _cprofile
+    enabled = True
+    _profile = Profile()
+    del _stack[:]
+    if cprofile:
+        import cProfile
+        _cprofile = cProfile.Profile()
+        _cprofile.enable()
+
+def disable():
+    global enabled, _cprofile
+    enabled = False
+    if _cprofile is not None:
+        _cprofile.disable()
+
+def take_profile():
+    """Return the measurements since the last call (or since profiling was
+    enabled) and start over, used by the worker processes of parallel.py"""
+    global _profile
+    result = _profile
+    _profile = Profile()
+    return result
+
+def merge(profile):
+    _profile.merge(profile)
+
+def report():
+    return _profile.report()
+
+def finish(par):
+    """Stop profiling and write the results to the files given by
+    par.profile (JSON or CSV) and par.cprofile (cProfile statistics)"""
+    if not enabled: return
+    disable()
+    if not par.quiet:
+        print "\nProfile of the stages (self excludes nested stages):"
+        print report()
+    if par.profile: _profile.write(par.profile)
+    if par.cprofile and _cprofile is not None:
+        _cprofile.dump_stats(par.cprofile)
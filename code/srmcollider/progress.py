@@ -26,6 +26,17 @@ while total > 0:
 Here is an example of its output:
 
 [------------------------->                                   ] 41%  821.2/sec
+
+The updates are only added up, the rate and the ETA are calculated and the
+meter is redrawn at most every rate_refresh seconds. If stdout is not a
+terminal (e.g. it is redirected to a log file), a plain line without
+terminal escape codes is written every log_refresh seconds instead:
+
+41% (410/1000 peptides)  821.2 peptides/sec (eta 0s)
+
+The meter can be shared with forked worker processes (see share and
+parallel.map_ranges): the workers add their updates in batches to a shared
+counter which is read by the parent process (see poll).
 """
 import time, sys, math
 
@@ -40,20 +51,33 @@ class ProgressMeter(object):
         self.total = int(kw.get('total', 100))
         # Number of units already processed
         self.count = int(kw.get('count', 0))
+        # Write to a terminal (redraw the meter) or to a log (write lines)?
+        self.tty = kw.get('tty', None)
+        if self.tty is None:
+            self.tty = hasattr(sys.stdout, 'isatty') and sys.stdout.isatty()
         # Refresh rate in seconds
         self.rate_refresh = float(kw.get('rate_refresh', .5))
+        if not self.tty:
+            self.rate_refresh = float(kw.get('log_refresh', 10))
+        # Number of units a worker process adds up before it reports them
+        self.batch = int(kw.get('batch', 100))
         # Number of ticks in meter
         self.meter_ticks = int(kw.get('ticks', 60))
-        self.meter_division = float(self.total) / self.meter_ticks
+        self.meter_division = float(max(self.total, 1)) / self.meter_ticks
         self.meter_value = int(self.count / self.meter_division)
-        self.last_update = None
-        self.rate_history_idx = 0
-        self.rate_history_len = 10
-        self.rate_history = [None] * self.rate_history_len
+        self.first_update = None
         self.rate_current = 0.0
+        self.rate_average = 0.0
         self.last_refresh = 0
+        self.last_refresh_count = self.count
+        self.finished = False
+        # the counter shared with the worker processes (see share)
+        self._shared = None
+        self._worker = False
+        self._pending = 0
+        self.worker_count = 0 # units reported by this worker process
         self._cursor = False
-        self.reset_cursor()
+        if self.tty: self.reset_cursor()
 
     def reset_cursor(self, first=False):
         if self._cursor:
@@ -62,72 +86,103 @@ class ProgressMeter(object):
         sys.stdout.write(self.ESC + '[s')
 
     def update(self, count, **kw):
+        if self._worker:
+            # in a worker process only add up the updates
+            self._pending += count
+            self.worker_count += count
+            if self._pending >= self.batch: self.flush()
+            return
         now = time.time()
-        # Caclulate rate of progress
-        rate = 0.0
+        if self.first_update is None: self.first_update = now - 0.0001
         # Add count to Total
-        self.count += count
-        self.count = min(self.count, self.total)
-        if self.last_update:
-            delta = now - float(self.last_update)
-            if delta:
-                rate = count / delta
-            else:
-                rate = count
-            self.rate_history[self.rate_history_idx] = rate
-            self.rate_history_idx += 1
-            self.rate_history_idx %= self.rate_history_len
-            cnt = 0
-            total = 0.0
-            # Average rate history
-            for rate in self.rate_history:
-                if rate == None:
-                    continue
-                cnt += 1
-                total += rate
-            rate = total / cnt
-        else: self.first_update = now - 0.0001
-        self.rate_current = rate
+        self.count = min(self.count + count, self.total)
+        if (now - self.last_refresh) > self.rate_refresh or \
+            (self.count >= self.total and not self.finished):
+                self.refresh(now=now)
+
+    def share(self):
+        """Prepare the meter to be updated from forked worker processes. Has to
+        be called before the workers are forked."""
+        import multiprocessing
+        # the workers start now
+        if self.first_update is None: self.first_update = time.time()
+        if self._shared is None:
+            self._shared = multiprocessing.Value('l', self.count)
+        else:
+            self._shared.value = self.count
+
+    def start_worker(self):
+        """Called in a forked worker process, from now on updates are sent to
+        the parent process in batches"""
+        self._worker = True
+        self._pending = 0
+        self.worker_count = 0
+
+    def flush(self):
+        """Send the updates of this worker process to the parent process"""
+        if self._pending == 0: return
+        with self._shared.get_lock():
+            self._shared.value += self._pending
+        self._pending = 0
+
+    def poll(self):
+        """Take over the updates of the worker processes (in the parent
+        process)"""
+        count = self._shared.value
+        if count > self.count: self.update(count - self.count)
+
+    def nice_timestring(self, eta):
+        if eta > 3600: return "%dh %dm" % ( eta // 3600,
+                               (( eta - 3600*(eta // 3600)) / 60)  )
+        elif eta > 60: return "%dm %ds" % ( eta // 60,
+                               (eta - 60*(eta // 60)) )
+        else: return "%ds" % eta
+
+    def _calculate_rates(self, now):
+        if self.first_update is None: self.first_update = now - 0.0001
+        if self.last_refresh and now > self.last_refresh:
+            self.rate_current = (self.count - self.last_refresh_count) / (now - self.last_refresh)
         self.rate_average = self.count / (now - self.first_update)
-        self.last_update = now
+        self.last_refresh_count = self.count
         # Device Total by meter division
         value = int(self.count / self.meter_division)
         if value > self.meter_value:
             self.meter_value = value
-        if self.last_refresh:
-            if (now - self.last_refresh) > self.rate_refresh or \
-                (self.count >= self.total):
-                    self.refresh()
-        else:
-            self.refresh()
 
-    def nice_timestring(self, eta):
-        if eta > 3600: return "%dh %dm" % ( eta // 3600, 
-                               (( eta - 3600*(eta // 3600)) / 60)  )
-        elif eta > 60: return "%dm %ds" % ( eta // 60, 
-                               (eta - 60*(eta // 60)) )
-        else: return "%ds" % eta 
+    def get_eta(self):
+        if self.rate_average <= 0: return '?'
+        eta = (self.total - self.count ) /self.rate_average
+        return self.nice_timestring( eta )
 
     def get_meter(self, **kw):
         bar = '-' * self.meter_value
         pad = ' ' * (self.meter_ticks - self.meter_value)
-        perc = (float(self.count) / self.total) * 100
-        eta = (self.total - self.count ) /self.rate_average
-        eta = self.nice_timestring( eta )
-        return '[%s>%s] %d%%  %.1f %s/sec (eta %s)' % (bar, pad, perc, 
-                   self.rate_average, self.unit,  eta )
+        perc = (float(self.count) / max(self.total, 1)) * 100
+        return '[%s>%s] %d%%  %.1f %s/sec (eta %s)' % (bar, pad, perc,
+                   self.rate_average, self.unit,  self.get_eta() )
+
+    def get_logline(self):
+        perc = (float(self.count) / max(self.total, 1)) * 100
+        return '%d%% (%s/%s %s)  %.1f %s/sec (eta %s)' % (perc, self.count,
+                   self.total, self.unit, self.rate_average, self.unit, self.get_eta() )
 
     def refresh(self, **kw):
-        # Clear line
-        sys.stdout.write(self.ESC + '[2K')
-        self.reset_cursor()
-        sys.stdout.write(self.get_meter(**kw))
+        now = kw.get('now', time.time())
+        self._calculate_rates(now)
+        if self.tty:
+            # Clear line
+            sys.stdout.write(self.ESC + '[2K')
+            self.reset_cursor()
+            sys.stdout.write(self.get_meter(**kw))
+        else:
+            sys.stdout.write(self.get_logline() + '\n')
         # Are we finished?
-        if self.count >= self.total:
+        if self.count >= self.total and not self.finished:
+            self.finished = True
             timediff = time.time() - self.first_update
             timediff = self.nice_timestring( timediff )
-            sys.stdout.write('\n')
+            if self.tty: sys.stdout.write('\n')
             sys.stdout.write('It took %s\n' % timediff )
         sys.stdout.flush()
         # Timestamp
-        self.last_refresh = time.time()
+        self.last_refresh = now
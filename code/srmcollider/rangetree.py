@@ -0,0 +1,332 @@
+"""
+ *
+ * Program       : SRMCollider
+ * Author        : Hannes Roest <roest@imsb.biol.ethz.ch>
+ * Date          : 05.02.2011
+ *
+ *
+ * Copyright (C) 2011 - 2012 Hannes Roest
+ *
+ * This library is free software; you can redistribute it and/or
+ * modify it under the terms of the GNU Lesser General Public
+ * License as published by the Free Software Foundation; either
+ * version 2.1 of the License, or (at your option) any later version.
+ *
+ * This library is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+ * Lesser General Public License for more details.
+ *
+ * You should have received a copy of the GNU Lesser General Public
+ * License along with this library; if not, write to the Free Software
+ * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307, USA
+ *
+"""
+
+"""
+A static two-dimensional (Q1, retention time) range index with the same
+interface as the compiled c_rangetree module.
+
+The precursors are sorted by Q1 and split into blocks of BLOCKSIZE
+consecutive precursors. Within each block the precursors are sorted by the
+rank of their retention time and all blocks are stored in one array of
+integer keys (block * number_of_distinct_rts + rank). A query selects the
+Q1 range with a binary search, the retention time range of all blocks that
+lie completely inside the Q1 range is then found with a single vectorized
+binary search in the key array and only the (at most two) partially covered
+blocks at the ends are checked element by element. Short Q1 ranges (at most
+SCAN_LIMIT precursors) are checked element by element right away since the
+vectorized scan is faster than the block lookup for them.
+
+Many windows can be queried at once with query_batch, which returns all
+hits as a compressed sparse row structure (see there).
+
+As in the CGAL rangetree, the query window is half-open, e.g. a precursor is
+selected if q1_low - correction <= q1 < q1_high and rt_low <= rt < rt_high.
+Then only those precursors are kept that have an isotope inside the open
+interval (q1_low, q1_high), see query_tree.
+
+Without numpy, the precursors are kept in a list sorted by Q1 and the
+retention time is checked for all precursors in the Q1 range.
+
+A tree (with numpy) can be stored in a file with save and memory-mapped again
+with load, see rangetree_cache.py.
+"""
+
+import bisect
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import Residues
+
+BLOCKSIZE = 512
+# Q1 ranges with at most this many precursors are scanned directly
+SCAN_LIMIT = 16384
+# maximal number of candidate precursors checked at once by query_batch
+BATCH_CANDIDATES = 1 << 22
+
+class Rangetree_Q1_RT(object):
+    """Range index over Q1 and retention time (ssrcalc) of precursors.
+
+    Drop-in replacement for c_rangetree.Rangetree_Q1_RT: create the tree with
+    create_tree (or create_tree_from_columns) and query it with query_tree.
+    """
+
+    def __init__(self, blocksize=BLOCKSIZE, use_numpy=True, scan_limit=SCAN_LIMIT):
+        self.blocksize = blocksize
+        self.scan_limit = scan_limit
+        self.use_numpy = use_numpy and numpy is not None
+        self.mass_diffC13 = Residues.Residues.mass_diffC13
+        self.create_tree_from_columns([], [], [], [])
+
+    @staticmethod
+    def create():
+        return Rangetree_Q1_RT()
+
+    def __len__(self):
+        return len(self.q1)
+
+    def create_tree(self, pepids):
+        """Create the tree from tuples with the following structure:
+            1 - transition_group (0 for the simple rangetree tuples)
+            2 - parent_id
+            3 - q1_charge
+            4 - q1
+            5 - ssrcalc
+        (all other entries are ignored)
+        """
+        self.create_tree_from_columns([t[2] for t in pepids], [t[3] for t in pepids],
+            [t[4] for t in pepids], [t[5] for t in pepids], [t[1] for t in pepids])
+
+    def create_tree_from_columns(self, parent_id, q1_charge, q1, ssrcalc, transition_group=None):
+        """Create the tree from the columns of the precursors (e.g. the
+        columns of a PrecursorTable). The transition groups are only needed
+        to exclude precursors in query_batch."""
+        if transition_group is None: transition_group = [0] * len(q1)
+        if not self.use_numpy:
+            self._entries = sorted(zip(q1, ssrcalc, parent_id, q1_charge,
+                                       transition_group, range(len(q1))))
+            self.q1 = [e[0] for e in self._entries]
+            return
+
+        q1 = numpy.asarray(q1, dtype=numpy.float64)
+        order = numpy.argsort(q1, kind='mergesort')
+        self._order = order
+        self.q1 = q1[order]
+        self.ssrcalc = numpy.asarray(ssrcalc, dtype=numpy.float64)[order]
+        self.parent_id = numpy.asarray(parent_id, dtype=numpy.int64)[order]
+        self.q1_charge = numpy.asarray(q1_charge, dtype=numpy.float64)[order]
+        self.transition_group = numpy.asarray(transition_group, dtype=numpy.int64)[order]
+
+        # the retention times are replaced by their rank, so that the keys of
+        # all blocks can be stored exactly in one sorted integer array
+        self._rt_values = numpy.unique(self.ssrcalc)
+        self._nr_ranks = max(len(self._rt_values), 1)
+        rank = numpy.searchsorted(self._rt_values, self.ssrcalc)
+        block = numpy.arange(len(self.q1), dtype=numpy.int64) // self.blocksize
+        self._within = numpy.lexsort((rank, block))
+        self._keys = (block * self._nr_ranks + rank)[self._within]
+
+    # the arrays that make up a tree (with numpy)
+    _arrays = ('q1', 'ssrcalc', 'parent_id', 'q1_charge', 'transition_group',
+               '_order', '_rt_values', '_within', '_keys')
+
+    def get_arrays(self):
+        """Return all data of the tree as a dictionary of numpy arrays (see
+        from_arrays)"""
+        if not self.use_numpy:
+            raise ValueError("Only a rangetree with numpy can be stored")
+        arrays = dict([ (name, getattr(self, name)) for name in self._arrays])
+        arrays['_parameters'] = numpy.array([self.blocksize, self.scan_limit,
+                                             self._nr_ranks], dtype=numpy.int64)
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """Create a tree from the arrays returned by get_arrays. The arrays
+        are used as they are (e.g. memory-mapped) and are not copied."""
+        if numpy is None:
+            raise ImportError("Loading a rangetree requires numpy")
+        blocksize, scan_limit, nr_ranks = [int(v) for v in arrays['_parameters']]
+        tree = cls(blocksize=blocksize, scan_limit=scan_limit)
+        for name in cls._arrays:
+            setattr(tree, name, arrays[name])
+        tree._nr_ranks = nr_ranks
+        return tree
+
+    def save(self, filename, fingerprint=''):
+        """Store the tree in a file that can be memory-mapped with load"""
+        import rangetree_cache
+        rangetree_cache.write_arrays(filename, fingerprint, self.get_arrays())
+
+    @classmethod
+    def load(cls, filename, fingerprint=None):
+        """Memory-map a tree stored with save. If a fingerprint is given,
+        it has to match the one of the file."""
+        import rangetree_cache
+        return cls.from_arrays(rangetree_cache.read_arrays(filename, fingerprint))
+
+    def query_tree(self, q1_low, rt_low, q1_high, rt_high, max_nr_isotopes=0, correction=0.0):
+        """Return the parent_ids of all precursors with an isotope in the
+        window as a list of 1-tuples (as c_rangetree does).
+
+        The isotope correction should be computed as
+            nr_isotopes_to_consider * mass_difference_of_C13 / minimal_parent_charge
+        """
+        if not self.use_numpy:
+            return [ (e[2],) for e in self._query_python(q1_low, rt_low,
+                q1_high, rt_high, max_nr_isotopes, correction)]
+        positions = self.query_positions(q1_low, rt_low, q1_high, rt_high,
+                                         max_nr_isotopes, correction)
+        return [ (p,) for p in self.parent_id[positions].tolist()]
+
+    def query_positions(self, q1_low, rt_low, q1_high, rt_high, max_nr_isotopes=0, correction=0.0):
+        """Return the (sorted) positions of the selected precursors in the
+        arrays q1, ssrcalc, parent_id and q1_charge of the tree"""
+        candidates = self._window_query(q1_low - correction, rt_low, q1_high, rt_high)
+        return candidates[self._isotope_mask(candidates, q1_low, q1_high, max_nr_isotopes)]
+
+    def _window_query(self, q1_low, rt_low, q1_high, rt_high):
+        # all positions with q1_low <= q1 < q1_high and rt_low <= rt < rt_high
+        lo = numpy.searchsorted(self.q1, q1_low, 'left')
+        hi = numpy.searchsorted(self.q1, q1_high, 'left')
+        rlo = numpy.searchsorted(self._rt_values, rt_low, 'left')
+        rhi = numpy.searchsorted(self._rt_values, rt_high, 'left')
+        if hi <= lo or rhi <= rlo: return numpy.zeros(0, dtype=numpy.int64)
+
+        # for short Q1 ranges checking every precursor is faster
+        if hi - lo <= self.scan_limit:
+            return self._scan(lo, hi, rt_low, rt_high)
+        B = self.blocksize
+        first_full = -(-lo // B)
+        last_full = hi // B
+        if first_full >= last_full:
+            return self._scan(lo, hi, rt_low, rt_high)
+
+        # blocks that lie completely inside the Q1 range
+        blocks = numpy.arange(first_full, last_full, dtype=numpy.int64) * self._nr_ranks
+        starts = numpy.searchsorted(self._keys, blocks + rlo, 'left')
+        ends = numpy.searchsorted(self._keys, blocks + rhi, 'left')
+        lengths = ends - starts
+        total = lengths.sum()
+        offsets = numpy.repeat(starts - (numpy.cumsum(lengths) - lengths), lengths)
+        inside = self._within[offsets + numpy.arange(total, dtype=numpy.int64)]
+
+        result = numpy.concatenate((self._scan(lo, first_full * B, rt_low, rt_high),
+            inside, self._scan(last_full * B, hi, rt_low, rt_high)))
+        result.sort()
+        return result
+
+    def _scan(self, start, end, rt_low, rt_high):
+        rt = self.ssrcalc[start:end]
+        return numpy.flatnonzero((rt >= rt_low) & (rt < rt_high)) + start
+
+    def _isotope_mask(self, positions, q1_low, q1_high, max_nr_isotopes):
+        # keep only precursors that have an isotope in (q1_low, q1_high)
+        q1 = self.q1[positions]
+        charge = self.q1_charge[positions]
+        mask = numpy.zeros(len(positions), dtype=bool)
+        for iso in range(max_nr_isotopes+1):
+            mz = q1 + (self.mass_diffC13 * iso) / charge
+            mask |= (mz > q1_low) & (mz < q1_high)
+        return mask
+
+    def _query_python(self, q1_low, rt_low, q1_high, rt_high, max_nr_isotopes, correction):
+        lo = bisect.bisect_left(self.q1, q1_low - correction)
+        hi = bisect.bisect_left(self.q1, q1_high, lo)
+        result = []
+        for entry in self._entries[lo:hi]:
+            q1, ssrcalc, charge = entry[0], entry[1], entry[3]
+            if ssrcalc < rt_low or ssrcalc >= rt_high: continue
+            for iso in range(max_nr_isotopes+1):
+                mz = q1 + (self.mass_diffC13 * iso) / charge
+                if mz > q1_low and mz < q1_high:
+                    result.append(entry)
+                    break
+        return result
+
+    def query_batch(self, q1_low, rt_low, q1_high, rt_high, max_nr_isotopes=0,
+                    correction=0.0, exclude_transition_group=None):
+        """Query many windows at once.
+
+        The window boundaries (and exclude_transition_group) are sequences
+        with one entry per window or single values. The selection is the same
+        as in query_tree, additionally precursors with the transition group
+        exclude_transition_group[k] are not reported for window k.
+
+        Returns a compressed sparse row structure (offsets, indices): the
+        precursors found in window k are indices[offsets[k]:offsets[k+1]]
+        (sorted by Q1), the indices refer to the order in which the
+        precursors were passed to create_tree.
+        """
+        if not self.use_numpy:
+            return self._query_batch_python(q1_low, rt_low, q1_high, rt_high,
+                max_nr_isotopes, correction, exclude_transition_group)
+
+        windows = [q1_low, rt_low, q1_high, rt_high]
+        if exclude_transition_group is not None: windows.append(exclude_transition_group)
+        windows = numpy.broadcast_arrays(*[numpy.atleast_1d(w) for w in windows])
+        q1_low, rt_low, q1_high, rt_high = [w.astype(numpy.float64) for w in windows[:4]]
+        nr_windows = len(q1_low)
+        lo = numpy.searchsorted(self.q1, q1_low - correction, 'left')
+        hi = numpy.maximum(numpy.searchsorted(self.q1, q1_high, 'left'), lo)
+        lengths = hi - lo
+
+        # the candidates of short windows are checked all at once (in chunks
+        # to limit the memory), long windows use the blocks of the tree
+        positions, window_ids = [], []
+        short = numpy.flatnonzero(lengths <= self.scan_limit)
+        chunk = (numpy.cumsum(lengths[short]) - 1) // BATCH_CANDIDATES
+        for windows_used in numpy.split(short, numpy.flatnonzero(numpy.diff(chunk)) + 1):
+            n = lengths[windows_used]
+            ids = numpy.repeat(windows_used, n)
+            pos = numpy.repeat(lo[windows_used] - (numpy.cumsum(n) - n), n) + \
+                    numpy.arange(n.sum(), dtype=numpy.int64)
+            rt = self.ssrcalc[pos]
+            keep = (rt >= rt_low[ids]) & (rt < rt_high[ids])
+            pos, ids = pos[keep], ids[keep]
+            keep = self._isotope_mask(pos, q1_low[ids], q1_high[ids], max_nr_isotopes)
+            positions.append(pos[keep])
+            window_ids.append(ids[keep])
+        for k in numpy.flatnonzero(lengths > self.scan_limit):
+            pos = self.query_positions(q1_low[k], rt_low[k], q1_high[k], rt_high[k],
+                                       max_nr_isotopes, correction)
+            positions.append(pos)
+            window_ids.append(numpy.repeat(k, len(pos)))
+
+        positions = numpy.concatenate(positions + [numpy.zeros(0, dtype=numpy.int64)])
+        window_ids = numpy.concatenate(window_ids + [numpy.zeros(0, dtype=numpy.int64)])
+        if exclude_transition_group is not None:
+            keep = self.transition_group[positions] != windows[4][window_ids]
+            positions, window_ids = positions[keep], window_ids[keep]
+        # the hits of each window are already sorted by Q1
+        order = numpy.argsort(window_ids, kind='mergesort')
+        offsets = numpy.zeros(nr_windows + 1, dtype=numpy.int64)
+        offsets[1:] = numpy.cumsum(numpy.bincount(window_ids, minlength=nr_windows))
+        return offsets, self._order[positions[order]]
+
+    def _query_batch_python(self, q1_low, rt_low, q1_high, rt_high, max_nr_isotopes,
+                            correction, exclude_transition_group):
+        windows = [q1_low, rt_low, q1_high, rt_high, exclude_transition_group]
+        nr_windows = max([len(w) for w in windows if hasattr(w, '__len__')] + [1])
+        windows = [w if hasattr(w, '__len__') else [w] * nr_windows for w in windows]
+        offsets = [0]
+        indices = []
+        for k in range(nr_windows):
+            for entry in self._query_python(windows[0][k], windows[1][k], windows[2][k],
+                windows[3][k], max_nr_isotopes, correction):
+                if entry[4] == windows[4][k]: continue
+                indices.append(entry[5])
+            offsets.append(len(indices))
+        return offsets, indices
+
+class ExtendedRangetree_Q1_RT(Rangetree_Q1_RT):
+    """Drop-in replacement for c_rangetree.ExtendedRangetree_Q1_RT, it is
+    created from the tuples of Precursors.get_alltuples_extended_rangetree"""
+
+    @staticmethod
+    def create():
+        return ExtendedRangetree_Q1_RT()
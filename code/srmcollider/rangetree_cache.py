@@ -0,0 +1,212 @@
+"""
+ *
+ * Program       : SRMCollider
+ * Author        : Hannes Roest <roest@imsb.biol.ethz.ch>
+ * Date          : 05.02.2011
+ *
+ *
+ * Copyright (C) 2011 - 2012 Hannes Roest
+ *
+ * This library is free software; you can redistribute it and/or
+ * modify it under the terms of the GNU Lesser General Public
+ * License as published by the Free Software Foundation; either
+ * version 2.1 of the License, or (at your option) any later version.
+ *
+ * This library is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+ * Lesser General Public License for more details.
+ *
+ * You should have received a copy of the GNU Lesser General Public
+ * License along with this library; if not, write to the Free Software
+ * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307, USA
+ *
+"""
+
+"""
+A file cache for the background precursors, their rangetree and lookups.
+
+Getting the background precursors from the database and building the
+rangetree takes minutes for large backgrounds, while many runs use the same
+background. The precursors (a PrecursorTable), the rangetree (of
+rangetree.py) and the parent_id/transition_group lookups are therefore stored
+in a binary file and memory-mapped in the next run, see
+PrecursorAccess.getFromDB_with_rangetree and the --rangetree_cache option.
+
+Each file is identified by a fingerprint of everything the precursors depend
+on: the peptide tables and their content in the selected Q1 range, the
+additional SQL restrictions (query2_add), the Q1 range itself, the isotope
+settings and the precursor index file. A file whose fingerprint does not
+match is ignored, thus it is rebuilt automatically after the background
+changes. The files are stored in a directory with the fingerprint in the
+file name, so that runs with different windows do not overwrite each other.
+
+File layout (all little endian):
+
+    header: magic (8 bytes), version (uint32), number of arrays (uint32),
+            fingerprint (40 bytes, sha1 in hex)
+    table of contents, one entry per array:
+            name (32 bytes), numpy dtype (8 bytes), offset (uint64),
+            number of entries (uint64)
+    data of the arrays, each aligned to ALIGNMENT bytes
+"""
+
+import hashlib
+import os
+import struct
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import Residues
+
+MAGIC = 'SRMRTREE'
+VERSION = 1
+ALIGNMENT = 64
+_header = struct.Struct('<8sII40s')
+_entry = struct.Struct('<32s8sQQ')
+
+class RangetreeCacheError(Exception):
+    pass
+
+def write_arrays(filename, fingerprint, arrays):
+    """Write a dictionary of one-dimensional numpy arrays to a file"""
+    names = sorted(arrays.keys())
+    offset = _header.size + len(names) * _entry.size
+    entries = []
+    for name in names:
+        offset += -offset % ALIGNMENT
+        a = arrays[name]
+        entries.append(_entry.pack(name, a.dtype.str, offset, len(a)))
+        offset += a.nbytes
+
+    # only replace an existing file once the new one is complete
+    tmpfile = '%s.%s.tmp' % (filename, os.getpid())
+    f = open(tmpfile, 'wb')
+    f.write(_header.pack(MAGIC, VERSION, len(names), fingerprint))
+    f.write(''.join(entries))
+    for name in names:
+        f.write('\0' * (-f.tell() % ALIGNMENT))
+        numpy.ascontiguousarray(arrays[name]).tofile(f)
+    f.close()
+    os.rename(tmpfile, filename)
+
+def read_arrays(filename, fingerprint=None):
+    """Memory-map the arrays of a file written by write_arrays.
+
+    The arrays are mapped copy-on-write, changes are not written back to the
+    file. Raises RangetreeCacheError if the file is not valid or if its
+    fingerprint differs from the given one.
+    """
+    if numpy is None:
+        raise ImportError("The rangetree cache requires numpy")
+    f = open(filename, 'rb')
+    header = f.read(_header.size)
+    if len(header) != _header.size:
+        f.close()
+        raise RangetreeCacheError("File %s is not a rangetree cache" % filename)
+    magic, version, nr_arrays, file_fingerprint = _header.unpack(header)
+    toc = f.read(nr_arrays * _entry.size)
+    f.close()
+    if magic != MAGIC:
+        raise RangetreeCacheError("File %s is not a rangetree cache" % filename)
+    if version != VERSION:
+        raise RangetreeCacheError("Rangetree cache %s has version %s, expected %s" % (
+            filename, version, VERSION))
+    file_fingerprint = file_fingerprint.rstrip('\0')
+    if fingerprint is not None and file_fingerprint != fingerprint:
+        raise RangetreeCacheError("Rangetree cache %s is outdated" % filename)
+    if len(toc) != nr_arrays * _entry.size:
+        raise RangetreeCacheError("Rangetree cache %s is truncated" % filename)
+
+    arrays = {}
+    for i in range(nr_arrays):
+        name, dtype, offset, n = _entry.unpack_from(toc, i * _entry.size)
+        dtype = dtype.rstrip('\0')
+        # mmap cannot map empty regions
+        if n == 0: a = numpy.zeros(0, dtype=dtype)
+        else: a = numpy.memmap(filename, dtype=dtype, mode='c', offset=offset, shape=(n,))
+        arrays[name.rstrip('\0')] = a
+    return arrays
+
+def get_fingerprint(par, cursor, lower_q1, upper_q1, extra=''):
+    """Compute the fingerprint of the background precursors that
+    PrecursorAccess.getFromDB selects with these arguments.
+
+    For each peptide table, the number of precursors in the Q1 range and the
+    sums of some of their columns are computed in the database, thus changes
+    to the content of the tables are detected without fetching the
+    precursors.
+    """
+    isotope_correction = par.isotopes_up_to * Residues.Residues.mass_diffC13 / min(par.parent_charges)
+    key = [VERSION, lower_q1, upper_q1, par.isotopes_up_to, list(par.parent_charges),
+           par.query2_add, extra]
+    if par.precursor_index:
+        key.extend([par.precursor_index, par.max_mods, par.max_MC,
+                    os.path.getmtime(par.precursor_index), os.path.getsize(par.precursor_index)])
+    else:
+        for table in par.peptide_tables:
+            cursor.execute("""
+            select count(*), sum(q1), sum(ssrcalc), sum(parent_id), sum(transition_group)
+            from %(peptide_table)s where q1 between %(lowq1)s - %(isotope_correction)s and %(highq1)s
+            %(query_add)s
+            """ % {'peptide_table' : table,
+                   'lowq1'  : lower_q1,
+                   'highq1' : upper_q1,
+                   'isotope_correction' : isotope_correction,
+                   'query_add' : par.query2_add })
+            key.append( (table, tuple(cursor.fetchone())) )
+    return hashlib.sha1(repr(key)).hexdigest()
+
+def get_filename(directory, fingerprint):
+    return os.path.join(directory, 'rangetree_%s.bin' % fingerprint)
+
+def save_precursors(filename, fingerprint, access, rtree):
+    """Store the precursors and lookups of a PrecursorAccess object and the
+    rangetree (if it is a rangetree of rangetree.py)"""
+    arrays = {}
+    for name, a in access.precursors.get_arrays().iteritems():
+        arrays['precursors.' + name] = a
+    arrays['lookup.parent_id'] = access.parentid_lookup.order
+    arrays['lookup.transition_group'] = access.transition_group_lookup.order
+    if hasattr(rtree, 'get_arrays') and rtree.use_numpy:
+        for name, a in rtree.get_arrays().iteritems():
+            arrays['rangetree.' + name] = a
+    write_arrays(filename, fingerprint, arrays)
+
+def _select(arrays, prefix):
+    return dict([ (k[len(prefix):], v) for k, v in arrays.iteritems() if k.startswith(prefix)])
+
+def load_precursors(filename, fingerprint, access, extended=False):
+    """Load the precursors and lookups stored with save_precursors into a
+    PrecursorAccess object and return the rangetree.
+
+    The stored rangetree is used if the rangetree backend is the numpy one,
+    otherwise (e.g. for c_rangetree) a new tree is built from the stored
+    precursors. Returns None if the file does not exist or is not valid.
+    """
+    import backends, precursor, rangetree
+    if not os.path.exists(filename): return None
+    try:
+        arrays = read_arrays(filename, fingerprint)
+    except RangetreeCacheError:
+        return None
+
+    table = precursor.PrecursorTable.from_arrays(_select(arrays, 'precursors.'))
+    access.precursors = table
+    access.parentid_lookup = precursor._SortedPrecursorTableLookup(
+        table, table.get_column('parent_id'), arrays['lookup.parent_id'])
+    access.transition_group_lookup = precursor._SortedPrecursorTableLookup(
+        table, table.get_column('transition_group'), arrays['lookup.transition_group'])
+
+    rtree = backends.get_backends().get('rangetree')(extended=extended)
+    tree_arrays = _select(arrays, 'rangetree.')
+    if isinstance(rtree, rangetree.Rangetree_Q1_RT) and rtree.use_numpy and tree_arrays:
+        rtree = type(rtree).from_arrays(tree_arrays)
+        access._rangetree = rtree
+        access._rangetree_precursors = table
+        return rtree
+    if extended: return access.build_extended_rangetree()
+    return access.build_rangetree()
@@ -0,0 +1,197 @@
+"""
+ *
+ * Program       : SRMCollider
+ * Author        : Hannes Roest <roest@imsb.biol.ethz.ch>
+ * Date          : 05.02.2011
+ *
+ *
+ * Copyright (C) 2011 - 2012 Hannes Roest
+ *
+ * This library is free software; you can redistribute it and/or
+ * modify it under the terms of the GNU Lesser General Public
+ * License as published by the Free Software Foundation; either
+ * version 2.1 of the License, or (at your option) any later version.
+ *
+ * This library is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+ * Lesser General Public License for more details.
+ *
+ * You should have received a copy of the GNU Lesser General Public
+ * License along with this library; if not, write to the Free Software
+ * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307, USA
+ *
+"""
+
+"""
+A disk cache for the results of the web interface.
+
+Users frequently submit the same peptides with the same settings again. The
+ResultCache stores the results of the expensive steps (SSRCalc lookup,
+selection of the interfering precursors and the calculation of the
+interferences) per peptide in a local directory. The entries are addressed by
+a hash over the peptide and all parameters that influence the result, thus a
+peptide is answered from the cache even if it is submitted together with
+different peptides.
+
+Entries expire after ttl seconds and the least recently used entries are
+removed when the size of the cache grows beyond maxsize bytes.
+"""
+
+import os, time, tempfile
+import hashlib
+import cPickle as pickle
+
+import fragments
+
+# Parameters (attributes of SRM_parameters) that influence the interferences
+# found for a peptide. The enabled ion series are added separately.
+RESULT_PARAMETERS = ('peptide_tables', 'query2_add', 'q1_window', 'q3_window',
+                     'ssrcalc_window', 'ppm', 'isotopes_up_to', 'q3_range',
+                     'parent_charges', 'select_by', 'precursor_index',
+                     'chargeCheck', 'genome', 'dontdo2p2f')
+
+def _normalize(value):
+    # unicode and str with the same content, lists and tuples should result
+    # in the same key
+    if isinstance(value, unicode): return value.encode("utf8")
+    if isinstance(value, (list, tuple)): return tuple([_normalize(v) for v in value])
+    if isinstance(value, float): return repr(value)
+    return value
+
+def get_parameter_key(par):
+    """Return a normalized tuple of all parameters that influence the result"""
+    return tuple([(p, _normalize(getattr(par, p, None))) for p in RESULT_PARAMETERS] +
+                 [('ion_series', fragments.get_ion_series(par))])
+
+def get_peptide_key(modified_sequence, q1, ssrcalc, transitions, par):
+    """Return the key for the results of a single peptide with the given
+    transitions (a list of (q3, id) tuples)"""
+    return ('peptide', _normalize(modified_sequence), _normalize(q1),
+            _normalize(ssrcalc), _normalize(transitions), get_parameter_key(par))
+
+def get_ssrcalc_key(sequence, ssrcalc_table):
+    """Return the key for the SSRCalc value of an (unmodified) sequence"""
+    return ('ssrcalc', _normalize(ssrcalc_table), _normalize(sequence))
+
+class ResultCache(object):
+    """Pickles results into a directory, addressed by a hash of their key
+
+    The key needs to have a unique repr (e.g. nested tuples of strings and
+    numbers). Writes are atomic, thus several processes can share the same
+    directory. Expired and surplus entries are removed by cleanup, which is
+    called automatically by put at most once every cleanup_interval seconds.
+    If the directory cannot be created or written, the results are not
+    cached (get always misses and put does nothing).
+    """
+
+    def __init__(self, directory, ttl=7*24*3600, maxsize=500*1024*1024,
+                 cleanup_interval=600):
+        self.directory = directory
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.cleanup_interval = cleanup_interval
+        self.hits = 0
+        self.misses = 0
+        self.enabled = True
+        try:
+            if not os.path.isdir(directory): os.makedirs(directory)
+        except OSError:
+            self.enabled = False
+
+    def _filename(self, key):
+        digest = hashlib.sha1(repr(key)).hexdigest()
+        return os.path.join(self.directory, digest[:2], digest + '.pickle')
+
+    def get(self, key, default=None):
+        """Return the result stored under key or default"""
+        if not self.enabled:
+            self.misses += 1
+            return default
+        filename = self._filename(key)
+        try:
+            if time.time() - os.path.getmtime(filename) > self.ttl:
+                self._remove(filename)
+                raise OSError
+            f = open(filename, 'rb')
+            try: stored_key, value = pickle.load(f)
+            finally: f.close()
+        except (IOError, OSError, EOFError, pickle.UnpicklingError):
+            self.misses += 1
+            return default
+        if stored_key != key:
+            # hash collision
+            self.misses += 1
+            return default
+        # mark as recently used (for the eviction)
+        try: os.utime(filename, (time.time(), os.path.getmtime(filename)))
+        except OSError: pass
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        """Store value under key"""
+        if not self.enabled: return
+        filename = self._filename(key)
+        dirname = os.path.dirname(filename)
+        if not os.path.isdir(dirname):
+            try: os.makedirs(dirname)
+            except OSError: pass # created by another process
+        try:
+            fd, tmpname = tempfile.mkstemp(dir=dirname, suffix='.tmp')
+        except (IOError, OSError):
+            # the directory is not writable, continue without caching
+            return
+        f = os.fdopen(fd, 'wb')
+        try:
+            pickle.dump( (key, value), f, pickle.HIGHEST_PROTOCOL)
+        finally:
+            f.close()
+        os.rename(tmpname, filename)
+        try: self._maybe_cleanup()
+        except (IOError, OSError): pass
+
+    def _remove(self, filename):
+        try: os.remove(filename)
+        except OSError: pass
+
+    def _maybe_cleanup(self):
+        stamp = os.path.join(self.directory, '.last_cleanup')
+        try:
+            if time.time() - os.path.getmtime(stamp) < self.cleanup_interval: return
+        except OSError: pass
+        open(stamp, 'w').close()
+        self.cleanup()
+
+    def _entries(self):
+        for dirpath, dirnames, filenames in os.walk(self.directory):
+            for f in filenames:
+                if f.endswith('.pickle'):
+                    yield os.path.join(dirpath, f)
+
+    def cleanup(self):
+        """Remove expired entries and then the least recently used entries
+        until the cache is smaller than maxsize"""
+        now = time.time()
+        entries = []
+        total = 0
+        for filename in self._entries():
+            try: st = os.stat(filename)
+            except OSError: continue
+            if now - st.st_mtime > self.ttl:
+                self._remove(filename)
+                continue
+            entries.append( (st.st_atime, st.st_size, filename) )
+            total += st.st_size
+        entries.sort()
+        for atime, size, filename in entries:
+            if total <= self.maxsize: break
+            self._remove(filename)
+            total -= size
+
+    def clear(self):
+        for filename in self._entries():
+            self._remove(filename)
+
+    def stats(self):
+        return {'hits' : self.hits, 'misses' : self.misses}
@@ -0,0 +1,224 @@
+"""
+ *
+ * Program       : SRMCollider
+ * Author        : Hannes Roest <roest@imsb.biol.ethz.ch>
+ * Date          : 05.02.2011
+ *
+ *
+ * Copyright (C) 2011 - 2012 Hannes Roest
+ *
+ * This library is free software; you can redistribute it and/or
+ * modify it under the terms of the GNU Lesser General Public
+ * License as published by the Free Software Foundation; either
+ * version 2.1 of the License, or (at your option) any later version.
+ *
+ * This library is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+ * Lesser General Public License for more details.
+ *
+ * You should have received a copy of the GNU Lesser General Public
+ * License along with this library; if not, write to the Free Software
+ * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307, USA
+ *
+"""
+
+"""
+Building blocks for running the web interface as a long-running service
+(see cgi-scripts/collider_service.py) instead of starting a new CGI process
+for every request.
+
+ - ThreadLocalOutput: redirects print statements of the request handlers
+   into a separate buffer per thread
+ - ConnectionPool: a pool of database connections shared between threads
+ - BackgroundIndices: in-memory precursor indices of the background
+   peptide tables which are kept warm between requests
+ - RequestMetrics: request counts and latencies
+"""
+
+import sys, time, threading
+import Queue
+from StringIO import StringIO
+
+import precursor_index
+
+class ThreadLocalOutput(object):
+    """A file-like object that writes into a buffer of the current thread.
+
+    Threads that have not called start write into the default stream.
+    """
+
+    def __init__(self, default):
+        self.default = default
+        self._local = threading.local()
+
+    @classmethod
+    def install(cls):
+        """Replace sys.stdout with a ThreadLocalOutput (only once)"""
+        if not isinstance(sys.stdout, cls):
+            sys.stdout = cls(sys.stdout)
+        return sys.stdout
+
+    def _stream(self):
+        return getattr(self._local, 'buffer', None) or self.default
+
+    def start(self):
+        self._local.buffer = StringIO()
+
+    def stop(self):
+        """Stop capturing and return everything written since start"""
+        result = self._local.buffer.getvalue()
+        self._local.buffer = None
+        return result
+
+    def write(self, s):
+        self._stream().write(s)
+
+    def writelines(self, lines):
+        self._stream().writelines(lines)
+
+    def flush(self):
+        self._stream().flush()
+
+class ConnectionPool(object):
+    """A pool of at most size database connections.
+
+    Connections are created by factory when needed and returned to the pool
+    after use, a thread waits if all connections are in use.
+    """
+
+    def __init__(self, factory, size=4):
+        self.factory = factory
+        self.size = size
+        self._created = 0
+        self._lock = threading.Lock()
+        self._idle = Queue.LifoQueue()
+
+    def get(self):
+        try:
+            return self._idle.get_nowait()
+        except Queue.Empty:
+            pass
+        with self._lock:
+            create = self._created < self.size
+            if create: self._created += 1
+        if create:
+            try:
+                return self.factory()
+            except:
+                with self._lock: self._created -= 1
+                raise
+        return self._idle.get()
+
+    def put(self, connection):
+        self._idle.put(connection)
+
+    def discard(self, connection):
+        """Do not return a (broken) connection to the pool"""
+        with self._lock: self._created -= 1
+        try: connection.close()
+        except Exception: pass
+
+class BackgroundIndices(object):
+    """In-memory precursor indices of the background peptide tables.
+
+    An index is loaded for each combination of peptide table and SQL
+    restriction (par.query2_add) when it is first needed and kept in memory
+    afterwards. The interfering precursors are then selected from memory with
+    the same criteria as SRMcollider._get_all_precursors uses in the
+    database.
+    """
+
+    def __init__(self):
+        self._indices = {}
+        # one lock per index that is being loaded, the global lock only
+        # protects the dictionaries
+        self._loading = {}
+        self._lock = threading.Lock()
+
+    def load(self, cursor, table, query_add):
+        """Load (or return the already loaded) index for the table.
+
+        Only the threads that need the same index wait for it to be loaded,
+        the requests for indices that are already in memory are not blocked.
+        """
+        key = (table, query_add)
+        with self._lock:
+            index = self._indices.get(key)
+            if index is not None: return index
+            key_lock = self._loading.setdefault(key, threading.Lock())
+        with key_lock:
+            with self._lock:
+                # another thread may have loaded it in the meantime
+                index = self._indices.get(key)
+            if index is None:
+                cursor.execute("select %s from %s where 1=1 %s" % (
+                    precursor_index.PRECURSOR_VALUES, table, query_add))
+                index = precursor_index.InMemoryPrecursorIndex(cursor.fetchall())
+                with self._lock:
+                    self._indices[key] = index
+                    self._loading.pop(key, None)
+        return index
+
+    def get_all_precursors(self, par, precursor, cursor):
+        """Return the interfering precursors of precursor (in all background
+        tables of par)"""
+        result = []
+        for table in par.peptide_tables:
+            index = self.load(cursor, table, par.query2_add)
+            result.extend(precursor_index.get_interfering_precursors(
+                index, par, precursor, restrict_modifications=False))
+        return result
+
+    def __len__(self):
+        return len(self._indices)
+
+class RequestMetrics(object):
+    """Counts requests and keeps the latencies of the most recent requests
+    per request type"""
+
+    def __init__(self, window=1000):
+        self.window = window
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._counts = {}
+        self._errors = {}
+        self._latencies = {}
+
+    def record(self, kind, latency, error=False):
+        with self._lock:
+            self._counts[kind] = self._counts.get(kind, 0) + 1
+            if error: self._errors[kind] = self._errors.get(kind, 0) + 1
+            recent = self._latencies.setdefault(kind, [])
+            recent.append(latency)
+            if len(recent) > self.window: del recent[0]
+
+    def stats(self):
+        """Return a dictionary with count, errors and latency percentiles (in
+        seconds) of the recent requests for each request type"""
+        result = {}
+        with self._lock:
+            for kind in self._counts:
+                recent = sorted(self._latencies[kind])
+                result[kind] = {
+                    'count'  : self._counts[kind],
+                    'errors' : self._errors.get(kind, 0),
+                    'mean'   : sum(recent) / len(recent),
+                    'p50'    : _percentile(recent, 0.5),
+                    'p95'    : _percentile(recent, 0.95),
+                    'max'    : recent[-1],
+                }
+        return result
+
+    def format(self):
+        """Return the metrics as plain text, one value per line"""
+        lines = ['uptime_seconds %.1f' % (time.time() - self.started)]
+        for kind, values in sorted(self.stats().iteritems()):
+            lines.append('requests{type="%s"} %s' % (kind, values['count']))
+            lines.append('errors{type="%s"} %s' % (kind, values['errors']))
+            for name in ('mean', 'p50', 'p95', 'max'):
+                lines.append('latency_seconds{type="%s",stat="%s"} %.6f' % (kind, name, values[name]))
+        return '\n'.join(lines) + '\n'
+
+def _percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
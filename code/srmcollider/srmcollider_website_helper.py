@@ -1,6 +1,7 @@
-import os, csv
+import os, csv, tempfile
 import collider
 import c_getnonuis
+import result_cache
 
 import DDB
 
@@ -350,18 +351,7 @@ class SRMColliderController():
         par.add_sql_select = ""
         par.select_by = "modified_sequence"
         par.eval()
-        par.query2_add = ''
-        if not oxMet and not Deamid:
-            par.query2_add = ' and modifications = 0 '
-        elif oxMet and not Deamid:
-            par.query2_add = " and modified_sequence not like '%N[115]%' "
-        elif not oxMet and Deamid:
-            par.query2_add = " and modified_sequence not like '%M[147]%' "
-
-        if missed == 0:
-            par.query2_add += ' and missed_cleavages = 0 '
-        if missed == 1:
-            par.query2_add += ' and missed_cleavages <= 1 '
+        par.query2_add = get_query_add(oxMet, Deamid, missed)
 
         par.chargeCheck = chargeCheck
         par.genome = genome
@@ -463,22 +453,48 @@ def getSRMParameter(q1_w, q3_w, ssr_w, high, low, isotope, ions,
     par.transition_table = db_used + '.srmTransitions_' + table_used
     par.__dict__.update( ions )
     par.eval()
-    par.query2_add = ''
+    par.query2_add = get_query_add(oxMet, Deamid, missed)
+    return par
+
+def get_query_add(oxMet, Deamid, missed):
+    """Return the SQL restrictions on the background peptides for the
+    modifications and missed cleavages selected on the website"""
+    query_add = ''
     if not oxMet and not Deamid:
-        par.query2_add = ' and modifications = 0 '
+        query_add = ' and modifications = 0 '
     elif oxMet and not Deamid:
-        par.query2_add = " and modified_sequence not like '%N[115]%' "
+        query_add = " and modified_sequence not like '%N[115]%' "
     elif not oxMet and Deamid:
-        par.query2_add = " and modified_sequence not like '%M[147]%' "
+        query_add = " and modified_sequence not like '%M[147]%' "
 
     if missed == 0:
-        par.query2_add += ' and missed_cleavages = 0 '
+        query_add += ' and missed_cleavages = 0 '
     if missed == 1:
-        par.query2_add += ' and missed_cleavages <= 1 '
+        query_add += ' and missed_cleavages <= 1 '
+    return query_add
 
-    return par
+def get_ssrcalc_values(seqs, input_sequences, default_ssrcalc, cursor, ssrcalc_path,
+                       cache=None):
+    """Return a dictionary of the SSRCalc values of the (unmodified) input sequences.
 
-def get_ssrcalc_values(seqs, input_sequences, default_ssrcalc, cursor, ssrcalc_path):
+    If a ResultCache is given, the values are looked up there first and
+    newly calculated values are stored in it.
+    """
+    if cache is not None:
+        cached = {}
+        for s in input_sequences:
+            s = filter(str.isalpha, s)
+            value = cache.get(result_cache.get_ssrcalc_key(s, default_ssrcalc))
+            if value is not None: cached[s] = value
+        if len(cached) == len(set([filter(str.isalpha, s) for s in input_sequences])):
+            return cached
+        pepmap = _get_ssrcalc_values(seqs, input_sequences, default_ssrcalc, cursor, ssrcalc_path)
+        for s, value in pepmap.iteritems():
+            cache.put(result_cache.get_ssrcalc_key(s, default_ssrcalc), value)
+        return pepmap
+    return _get_ssrcalc_values(seqs, input_sequences, default_ssrcalc, cursor, ssrcalc_path)
+
+def _get_ssrcalc_values(seqs, input_sequences, default_ssrcalc, cursor, ssrcalc_path):
     if default_ssrcalc != '':
         ssr_query = """
         select sequence, ssrcalc
@@ -497,24 +513,31 @@ def get_ssrcalc_values(seqs, input_sequences, default_ssrcalc, cursor, ssrcalc_p
     # TODO: the used version in the TPP is 3.0 which is old and cannot be used
     # any more online. It makes it hard to compare. Is there a new pl script?
 
-    # SSRCalc finds the parameter file with ENV
-    shellfile = '/tmp/ssrfile%s.sh' % os.getpid()
-    outfile = '/tmp/ssrout%s.out' % os.getpid()
+    # SSRCalc finds the parameter file with ENV. The files need unique names
+    # since several requests may be handled at the same time (in threads of
+    # the same process).
+    fd, shellfile = tempfile.mkstemp(prefix='ssrfile', suffix='.sh')
+    os.close(fd)
+    fd, outfile = tempfile.mkstemp(prefix='ssrout', suffix='.out')
+    os.close(fd)
     env = {'SSRCalc' : ssrcalc_path } 
     cmd = """/SSRCalc3.pl --alg 3.0 --seq "%s" --output tsv --B 1 --A 0 > """ % " / ".join(not_found)
     cmd = ssrcalc_path + cmd + outfile
 
-    f = open(shellfile, 'w')
-    f.write(cmd)
-    f.close()
-
-    os.spawnlpe(os.P_WAIT, "/bin/bash", "bash", shellfile, env)
-    r = csv.reader( open(outfile), delimiter='\t')
-    for line in r:
-        pepmap[line[0]] = float(line[2])
-
-    os.system("rm %s" % shellfile)
-    os.system("rm %s" % outfile)
+    try:
+        f = open(shellfile, 'w')
+        f.write(cmd)
+        f.close()
+
+        os.spawnlpe(os.P_WAIT, "/bin/bash", "bash", shellfile, env)
+        f = open(outfile)
+        r = csv.reader(f, delimiter='\t')
+        for line in r:
+            pepmap[line[0]] = float(line[2])
+        f.close()
+    finally:
+        os.remove(shellfile)
+        os.remove(outfile)
     return pepmap
 
 def unique_values(seq): 
@@ -23,20 +23,234 @@
  *
 """
 
-# Get a list of all non-UIS combinations (using c++ if possible)
-def get_nonuis_list(collisions_per_peptide, MAX_UIS):
+import backends
+import profiling
+
+# Get a list of all non-UIS combinations (using c++ if possible, see backends.py)
+@profiling.profiled('nonuis')
+def get_nonuis_list(collisions_per_peptide, MAX_UIS, par=None):
     non_uis_list = [set() for i in range(MAX_UIS+1)]
-    try:
-        import c_getnonuis
-        for order in range(1,MAX_UIS+1):
-                non_uis_list[order] = c_getnonuis.get_non_uis(
-                    collisions_per_peptide, order)
-    except ImportError:
-        for pepc in collisions_per_peptide.values():
-            for i in range(1,MAX_UIS+1):
-                get_non_uis(pepc, non_uis_list[i], i)
+    calculate_nonuis = backends.get_backends(par).get('nonuis')
+    for order in range(1,MAX_UIS+1):
+        non_uis_list[order] = calculate_nonuis(collisions_per_peptide, order)
     return non_uis_list 
 
+# Count the non-UIS combinations for each order without enumerating them
+@profiling.profiled('nonuis')
+def get_nonuis_counts(collisions_per_peptide, MAX_UIS):
+    """Return a list whose entry at position order is the number of non-UIS
+    combinations of this order, e.g. len(get_nonuis_list(...)[order]).
+
+    The interfered transitions of each peptide are stored as a bitmask and
+    only the distinct, maximal masks are kept. The size of the union of all
+    order-sized subsets of these masks is then counted directly.
+    """
+    bits = {}
+    masks = set()
+    for pepc in collisions_per_peptide.values():
+        m = 0
+        for t in pepc:
+            if not bits.has_key(t): bits[t] = 1 << len(bits)
+            m |= bits[t]
+        masks.add(m)
+    masks = _maximal_masks(masks)
+    result = [0 for i in range(MAX_UIS+1)]
+    for order in range(1,MAX_UIS+1):
+        result[order] = _count_subset_union(masks, order, {})
+    return result
+
+# Below this number of subsets, _count_subset_union collects them in a set
+_ENUMERATE_LIMIT = 100000
+
+def _popcount(m):
+    return bin(m).count('1')
+
+def _nchoosek(n, k):
+    # exact integer version of choose
+    if k > n: return 0
+    result = 1
+    for i in range(k):
+        result = result * (n - i) / (i + 1)
+    return result
+
+def _maximal_masks(masks):
+    """Remove duplicate masks and masks that are contained in another mask,
+    returns the masks sorted by decreasing number of bits"""
+    result = []
+    for m in sorted(set(masks), key=_popcount, reverse=True):
+        for other in result:
+            if m & other == m: break
+        else: result.append(m)
+    return result
+
+def _count_subset_union(masks, order, cache):
+    """Count the distinct subsets of size order of all masks.
+
+    Each mask contributes its subsets that are not subsets of any previous
+    mask. The subsets shared with a previous mask are exactly the subsets of
+    their intersection, thus the same function is used to count them.
+    """
+    masks = _maximal_masks([m for m in masks if _popcount(m) >= order])
+    key = tuple(masks)
+    if cache.has_key(key): return cache[key]
+    if sum([_nchoosek(_popcount(m), order) for m in masks]) < _ENUMERATE_LIMIT:
+        # few subsets, it is cheaper to collect them directly (as bitmasks)
+        subsets = set()
+        for m in masks:
+            bits = [1 << i for i in range(m.bit_length()) if m & (1 << i)]
+            subsets.update([sum(c) for c in combinations(bits, order)])
+        cache[key] = len(subsets)
+        return cache[key]
+    total = 0
+    for i, m in enumerate(masks):
+        total += _nchoosek(_popcount(m), order)
+        if i > 0:
+            total -= _count_subset_union([m & other for other in masks[:i]], order, cache)
+    cache[key] = total
+    return total
+
+def calculate_eUIS(N, ssrcalcvalues, strike3_ssrcalcwindow):
+    """Find the combinations of transitions that coelute (strike 3 of eUIS).
+
+    ssrcalcvalues contains for each transition the (retention time) values
+    where an interfering peptide elutes, N the number of values of each
+    transition. A set of transitions coelutes if each of them has a value
+    such that all these values lie within strike3_ssrcalcwindow.
+
+    All values are merged into one stream sorted by retention time and a
+    window of width strike3_ssrcalcwindow is slid over it, starting at each
+    value. The transitions present in the window are kept as a bitmask. Each
+    maximal coeluting set is returned once (as a sorted list of transition
+    indices). The subsets of these sets are the same as the ones of the
+    result of collider.thisthirdstrike and c_getnonuis.calculate_eUIS which
+    also return non-maximal sets.
+    """
+    events = []
+    for t, values in enumerate(ssrcalcvalues):
+        events.extend([ (v, t) for v in values[:N[t]] ])
+    events.sort()
+    nr_events = len(events)
+    counts = [0 for t in ssrcalcvalues]
+    window = 0
+    candidates = []
+    added = removed = False
+    left = right = 0
+    while left < nr_events:
+        start = events[left][0]
+        while right < nr_events and not (events[right][0] - start > strike3_ssrcalcwindow):
+            t = events[right][1]
+            if counts[t] == 0:
+                window |= 1 << t
+                added = True
+            counts[t] += 1
+            right += 1
+        # Without a new transition the window is a subset of the previous
+        # set, without a removed one the previous set is a subset of it.
+        if added:
+            if candidates and not removed: candidates.pop()
+            candidates.append(window)
+            added = removed = False
+        while left < nr_events and events[left][0] == start:
+            t = events[left][1]
+            counts[t] -= 1
+            if counts[t] == 0:
+                window &= ~(1 << t)
+                removed = True
+            left += 1
+
+    # sets may still be contained in a set that is found later or earlier
+    maximal = set(_maximal_masks(candidates))
+    result = []
+    for m in candidates:
+        if not m in maximal: continue
+        maximal.remove(m)
+        result.append([t for t in range(m.bit_length()) if m & (1 << t)])
+    return result
+
+def annotate_interferences(precursor, interfering_precursors, collisions_per_peptide):
+    """Annotate each interfering peptide with its distance to the precursor.
+
+    Returns a list of tuples (transition_group, ssrcalc, rt_distance,
+    q1_distance, transitions) for each peptide (transition group) in
+    collisions_per_peptide. The distances are absolute, the Q1 distance is the
+    one of the closest interfering precursor of the peptide.
+    """
+    closest = {}
+    for p in interfering_precursors:
+        if not collisions_per_peptide.has_key(p.transition_group): continue
+        q1_distance = abs(p.q1 - precursor.q1)
+        if closest.has_key(p.transition_group) and closest[p.transition_group][1] <= q1_distance: continue
+        closest[p.transition_group] = (p, q1_distance)
+    result = []
+    for transition_group, transitions in collisions_per_peptide.iteritems():
+        p, q1_distance = closest[transition_group]
+        result.append( (transition_group, p.ssrcalc, abs(p.ssrcalc - precursor.ssrcalc),
+                        q1_distance, transitions) )
+    return result
+
+def select_interferences(annotated, max_rt_distance=None, max_q1_distance=None):
+    """Select the annotated interferences (see annotate_interferences) within
+    the given distances, returns a collisions_per_peptide dictionary"""
+    return dict([ (a[0], a[4]) for a in annotated
+                 if (max_rt_distance is None or a[2] <= max_rt_distance)
+                 and (max_q1_distance is None or a[3] <= max_q1_distance)])
+
+def get_three_strike_nonuis(precursor, transitions, interfering_precursors, par,
+    order, strike3_ssrcalcwindow, local_ssrcalc_window=None, contamination_allow=0):
+    """Compute the combinations of transitions of the given order that are
+    excluded by each of the three strikes of the eUIS:
+
+        1. global UIS: no interfering peptide in the whole neighbourhood
+           interferes with all transitions of the combination
+        2. locally clean: at most contamination_allow transitions of the
+           combination are interfered by a peptide within
+           local_ssrcalc_window (skipped if local_ssrcalc_window is None)
+        3. no coelution: the transitions are not interfered by different
+           peptides that elute within strike3_ssrcalcwindow
+
+    The fragments of the interfering precursors are matched only once, all
+    strikes are derived from the annotated interferences. Returns three sets
+    of combinations (sorted tuples of transition ids).
+    """
+    implementations = backends.get_backends(par)
+    calculate_nonuis = implementations.get('nonuis')
+    q3_low, q3_high = par.get_q3range_transitions()
+    with profiling.timer('collisions'):
+        collisions_per_peptide = implementations.get('collisions_per_peptide')(
+            transitions, interfering_precursors, par, q3_low, q3_high)
+        annotated = annotate_interferences(precursor, interfering_precursors, collisions_per_peptide)
+    profiling.observe('collisions_per_query', len(collisions_per_peptide))
+
+    with profiling.timer('nonuis'):
+        strike1 = set(calculate_nonuis(select_interferences(annotated), order))
+
+    strike2 = set()
+    if local_ssrcalc_window is not None:
+        dirty = set()
+        for v in select_interferences(annotated, local_ssrcalc_window).values():
+            dirty.update(v)
+        for c in combinations(sorted([t[1] for t in transitions]), order):
+            if len([t for t in c if t in dirty]) > contamination_allow: strike2.add(c)
+
+    # for each transition the retention times of the peptides interfering with it
+    ssrcalcvalues = [ [] for t in transitions]
+    for a in annotated:
+        for tr in a[4]: ssrcalcvalues[tr].append(a[1])
+    for v in ssrcalcvalues: v.sort()
+    N = [len(v) for v in ssrcalcvalues]
+    with profiling.timer('euis'):
+        coeluting = implementations.get('euis')(N, ssrcalcvalues, strike3_ssrcalcwindow)
+    with profiling.timer('nonuis'):
+        strike3 = set(calculate_nonuis(dict(enumerate([list(c) for c in coeluting])), order))
+    return strike1, strike2, strike3
+
+def get_maximal_combinations(combinations):
+    """Return the combinations (sequences of transition indices) that are not
+    contained in another one, as sorted tuples"""
+    bits = [sum([1 << t for t in c]) for c in combinations]
+    return sorted([tuple([t for t in range(m.bit_length()) if m & (1 << t)])
+                   for m in _maximal_masks(bits)])
+
 def get_non_uis(pepc, non_uis, order):
     if len( pepc ) >= order: 
         non_uis.update( [tuple(sorted(p)) for p in combinations(pepc, order)] )
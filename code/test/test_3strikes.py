@@ -8,6 +8,7 @@ sys.path.extend(['.', '..', '../external/', 'external/'])
 
 from srmcollider import uis_functions
 from srmcollider.collider import thisthirdstrike
+from srmcollider.precursor import Precursor
 
 from nose.plugins.attrib import attr
 
@@ -95,6 +96,87 @@ class Test_3strikes(unittest.TestCase):
         self.assertTrue((1,3) not in expanded[2])
         self.assertTrue((0,1,2) in expanded[3])
 
+    def test_calculate_eUIS(self):
+        ssrcalcvalues  = self.ssrcalcvalues_four_example  
+        N = [len(v) for v in ssrcalcvalues]
+        # only the maximal combinations are returned
+        self.assertEqual(uis_functions.calculate_eUIS(N, ssrcalcvalues, 1.0),
+                         [[0, 1, 3], [0, 1, 2]])
+        self.assertEqual(uis_functions.calculate_eUIS(N, ssrcalcvalues, 0.3),
+                         [[0, 3], [0, 1, 2]])
+        self.assertEqual(uis_functions.calculate_eUIS([0, 0], [[], []], 1.0), [])
+        self.assertEqual(uis_functions.calculate_eUIS([1, 0, 2], [[2.0], [], [1.0, 2.0]], 0.0),
+                         [[0, 2]])
+
+    def test_calculate_eUIS_random(self):
+        # the same maximal combinations as thisthirdstrike
+        import random
+        random.seed(11)
+        for i in range(500):
+            ssrcalcvalues = [sorted([random.choice([round(random.uniform(0, 10), 1), 2.0, 3.0])
+                for j in range(random.randint(0, 5))]) for t in range(random.randint(1, 7))]
+            N = [len(v) for v in ssrcalcvalues]
+            for window in [0.0, 0.3, 1.0, 2.5]:
+                result = uis_functions.calculate_eUIS(N, ssrcalcvalues, window)
+                self.assertEqual(sorted([tuple(c) for c in result]), uis_functions.get_maximal_combinations(
+                    thisthirdstrike(N, ssrcalcvalues, window).keys()))
+
+    def test_annotate_interferences(self):
+        from srmcollider.precursor import Precursor
+        precursor = Precursor(transition_group=1, q1=500.0, ssrcalc=20.0)
+        interfering = [Precursor(transition_group=2, q1=501.0, ssrcalc=25.0),
+                       Precursor(transition_group=2, q1=500.5, ssrcalc=25.0),
+                       Precursor(transition_group=3, q1=499.0, ssrcalc=18.0),
+                       Precursor(transition_group=4, q1=499.5, ssrcalc=20.0)]
+        annotated = uis_functions.annotate_interferences(precursor, interfering,
+            {2 : [0, 1], 3 : [1]})
+        self.assertEqual(sorted(annotated), [(2, 25.0, 5.0, 0.5, [0, 1]), (3, 18.0, 2.0, 1.0, [1])])
+        self.assertEqual(uis_functions.select_interferences(annotated), {2 : [0, 1], 3 : [1]})
+        self.assertEqual(uis_functions.select_interferences(annotated, 3.0), {3 : [1]})
+        self.assertEqual(uis_functions.select_interferences(annotated, None, 0.5), {2 : [0, 1]})
+
+    def test_three_strike_nonuis(self):
+        import random
+        import test_shared
+        from srmcollider import backends
+        random.seed(3)
+        par = test_shared.get_default_setup_parameters()
+        precursor = test_shared.runpep_obj1
+        interfering = []
+        for p in test_shared.runprecursors_obj1:
+            p = Precursor(modified_sequence=p.modified_sequence, transition_group=p.transition_group,
+                q1_charge=p.q1_charge, isotopically_modified=p.isotopically_modified,
+                q1=precursor.q1 + random.uniform(-1, 1), ssrcalc=precursor.ssrcalc + random.uniform(-5, 5))
+            interfering.append(p)
+        q3_low, q3_high = par.get_q3range_transitions()
+        transitions = precursor.calculate_transitions(q3_low, q3_high)
+
+        # compute each strike separately
+        collisions_per_peptide = backends.load('collisions_per_peptide', 'python')(
+            transitions, interfering, par, q3_low, q3_high)
+        ssrcalc = dict([ (p.transition_group, p.ssrcalc) for p in interfering])
+        ssrcalcvalues = [ [] for t in transitions]
+        for k, v in collisions_per_peptide.iteritems():
+            for tr in v: ssrcalcvalues[tr].append(ssrcalc[k])
+        ssrcalcvalues = [sorted(v) for v in ssrcalcvalues]
+        coeluting = thisthirdstrike([len(v) for v in ssrcalcvalues], ssrcalcvalues, 1.0)
+        local = set()
+        for k, v in collisions_per_peptide.iteritems():
+            if abs(ssrcalc[k] - precursor.ssrcalc) <= 2.0: local.update(v)
+
+        for order in [1, 2, 3]:
+            strike1, strike2, strike3 = uis_functions.get_three_strike_nonuis(precursor,
+                transitions, interfering, par, order, 1.0, 2.0, 1)
+            self.assertEqual(strike1, uis_functions.get_nonuis_list(collisions_per_peptide, order)[order])
+            self.assertEqual(strike2, set([c for c in uis_functions.combinations(range(len(transitions)), order)
+                                           if len([t for t in c if t in local]) > 1]))
+            self.assertEqual(strike3, uis_functions.get_nonuis_list(
+                dict(enumerate([list(c) for c in coeluting])), order)[order])
+            self.assertTrue(len(strike1) > 0)
+            self.assertTrue(len(strike3) >= len(strike1))
+        self.assertEqual(uis_functions.get_three_strike_nonuis(precursor,
+            transitions, interfering, par, 2, 1.0)[1], set())
+
     @attr('cpp')
     def test_cpp_implementation(self):
         strike3_ssrcalcwindow = 0.3
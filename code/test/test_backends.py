@@ -0,0 +1,198 @@
+"""
+This file tests the functionality of the backends.py module. All backends
+that are available are run on the same input and have to give the same
+results.
+"""
+import sys, unittest
+sys.path.extend(['.', '..', '../external/', 'external/'])
+from srmcollider import backends, uis_functions
+
+import test_shared
+
+def _run_all(operation, *args):
+    """Run all available implementations of operation, returns a dictionary
+    with the result of each backend"""
+    results = {}
+    for name in backends.available(operation):
+        results[name] = backends.load(operation, name)(*args)
+    return results
+
+def _rounded(transitions):
+    return sorted([ (round(t[0], 6), t[1], t[2], t[3]) for t in transitions])
+
+def _sorted_values(collisions_per_peptide):
+    return dict([ (k, sorted(v)) for k, v in collisions_per_peptide.iteritems()])
+
+class Test_registry(unittest.TestCase):
+
+    def test_fallback_order(self):
+        self.assertEqual(backends.get_fallback_order('auto'), ['cpp', 'numpy', 'python'])
+        self.assertEqual(backends.get_fallback_order('numpy'), ['numpy', 'python'])
+        self.assertEqual(backends.get_fallback_order('cpp', allow_cpp=False), ['numpy', 'python'])
+        self.assertEqual(backends.get_fallback_order('python'), ['python'])
+        self.assertRaises(backends.BackendError, backends.get_fallback_order, 'fortran')
+
+    def test_python(self):
+        impl = backends.Backends('python')
+        for op in backends.OPERATIONS:
+            self.assertEqual(impl.name(op), 'python')
+        report = impl.report()
+        for op in backends.OPERATIONS:
+            self.assertTrue(op in report)
+
+    def test_auto(self):
+        impl = backends.Backends('auto')
+        for op in backends.OPERATIONS:
+            available = backends.available(op)
+            if available: self.assertEqual(impl.name(op), available[0])
+            else: self.assertEqual(impl.name(op), None)
+
+    def test_unavailable(self):
+        if not 'cpp' in backends.available('collisions_per_peptide'):
+            self.assertRaises(backends.BackendError, backends.Backends, 'cpp')
+        # without C++ the same as the numpy backend
+        impl = backends.Backends('cpp', allow_cpp=False)
+        self.assertEqual(repr(impl), repr(backends.Backends('numpy')))
+
+    def test_get_backends(self):
+        par = test_shared.get_default_setup_parameters()
+        self.assertEqual(par.backend, 'auto')
+        self.assertTrue(par.get_backends() is backends.get_backends(par))
+        par.backend = 'python'
+        self.assertEqual(par.get_backends().name('transitions'), 'python')
+        self.assertEqual(backends.get_backends(par, allow_cpp=False).preferred, 'python')
+
+class Test_differential(unittest.TestCase):
+
+    def setUp(self):
+        self.par = test_shared.get_default_setup_parameters()
+
+    def test_transitions(self):
+        peptides = [ (p[0], p[1], p[2]) for p in test_shared.runprecursors1[:50]]
+        results = _run_all('transitions', peptides, [1,2], 300, 1500)
+        self.assertTrue(len(results) >= 2)
+        reference = _rounded(results['python'])
+        self.assertTrue(len(reference) > 0)
+        for name, result in results.iteritems():
+            self.assertEqual(_rounded(result), reference, name)
+
+    def test_collisions_per_peptide(self):
+        example = test_shared.ThreePeptideExample
+        transitions = tuple([ (t[0], i) for i, t in enumerate(
+            backends.load('transitions', 'python')(
+            ((example.precursor.q1, example.precursor.modified_sequence, -1),),
+            [1], 400, 1400))])
+        results = _run_all('collisions_per_peptide', transitions,
+            example.interfering_precursors, self.par, 400, 1400)
+        self.assertTrue(len(results) >= 2)
+        for name, result in results.iteritems():
+            self.assertEqual(_sorted_values(result), {665: [4], 618: [0, 2]}, name)
+
+    def test_collisions_per_peptide_background(self):
+        transitions = test_shared.runpep_obj1.calculate_transitions(400, 1400)
+        results = _run_all('collisions_per_peptide', transitions,
+            test_shared.runprecursors_obj1, self.par, 400, 1400)
+        reference = _sorted_values(results['python'])
+        self.assertTrue(len(reference) > 0)
+        for name, result in results.iteritems():
+            self.assertEqual(_sorted_values(result), reference, name)
+
+    def test_get_coll_per_peptide_from_precursors(self):
+        # the whole path through collider (fragments and matching) with each backend
+        from srmcollider import collider
+        mycollider = collider.SRMcollider()
+        example = test_shared.ThreePeptideExample
+        q3_low, q3_high = self.par.get_q3range_transitions()
+        for precursor, background, expected in [
+            (example.precursor, example.interfering_precursors, {665: [4], 618: [0, 2]}),
+            (test_shared.runpep_obj1, test_shared.runprecursors_obj1, None)]:
+            transitions = precursor.calculate_transitions(q3_low, q3_high)
+            results = {}
+            for name in backends.available('collisions_per_peptide'):
+                par = test_shared.get_default_setup_parameters()
+                par.backend = name
+                results[name] = _sorted_values(collider.get_coll_per_peptide_from_precursors(
+                    mycollider, transitions, background, par, precursor))
+            self.assertTrue(len(results) >= 2)
+            if expected is None: expected = results['python']
+            self.assertTrue(len(expected) > 0)
+            for name, result in results.iteritems():
+                self.assertEqual(result, expected, name)
+
+    def test_collisions_q3_range_edges(self):
+        # Fragments just outside [q3_low, q3_high] still interfere with the
+        # transitions at the edges of the range (c_getnonuis does not restrict
+        # the fragments at all), all backends have to find them.
+        from srmcollider import collider
+        mycollider = collider.SRMcollider()
+        example = test_shared.ThreePeptideExample
+        background = example.interfering_precursors
+        for ppm in [False, True]:
+            par = test_shared.get_default_setup_parameters()
+            par.ppm = ppm
+            if ppm: par.q3_window = 20
+            fragments = sorted(mycollider._calculate_fragment_masses(background, par,
+                mycollider.R, 0, 10**6, mycollider.RN15))
+            low, high = fragments[len(fragments) // 4][0], fragments[3 * len(fragments) // 4][0]
+            window = par.q3_window * 10**(-6) * low if ppm else par.q3_window
+            # the transitions are inside the range, the fragments low and high
+            # are outside but within the Q3 window of a transition
+            q3_low, q3_high = low + 0.6 * window, high - 0.6 * window
+            transitions = ((q3_low + 0.1 * window, 0), (q3_low + 3.0, 1),
+                           (q3_high - 0.1 * window, 2))
+            expected = {}
+            for q3, q1, zero, key in fragments:
+                for t in transitions:
+                    w = par.q3_window * 10**(-6) * t[0] if ppm else par.q3_window
+                    if abs(t[0] - q3) <= w and t[1] not in expected.setdefault(key, []):
+                        expected[key].append(t[1])
+            expected = _sorted_values(dict([ (k, v) for k, v in expected.iteritems() if v]))
+            self.assertTrue(0 in reduce(lambda a, b: a + b, expected.values()))
+            self.assertTrue(2 in reduce(lambda a, b: a + b, expected.values()))
+            results = _run_all('collisions_per_peptide', transitions, background, par, q3_low, q3_high)
+            self.assertTrue(len(results) >= 2)
+            for name, result in results.iteritems():
+                self.assertEqual(_sorted_values(result), expected, name)
+
+    def test_nonuis(self):
+        for collisions_per_peptide, lennonuis in [
+            (test_shared.refcollperpep1, test_shared.lennonuis1),
+            (test_shared.refcollperpep2, test_shared.lennonuis2)]:
+            for order in range(1, 6):
+                results = _run_all('nonuis', collisions_per_peptide, order)
+                reference = set(results['python'])
+                self.assertEqual(len(reference), lennonuis[order-1])
+                for name, result in results.iteritems():
+                    self.assertEqual(set(result), reference, name)
+
+    def test_euis(self):
+        ssrcalcvalues = [ [1, 5, 8, 8.5], [1.5, 8.2], [2.1, 5.1, 8.1], [1.0] ]
+        N = [len(v) for v in ssrcalcvalues]
+        for window in [0.3, 1.0]:
+            results = _run_all('euis', N, ssrcalcvalues, window)
+            # c_getnonuis also returns combinations that are contained in others
+            reference = uis_functions.get_maximal_combinations(results['python'])
+            self.assertTrue(len(reference) > 0)
+            for name, result in results.iteritems():
+                self.assertEqual(uis_functions.get_maximal_combinations(result), reference, name)
+
+    def test_rangetree(self):
+        import random
+        random.seed(7)
+        tuples = tuple([ (0, 0, i, random.choice([2, 3]), random.uniform(400, 600),
+            random.choice([10.0, 12.5, 20.0, random.uniform(0, 50)])) for i in range(2000)])
+        trees = {}
+        for name in backends.available('rangetree'):
+            trees[name] = backends.load('rangetree', name)()
+            trees[name].create_tree(tuples)
+        self.assertTrue(len(trees) >= 2)
+        for q1 in [400.0, 450.5, tuples[17][4], 599.0]:
+            for rt_low, rt_high in [(0, 50), (10.0, 12.5), (tuples[17][5], 30.0)]:
+                for isotopes in [0, 3]:
+                    args = (q1 - 1.0, rt_low, q1 + 1.0, rt_high, isotopes, isotopes * 1.0033 / 2)
+                    reference = sorted(trees['python'].query_tree(*args))
+                    for name, tree in trees.iteritems():
+                        self.assertEqual(sorted(tree.query_tree(*args)), reference, name)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+"""
+This file tests the functionality of the bulk_loader.py module.
+"""
+import sys, unittest
+sys.path.extend(['.', '..', '../external/', 'external/'])
+import sqlite3, re, itertools
+
+from srmcollider import bulk_loader, Residues, DDB
+
+peptides = [ (0, 'PEPTIDEK', 10.0), (2, 'MNCMKPNR', 12.5), (3, 'GALEMNRK', 20.0),
+             (5, 'KLMNQ' * 20 , 30.0) ]
+
+class Test_bulk_loader(unittest.TestCase):
+
+    def setUp(self):
+        self.options = bulk_loader.LoaderOptions(oxidize_methionines=True,
+            deamidate_asparagine=True, max_nr_modifications=3)
+
+    def test_masses(self):
+        # the same masses as DDB.Peptide
+        for type, isotope in [('mono', Residues.NOISOTOPEMODIFICATION),
+                              ('N15', Residues.N15_ISOTOPEMODIFICATION)]:
+            R = Residues.get_residues(type)
+            self.options.isotope_modification = isotope
+            for key, sequence, ssrcalc in peptides[:3]:
+                for modified_sequence, modifications, mc, precursors in \
+                  bulk_loader.get_variants(sequence, self.options):
+                    peptide = DDB.Peptide()
+                    peptide.set_sequence(modified_sequence)
+                    self.assertEqual(mc, peptide.missed_cleavages())
+                    for charge, q1 in precursors:
+                        peptide.charge = charge
+                        peptide.create_fragmentation_pattern(R)
+                        # derived from the unmodified mass with the modification deltas
+                        self.assertAlmostEqual(q1, peptide.charged_mass, places=9)
+
+    def test_variants(self):
+        variants = bulk_loader.get_variants('MNCMKPNR', self.options)
+        self.assertEqual(variants[0][:3], ('MNC[160]MKPNR', 0, 0))
+        self.assertEqual(len(variants), 15)
+        self.assertTrue(('M[147]N[115]C[160]MKPNR', 2, 0) in [v[:3] for v in variants])
+        self.assertEqual(bulk_loader.count_missed_cleavages('GALEMNRK'), 1)
+
+    def test_iterate_modifications(self):
+        # the same variants in the same order as the original create_db.py,
+        # which replaced the residues in the sequence strings
+        def get_all_modifications(sequence, to_modify, replace_with, max_nr):
+            positions = [m.start() for m in re.finditer(to_modify, sequence)]
+            for i in range(1, min(max_nr, 1+len(positions))):
+                for comb in itertools.combinations(positions, i):
+                    it = 0
+                    curr_seq = ''
+                    for pos in comb:
+                        curr_seq += sequence[it:pos] + replace_with
+                        it = pos+1
+                    yield curr_seq + sequence[it:], i
+        def get_all_modified_peptides(sequence, ox, deam, max_nr):
+            modified = []
+            if ox: modified = list(get_all_modifications(sequence, 'M', 'M[147]', max_nr))
+            if deam:
+                toappend = []
+                for seq, nr in modified:
+                    for seq_new, nr_new in get_all_modifications(seq, 'N', 'N[115]', max_nr):
+                        toappend.append( (seq_new, nr + nr_new) )
+                modified.extend(toappend)
+                modified.extend(get_all_modifications(sequence, 'N', 'N[115]', max_nr))
+            return [m for m in modified if not m[1] > max_nr]
+
+        for sequence in ['MNMNMNMNK', 'PEPTIDEK', 'MMMM', 'NCNCN', 'MC[160]N']:
+            tokens = [Residues.residue_tokens[c] for c in Residues.encode_sequence(sequence)]
+            for ox, deam, max_nr in itertools.product([True, False], [True, False], [1, 2, 3, 5]):
+                self.options.oxidize_methionines = ox
+                self.options.deamidate_asparagine = deam
+                self.options.max_nr_modifications = max_nr
+                variants = []
+                for nr, replaced in bulk_loader.iterate_modifications(tokens, self.options):
+                    modified = tokens[:]
+                    for pos, modification in replaced: modified[pos] = modification[1]
+                    variants.append( (''.join(modified), nr) )
+                self.assertEqual(variants, get_all_modified_peptides(sequence, ox, deam, max_nr))
+                self.assertEqual(len(set(variants)), len(variants))
+
+    def test_load_sqlite(self):
+        self.options.mass_cutoff = 1000
+        conn = sqlite3.connect(':memory:')
+        writer = bulk_loader.SqliteWriter(conn, 'srmPeptides_load')
+        nr_rows, nr_skipped = bulk_loader.load_peptides(iter(peptides), writer, self.options)
+        rows = conn.execute("select * from srmPeptides_load order by parent_id").fetchall()
+        self.assertEqual(len(rows), nr_rows)
+        self.assertEqual([r[0] for r in rows], range(1, nr_rows+1))
+        self.assertEqual(rows[0][1:4], (0, 'PEPTIDEK', 2))
+        self.assertTrue(all([r[4] <= 1000 for r in rows]))
+        # the charge states of one variant share the transition group
+        groups = {}
+        for r in rows: groups.setdefault(r[9], set()).add(r[2])
+        self.assertTrue(all([len(v) == 1 for v in groups.values()]))
+        indices = [r[1] for r in conn.execute("pragma index_list(srmPeptides_load)")
+                   if not r[1].startswith('sqlite_autoindex')]
+        self.assertEqual(sorted(indices), ['srmPeptides_load' + c for c in sorted(bulk_loader.INDEXED_COLUMNS)])
+
+        # the same rows with several processes
+        par_rows = list(bulk_loader.create_rows(iter(peptides), self.options,
+                                                processes=3, chunksize=1))
+        self.assertEqual(par_rows, [tuple(r) for r in rows])
+
+    def test_skip_long_sequences(self):
+        # the charge 3 precursor of the long peptide is below the mass cutoff
+        # but the sequence does not fit into the table, it is counted
+        stats = {}
+        rows = list(bulk_loader.create_rows(iter([ (0, 'G' * 260, 10.0), (1, 'PEPTIDEK', 20.0)]),
+                                            bulk_loader.LoaderOptions(), stats=stats))
+        self.assertEqual(stats, {'skipped' : 1})
+        self.assertEqual([(r[0], r[1], r[3], r[9]) for r in rows], [(1, 1, 2, 2), (2, 1, 3, 2)])
+
+    def test_format_infile_row(self):
+        row = (1, 2, 'PEPTIDEK', 2, 465.234813795001, 10.0 / 3, 0, 0, 0, 1)
+        line = bulk_loader.format_infile_row(row)
+        values = line.rstrip('\n').split('\t')
+        self.assertEqual(values[2], 'PEPTIDEK')
+        self.assertEqual(float(values[4]), row[4])
+        self.assertEqual(float(values[5]), row[5])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -6,7 +6,7 @@ from nose.plugins.attrib import attr
 
 import sys, time, unittest
 sys.path.extend(['.', '..', '../external/', 'external/'])
-from srmcollider import collider
+from srmcollider import collider, backends
 from srmcollider.Residues import Residues
 from srmcollider.precursor import Precursor
 
@@ -214,6 +214,75 @@ class Test_collider_function(unittest.TestCase):
         collider.get_non_uis( [1,2,3,4], test,2 )
         self.assertEqual(test, set([(1, 2), (1, 3), (1, 4), (2, 3), (3, 4), (2, 4)]))
 
+    def test_get_nonuis_counts(self):
+        for collperpep, lennonuis in [ (test_shared.refcollperpep1, test_shared.lennonuis1),
+                                       (test_shared.refcollperpep2, test_shared.lennonuis2)]:
+            counts = collider.get_nonuis_counts(collperpep, 5)
+            self.assertEqual(counts[1:], lennonuis)
+
+        self.assertEqual(collider.get_nonuis_counts({}, 3), [0, 0, 0, 0])
+        collperpep = { 1 : [0, 1, 2, 3], 2 : [2, 3, 4], 3 : [1, 2, 3], 4 : [3, 4, 5, 6, 7] }
+        counts = collider.get_nonuis_counts(collperpep, 5)
+        non_uis_list = collider.get_nonuis_list(collperpep, 5)
+        self.assertEqual(counts, [len(l) for l in non_uis_list])
+
+    def test_get_nonuis_counts_random(self):
+        import random
+        rand = random.Random(42)
+        for i in range(50):
+            collperpep = {}
+            for pep in range(rand.randint(1, 15)):
+                collperpep[pep] = rand.sample(range(12), rand.randint(1, 8))
+            counts = collider.get_nonuis_counts(collperpep, 6)
+            non_uis_list = [set() for order in range(7)]
+            for pepc in collperpep.values():
+                for order in range(1,7):
+                    collider.get_non_uis(pepc, non_uis_list[order], order)
+            self.assertEqual(counts, [len(l) for l in non_uis_list])
+
+    def _collisions_per_peptide_loop(self, transitions, collisions, par):
+        collisions_per_peptide = {}
+        q3_window_used = par.q3_window
+        for t in transitions:
+            if par.ppm: q3_window_used = par.q3_window * 10**(-6) * t[0]
+            for c in collisions:
+                if abs( t[0] - c[0] ) <= q3_window_used:
+                    if collisions_per_peptide.has_key(c[3]):
+                        if not t[1] in collisions_per_peptide[c[3]]:
+                            collisions_per_peptide[c[3]].append( t[1] )
+                    else: collisions_per_peptide[c[3]] = [ t[1] ] 
+        return collisions_per_peptide 
+
+    def test_calculate_collisions_per_peptide(self):
+        for transitions, collisions in [ (transitions_def1, collisions_def1),
+            (transitions_def2, collisions_def2), (transitions_def3, collisions_def3),
+            (transitions_def4, collisions_def4), (transitions_def5, collisions_def5)]:
+            for ppm, q3_window in [ (False, 4.0), (False, 0.5), (True, 20) ]:
+                self.par.ppm = ppm
+                self.par.q3_window = q3_window
+                self.assertEqual(self._collisions_per_peptide_loop(transitions, collisions, self.par), 
+                    collider.calculate_collisions_per_peptide(transitions, collisions, self.par))
+
+    def test_calculate_collisions_per_peptide_random(self):
+        import random
+        rand = random.Random(7)
+        self.par.q3_window = 0.35
+        for i in range(20):
+            transitions = [ (rand.uniform(400, 1400), j) for j in range(rand.randint(1, 20))]
+            collisions = [ (rand.choice(transitions)[0] + rand.choice([-0.35, 0.35, 0.0, rand.uniform(-1, 1)]),
+                            500.0, 0, rand.randint(1, 30)) for j in range(rand.randint(0, 200))]
+            self.assertEqual(self._collisions_per_peptide_loop(transitions, collisions, self.par), 
+                collider.calculate_collisions_per_peptide(transitions, collisions, self.par))
+
+    def test_calculate_collision_pairs(self):
+        self.par.q3_window = 1.0
+        self.par.ppm = False
+        transitions = [ (500.0, 10), (600.0, 11), (700.0, 12)]
+        collisions = [ (601.0, 0, 0, 3), (499.5, 0, 0, 2), (500.9, 0, 0, 3), 
+                       (500.2, 0, 0, 2), (650.0, 0, 0, 4), (701.5, 0, 0, 5)]
+        keys, indices = collider.calculate_collision_pairs(transitions, collisions, self.par)
+        self.assertEqual(zip(keys, indices), [ (2, 0), (3, 0), (3, 1)])
+
     def test_get_non_UIS_from_transitions1(self): 
         oldnon_uis = get_non_UIS_from_transitions_old(self.transitions, self.collisions, 
                                          self.par, self.MAX_UIS)
@@ -408,6 +477,17 @@ class Test_three_peptide_example(unittest.TestCase):
         self.interfering_precursors, self.real_parameters, None, False, False)
       self.assertEqual(collisions_per_peptide, {665: [4], 618: [0, 2]})
 
+    def test_collisions_per_peptide_python_backend(self):
+      """ Test the collisions per peptide with the pure python backend (the
+      fragments are returned as a generator).
+      """
+      q3_low, q3_high = self.real_parameters.get_q3range_transitions()
+      transitions = self.precursor.calculate_transitions(q3_low, q3_high)
+      self.real_parameters.backend = 'python'
+      collisions_per_peptide = collider.get_coll_per_peptide_from_precursors(self.acollider, transitions, 
+        self.interfering_precursors, self.real_parameters, None, False, False)
+      self.assertEqual(collisions_per_peptide, {665: [4], 618: [0, 2]})
+
     def test_collisions_per_peptide_forced_fragment_check(self):
       """ Test to calculate the collisions per peptide when enforcing fragment charge checks.
       Now the y11++ fragment is not allowed any more because a fragment of
@@ -425,8 +505,12 @@ class Test_three_peptide_example(unittest.TestCase):
       collisions_per_peptide = collider.get_coll_per_peptide_from_precursors(self.acollider, 
               transitions, self.interfering_precursors, self.real_parameters, precursor, forceNonCpp=False, 
                forceFragmentChargeCheck=True)
-      ### TODO, forceFragment check will reduce this
-      self.assertEqual(collisions_per_peptide, {665: [4]})
+      if 'cpp' in backends.available('collisions_per_peptide'):
+        ### TODO, forceFragment check will reduce this
+        self.assertEqual(collisions_per_peptide, {665: [4]})
+      else:
+        # without C++ the python (or numpy) backend is used
+        self.assertEqual(collisions_per_peptide, {665: [4], 618: [0]})
 
     def test_min_needed_transitions(self):
 
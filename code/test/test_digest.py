@@ -0,0 +1,58 @@
+"""
+This file tests the functionality of the digest.py module.
+"""
+import sys, unittest
+from StringIO import StringIO
+sys.path.extend(['.', '..', '../external/', 'external/'])
+from srmcollider import digest
+from srmcollider.digest import trypsinize
+
+class Test_digest(unittest.TestCase):
+
+    def test_trypsinize(self):
+        sequence = 'MAPVVISESEEDEDRVAITRRTKPQVHFDGEK'
+        self.assertEqual(list(trypsinize(sequence)),
+            ['MAPVVISESEEDEDR', 'VAITR', 'R', 'TKPQVHFDGEK'])
+        self.assertEqual(list(trypsinize(sequence, 1)),
+            ['MAPVVISESEEDEDR', 'MAPVVISESEEDEDRVAITR', 'VAITR', 'VAITRR', 
+             'R', 'RTKPQVHFDGEK', 'TKPQVHFDGEK'])
+        self.assertEqual(list(trypsinize('')), [])
+
+    def test_enzymes(self):
+        sequence = 'MAPKEPVVIKPSEEDEK'
+        self.assertEqual(list(digest.digest(sequence, 'lysc')), ['MAPK', 'EPVVIKPSEEDEK'])
+        self.assertEqual(list(digest.digest('MAPKAEPEK', 'lysc')), ['MAPK', 'AEPEK'])
+        self.assertEqual(list(digest.digest('MAPKAEPEK', 'gluc')), ['MAPKAEPE', 'K'])
+        self.assertEqual(list(digest.digest('MAPKAEPEK', 'gluc', 1, min_len=2)), ['MAPKAEPE', 'MAPKAEPEK'])
+        # semi-specific, one end is a cleavage site
+        self.assertEqual(list(digest.digest('PEPTKAAR', semi=True, min_len=3)),
+            ['PEPTK', 'PEP', 'PTK', 'PEPT', 'EPTK', 'AAR'])
+
+    def test_read_fasta(self):
+        fasta = StringIO('>1 first\nMAPK\nAEPEK\n\n>2\n>3\nPEPT IDE\n')
+        self.assertEqual(list(digest.read_fasta(fasta)),
+            [('1 first', 'MAPKAEPEK'), ('2', ''), ('3', 'PEPTIDE')])
+
+    def test_digest_proteins(self):
+        import random
+        random.seed(7)
+        proteins = [''.join([random.choice('ACDEKRPLM') for i in range(random.randint(0, 80))])
+                    for k in range(50)]
+        serial = list(digest.digest_proteins(proteins, 'trypsin', 1, min_len=3))
+        expected = []
+        for protein in proteins:
+            expected.extend([p for p in trypsinize(protein, 1) if len(p) >= 3])
+        self.assertEqual(serial, expected)
+        self.assertEqual(list(digest.digest_proteins(proteins, 'trypsin', 1,
+            min_len=3, processes=3, chunksize=4)), serial)
+
+        # the first occurrences, in order
+        unique = []
+        for p in serial:
+            if p not in unique: unique.append(p)
+        self.assertTrue(len(unique) < len(serial))
+        self.assertEqual(list(digest.unique(iter(serial), shards=5)), unique)
+        self.assertEqual(list(digest.unique(iter([]))), [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -81,5 +81,124 @@ class Test_fragmentation(unittest.TestCase):
         for calc, ref in zip(res, self.transitions_12_between300_1500):
             self.assertTrue(abs(calc[0] - ref) < 1e-3)
 
+class Test_residue_encoding(unittest.TestCase):
+
+    def setUp(self):
+        self.R = Residues('mono')
+
+    def _reference_series(self, sequence, R):
+        # fragmentation by parsing the sequence, as done before the encoding
+        import re
+        mass = 0
+        series = []
+        for q in re.finditer( '([A-Z]\[\d*\]|[A-Z])', sequence):
+            mass += R.residues[q.group(0)][1]
+            series.append(mass)
+        return [b + R.mass_H for b in series[:-1]], mass
+
+    def test_encoding(self):
+        from srmcollider import Residues as residues_module
+        peptide = DDB.Peptide()
+        peptide.set_sequence('C[160]EPTIDM[147]EK')
+        codes = peptide.get_encoded_sequence()
+        self.assertEqual([residues_module.residue_tokens[c] for c in codes],
+            ['C[160]', 'E', 'P', 'T', 'I', 'D', 'M[147]', 'E', 'K'])
+        self.assertEqual(codes[1], codes[7])
+        # the encoding is only computed once
+        self.assertTrue(peptide.get_encoded_sequence() is codes)
+        self.assertEqual(list(peptide._get_modified_fragments())[0], 'C[160]')
+        self.assertEqual(peptide.get_modified_sequence('SEQUEST'), 'C#EPTIDM@EK')
+
+    def test_fragmentation(self):
+        average = Residues('average')
+        for sequence in ['PEPTIDE', 'CEPC[160]IDM[147]E', 'N[115]GS[167]K']:
+            # the average masses are only known for unmodified residues
+            for R in [self.R, average]:
+                if R is average and '[' in sequence: continue
+                peptide = DDB.Peptide()
+                peptide.set_sequence(sequence)
+                peptide.charge = 2
+                peptide.create_fragmentation_pattern(R)
+                b_series, mass = self._reference_series(sequence, R)
+                self.assertEqual(peptide.b_series, b_series)
+                self.assertEqual(peptide.molecular_weight, mass + (R.mass_OH + R.mass_H))
+
+    def test_N15(self):
+        peptide = DDB.Peptide()
+        peptide.set_sequence('PEPTIDEK')
+        peptide.charge = 2
+        peptide.create_fragmentation_pattern(self.R)
+        light = peptide.molecular_weight
+        self.R.recalculate_monisotopic_data_for_N15()
+        peptide.create_fragmentation_pattern(self.R)
+        b_series, mass = self._reference_series('PEPTIDEK', self.R)
+        self.assertEqual(peptide.b_series, b_series)
+        self.assertTrue(peptide.molecular_weight > light)
+
+    def test_changed_sequence(self):
+        peptide = DDB.Peptide()
+        peptide.set_sequence('PEPTIDEC')
+        peptide.charge = 2
+        peptide.create_fragmentation_pattern(self.R)
+        unmodified = peptide.molecular_weight
+        peptide.modify_cysteins()
+        peptide.create_fragmentation_pattern(self.R)
+        self.assertTrue(peptide.molecular_weight > unmodified)
+        self.assertEqual(peptide.get_modified_sequence('SEQUEST'), 'PEPTIDEC#')
+
+    def test_encoding_threads(self):
+        # new residues encoded from several threads get distinct codes
+        import threading
+        from srmcollider import Residues as residues_module
+        tokens = ['K[%s]' % (500 + i) for i in range(200)]
+        results = {}
+        def encode(k):
+            results[k] = [residues_module.encode_sequence(t)[0] for t in tokens[k::4]]
+        threads = [threading.Thread(target=encode, args=(k,)) for k in range(4)]
+        for t in threads: t.start()
+        for t in threads: t.join()
+        for k in range(4):
+            self.assertEqual([residues_module.residue_tokens[c] for c in results[k]], tokens[k::4])
+
+    def test_unknown_residue(self):
+        peptide = DDB.Peptide()
+        peptide.set_sequence('PEPTIDEC[999]')
+        peptide.charge = 2
+        self.assertRaises(KeyError, peptide.create_fragmentation_pattern, self.R)
+
+class Test_residues(unittest.TestCase):
+
+    def test_shared(self):
+        from srmcollider.Residues import get_residues
+        R = get_residues('mono')
+        self.assertTrue(get_residues('mono') is R)
+        self.assertRaises(TypeError, R.recalculate_monisotopic_data_for_N15)
+        self.assertRaises(TypeError, R.residues.__setitem__, 'X', ('X', 1.0))
+        self.assertEqual(R.residues, Residues('mono').residues)
+        self.assertEqual(get_residues('average').residues, Residues('average').residues)
+
+        RN15 = Residues('mono')
+        RN15.recalculate_monisotopic_data_for_N15()
+        self.assertEqual(get_residues('N15').residues, RN15.residues)
+        self.assertRaises(TypeError, get_residues('N15').residues.__setitem__, 'X', ('X', 1.0))
+
+    def test_no_shared_state(self):
+        R = Residues('mono')
+        R.recalculate_monisotopic_data_for_N15()
+        # recalculating one object does not change others
+        self.assertNotEqual(R.residues['K'][1], Residues('mono').residues['K'][1])
+        self.assertEqual(Residues('mono').residues['s'][0], 'Phospho-S')
+        import copy, pickle
+        self.assertEqual(copy.deepcopy(R).residues, R.residues)
+        self.assertEqual(pickle.loads(pickle.dumps(Residues('mono'))).residues, Residues('mono').residues)
+
+    def test_res_pairs(self):
+        R = Residues('mono')
+        self.assertFalse('res_pairs' in R.__dict__)
+        nr = len(R.residues)
+        self.assertEqual(len(R.res_pairs), nr * nr)
+        self.assertTrue('PE' in R.res_pairs)
+        self.assertRaises(AttributeError, getattr, R, 'nonexisting')
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,87 @@
+"""
+This file tests the functionality of the fragment_cache.py module and its use
+in the collider.py module.
+"""
+import os, sys, tempfile, unittest
+sys.path.extend(['.', '..', '../external/', 'external/'])
+from srmcollider import collider, fragments
+from srmcollider.fragment_cache import FragmentCache
+from srmcollider.Residues import Residues
+
+import test_shared
+
+class Test_fragment_cache(unittest.TestCase):
+
+    def test_lru(self):
+        cache = FragmentCache(maxsize=2)
+        key1 = cache.get_key('PEPTIDE', 0, ('b', 'y'))
+        key2 = cache.get_key('PEPTIDER', 0, ('b', 'y'))
+        key3 = cache.get_key('PEPTIDE', 1, ('b', 'y'))
+        self.assertEqual(cache.get(key1), None)
+        cache.put(key1, [1.0, 2.0])
+        cache.put(key2, [3.0])
+        self.assertEqual(list(cache.get(key1)), [1.0, 2.0])
+        # key2 is the least recently used entry now
+        cache.put(key3, [4.0])
+        self.assertEqual(len(cache), 2)
+        self.assertFalse(key2 in cache)
+        self.assertTrue(key1 in cache)
+        self.assertEqual(cache.stats(), {'size' : 2, 'maxsize' : 2, 'hits' : 1,
+            'misses' : 1, 'evictions' : 1, 'disk_hits' : 0})
+
+    def test_disk_store(self):
+        fd, filename = tempfile.mkstemp(suffix='.sqlite')
+        os.close(fd)
+        try:
+            key = FragmentCache.get_key('PEPTIDE', 0, ('b', 'y'))
+            cache = FragmentCache(maxsize=10, filename=filename)
+            cache.put(key, [1.5, 2.25])
+            cache.close()
+
+            cache = FragmentCache(maxsize=10, filename=filename)
+            self.assertEqual(list(cache.get(key)), [1.5, 2.25])
+            self.assertEqual(cache.disk_hits, 1)
+            self.assertEqual(cache.get(FragmentCache.get_key('PEPTIDE', 1, ('b', 'y'))), None)
+            cache.close()
+        finally:
+            os.remove(filename)
+
+class Test_collider_fragment_cache(unittest.TestCase):
+
+    def setUp(self):
+        self.R = Residues('mono')
+        self.acollider = collider.SRMcollider()
+        self.par = test_shared.get_default_setup_parameters()
+
+    def _compare(self, precursors, forceFragmentChargeCheck=False):
+        reference = list(self.acollider._calculate_fragment_masses(precursors, self.par,
+            self.R, self.par.q3_low, self.par.q3_high, self.acollider.RN15, forceFragmentChargeCheck))
+        cached_collider = collider.SRMcollider()
+        cache = cached_collider.enable_fragment_cache(maxsize=50)
+        for i in range(2):
+            result = cached_collider.calculate_fragment_masses(precursors, self.par,
+                self.R, self.par.q3_low, self.par.q3_high, cached_collider.RN15, forceFragmentChargeCheck)
+            self.assertEqual(reference, result)
+        return cache
+
+    def test_cached(self):
+        cache = self._compare(test_shared.runprecursors1)
+        self.assertTrue(cache.hits > 0)
+        self.assertTrue(cache.evictions > 0)
+        self._compare(test_shared.runprecursors_obj2, True)
+
+    def test_ion_series(self):
+        self.par.aions = True
+        self.par.MMinusNH3 = True
+        self._compare(test_shared.runprecursors1)
+
+    def test_without_numpy(self):
+        numpy = fragments.numpy
+        fragments.numpy = None
+        try:
+            self._compare(test_shared.runprecursors2)
+        finally:
+            fragments.numpy = numpy
+
+if __name__ == '__main__':
+    unittest.main()
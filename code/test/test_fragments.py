@@ -0,0 +1,79 @@
+"""
+This file tests the vectorized fragment calculation of the fragments.py module
+against the pure Python implementation in the collider.py module.
+"""
+from nose.plugins.attrib import attr
+
+import sys, unittest
+sys.path.extend(['.', '..', '../external/', 'external/'])
+from srmcollider import collider, fragments
+from srmcollider.Residues import Residues
+
+import test_shared
+
+class Test_fragments(unittest.TestCase):
+
+    def setUp(self):
+        if not fragments.have_numpy():
+            raise unittest.SkipTest("numpy is not available")
+        self.R = Residues('mono')
+        self.RN15 = Residues('mono')
+        self.RN15.recalculate_monisotopic_data_for_N15()
+        self.acollider = collider.SRMcollider()
+        self.par = test_shared.get_default_setup_parameters()
+
+    def _compare(self, precursors, forceFragmentChargeCheck=False):
+        new = self.acollider.calculate_fragment_masses(precursors, self.par,
+            self.R, self.par.q3_low, self.par.q3_high, self.RN15, forceFragmentChargeCheck)
+        old = list(self.acollider._calculate_fragment_masses(precursors, self.par,
+            self.R, self.par.q3_low, self.par.q3_high, self.RN15, forceFragmentChargeCheck))
+        self.assertEqual(len(old), len(new))
+        # results have to be identical, not only within some epsilon
+        self.assertEqual(old, new)
+
+    def test_tuples(self):
+        self._compare(test_shared.runprecursors1)
+        self._compare(test_shared.runprecursors2)
+
+    def test_precursor_objects(self):
+        self._compare(test_shared.runprecursors_obj1)
+        self._compare(test_shared.runprecursors_obj2)
+
+    def test_charge_check(self):
+        self._compare(test_shared.runprecursors1, True)
+        self._compare(test_shared.runprecursors_obj2, True)
+
+    def test_all_ion_series(self):
+        for name, flag in fragments.ION_SERIES:
+            setattr(self.par, flag, True)
+        self.assertEqual(len(fragments.get_ion_series(self.par)), len(fragments.ION_SERIES))
+        self._compare(test_shared.runprecursors1)
+        self._compare(test_shared.runprecursors_obj2)
+
+    def test_N15(self):
+        precursors = [ (p[0], p[1], p[2], p[3], 1) for p in test_shared.runprecursors1]
+        precursors.extend(test_shared.runprecursors1)
+        self._compare(precursors)
+
+    def test_batches(self):
+        q3, q1, key = fragments.calculate_fragment_masses(test_shared.runprecursors1,
+            self.par, self.R, self.par.q3_low, self.par.q3_high, batchsize=7)
+        old = list(self.acollider._calculate_fragment_masses(test_shared.runprecursors1,
+            self.par, self.R, self.par.q3_low, self.par.q3_high))
+        self.assertEqual([o[0] for o in old], q3.tolist())
+        self.assertEqual([o[1] for o in old], q1.tolist())
+        self.assertEqual([o[3] for o in old], key.tolist())
+
+    def test_empty(self):
+        self.assertEqual(self.acollider.calculate_fragment_masses([], self.par,
+            self.R, self.par.q3_low, self.par.q3_high), [])
+
+    def test_transitions_ch(self):
+        peptides = [ (p[0], p[1], p[2]) for p in test_shared.runprecursors1]
+        old = list(collider._calculate_transitions_ch(peptides, [1,2], 300, 1500))
+        q3, q1, key = fragments.calculate_transitions_ch(peptides, [1,2], 300, 1500, self.R)
+        self.assertEqual(old, [ (a, b, 0, c) for a, b, c in
+                               zip(q3.tolist(), q1.tolist(), key.tolist())])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+"""
+This file tests the functionality of the parallel.py module.
+"""
+import os, sys, unittest
+sys.path.extend(['.', '..', '../external/', 'external/'])
+from srmcollider import parallel
+
+items = range(1000)
+
+def _sum_squares(start, end):
+    return sum([i*i for i in items[start:end]])
+
+def _chunk(start, end):
+    return (os.getpid(), items[start:end])
+
+class Test_parallel(unittest.TestCase):
+
+    def test_get_ranges(self):
+        self.assertEqual(parallel.get_ranges(10, 3), [(0, 3), (3, 6), (6, 10)])
+        self.assertEqual(parallel.get_ranges(2, 5), [(0, 1), (1, 2)])
+        self.assertEqual(parallel.get_ranges(0, 5), [])
+        for n in [1, 7, 100, 1001]:
+            ranges = parallel.get_ranges(n, 16)
+            self.assertEqual(sum([e - s for s, e in ranges]), n)
+            self.assertEqual(ranges[0][0], 0)
+            self.assertEqual(ranges[-1][1], n)
+
+    def test_serial(self):
+        self.assertEqual(parallel.map_ranges(_sum_squares, len(items), 1),
+                         [sum([i*i for i in items])])
+
+    def test_map_ranges(self):
+        result = parallel.map_ranges(_chunk, len(items), 4)
+        # the results are returned in order
+        merged = []
+        for pid, chunk in result:
+            merged.extend(chunk)
+        self.assertEqual(merged, items)
+        self.assertEqual(sum(parallel.map_ranges(_sum_squares, len(items), 3)),
+                         sum([i*i for i in items]))
+
+    def test_per_process(self):
+        p = parallel.PerProcess(lambda: os.getpid())
+        self.assertEqual(p.get(), os.getpid())
+        p = parallel.PerProcess(lambda: 'new', 'initial')
+        self.assertEqual(p.get(), 'initial')
+        p.pid = -1
+        self.assertEqual(p.get(), 'new')
+
+if __name__ == '__main__':
+    unittest.main()
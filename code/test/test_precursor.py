@@ -0,0 +1,230 @@
+"""
+This file tests the functionality of the precursor.py module.
+"""
+from nose.plugins.attrib import attr
+
+import sys, unittest
+sys.path.extend(['.', '..', '../external/', 'external/'])
+from srmcollider.precursor import Precursor, PrecursorTable, Precursors
+
+import test_shared
+
+rows = [
+    ('PEPTIDER', 1, 10, 2, 500.5, 20.0, 0, 0, 0),
+    (u'C[160]EPTIDEK', 2, 11, 3, 400.25, 30.0, 1, 0, 1),
+    ('ELVISLIVESK', 3, 12, 2, 600.0, 10.5, 0, 1, 0),
+]
+
+def _as_tuple(p):
+    return (p.modified_sequence, p.transition_group, p.parent_id, p.q1_charge, p.q1,
+            p.ssrcalc, p.modifications, p.missed_cleavages, p.isotopically_modified)
+
+class Test_precursor_table(unittest.TestCase):
+
+    def setUp(self):
+        self.table = PrecursorTable()
+        for r in rows:
+            self.table.append_row(r)
+
+    def test_access(self):
+        self.assertEqual(len(self.table), 3)
+        self.assertEqual(_as_tuple(self.table[1]), ('C[160]EPTIDEK', 2, 11, 3, 400.25, 30.0, 1, 0, 1))
+        self.assertEqual(_as_tuple(self.table[-1]), rows[2])
+        self.assertRaises(IndexError, self.table.__getitem__, 3)
+        self.assertEqual([_as_tuple(p) for p in self.table][0], rows[0])
+        self.assertEqual(self.table.get_sequence(2), 'ELVISLIVESK')
+
+    def test_append_object(self):
+        p = Precursor()
+        p.initialize(*rows[0])
+        self.table.append(p)
+        self.assertEqual(_as_tuple(self.table[3]), rows[0])
+
+    def test_lookup(self):
+        access = Precursors()
+        access.precursors = self.table
+        access.build_parent_id_lookup()
+        access.build_transition_group_lookup()
+        self.assertEqual(access.lookup_by_parent_id(12).modified_sequence, 'ELVISLIVESK')
+        self.assertEqual(access.lookup_by_transition_group(1).parent_id, 10)
+        self.assertRaises(KeyError, access.lookup_by_parent_id, 1)
+
+    def test_lookup_without_numpy(self):
+        import srmcollider.precursor
+        numpy = srmcollider.precursor.numpy
+        srmcollider.precursor.numpy = None
+        try:
+            self.test_lookup()
+        finally:
+            srmcollider.precursor.numpy = numpy
+
+    def test_lookup_duplicates(self):
+        self.table.append_row(('PEPTIDEK', 4, 10, 2, 450.0, 15.0, 0, 0, 0))
+        lookup = self.table.index_by('parent_id')
+        # the last precursor with a given value is returned (as with a dict)
+        self.assertEqual(lookup[10].modified_sequence, 'PEPTIDEK')
+        self.assertTrue(11 in lookup)
+        self.assertFalse(13 in lookup)
+        self.assertEqual(len(lookup), 3)
+
+    def test_columns(self):
+        q1 = self.table.get_column('q1')
+        self.assertEqual(list(q1), [500.5, 400.25, 600.0])
+        self.assertEqual(list(self.table.get_column('parent_id')), [10, 11, 12])
+        self.assertEqual(len(PrecursorTable().get_column('q1')), 0)
+        self.assertEqual(self.table.get_sequences(), ['PEPTIDER', 'C[160]EPTIDEK', 'ELVISLIVESK'])
+
+    def test_rangetree_tuples(self):
+        access = Precursors()
+        access.precursors = list(self.table)
+        expected = access.get_alltuples_extended_rangetree()
+        access.precursors = self.table
+        self.assertEqual(access.get_alltuples_extended_rangetree(), expected)
+        self.assertEqual(self.table.get_rangetree_tuples(),
+            tuple([(0, 0, r[2], r[3], r[4], r[5]) for r in rows]))
+
+    def test_slots(self):
+        import pickle
+        p = self.table[1]
+        self.assertRaises(AttributeError, setattr, p, 'seq_id', 5)
+        self.assertEqual(_as_tuple(pickle.loads(pickle.dumps(p))), _as_tuple(p))
+        self.assertEqual(_as_tuple(pickle.loads(pickle.dumps(p, 2))), _as_tuple(p))
+
+    def test_precursors_to_evaluate(self):
+        access = Precursors()
+        access.precursors = self.table
+        selected = access.getPrecursorsToEvaluate(400, 550)
+        self.assertEqual([_as_tuple(p) for p in selected], [rows[0]])
+        import srmcollider.precursor
+        numpy = srmcollider.precursor.numpy
+        srmcollider.precursor.numpy = None
+        try:
+            selected = access.getPrecursorsToEvaluate(400, 550)
+        finally:
+            srmcollider.precursor.numpy = numpy
+        self.assertEqual([_as_tuple(p) for p in selected], [rows[0]])
+        # same result as with a list of Precursor objects
+        access.precursors = list(self.table)
+        selected = access.getPrecursorsToEvaluate(400, 550)
+        self.assertEqual([_as_tuple(p) for p in selected], [rows[0]])
+
+class Test_rangetree_batch(unittest.TestCase):
+
+    def setUp(self):
+        import random
+        random.seed(3)
+        self.par = test_shared.get_default_setup_parameters()
+        self.table = PrecursorTable()
+        for i in range(500):
+            self.table.append_row(('PEPTIDE', i // 2, 1000 + i, random.choice([2, 3]),
+                random.uniform(400, 410), random.uniform(0, 40), 0, 0, 0))
+
+    def _neighbours(self, access, result, k):
+        return sorted([p.parent_id for p in access.get_neighbours(result, k)])
+
+    def test_query_rangetree_batch(self):
+        from srmcollider import rangetree
+        for precursors in [self.table, list(self.table)]:
+            access = Precursors()
+            access.precursors = precursors
+            tree = access.build_rangetree()
+            # a tree not built by access is queried precursor by precursor
+            other = rangetree.Rangetree_Q1_RT.create()
+            other.create_tree(self.table.get_rangetree_tuples())
+            query = list(self.table)[::7]
+            result = access.query_rangetree_batch(query, self.par, tree)
+            expected = access.query_rangetree_batch(query, self.par, other)
+            swath = access.query_rangetree_batch(query, self.par, tree, 402.0, 404.0)
+            for k, p in enumerate(query):
+                neighbours = self._neighbours(access, result, k)
+                self.assertEqual(neighbours, self._neighbours(access, expected, k))
+                self.assertFalse(p.parent_id in neighbours)
+                for other_p in access.get_neighbours(result, k):
+                    self.assertTrue(abs(other_p.ssrcalc - p.ssrcalc) < self.par.ssrcalc_window)
+                self.assertEqual(self._neighbours(access, swath, k), self._neighbours(access,
+                    access.query_rangetree_batch([p], self.par, other, 402.0, 404.0), 0))
+            self.assertTrue(len(result[1]) > 0)
+            self.assertTrue(len(swath[1]) > 0)
+            # the parent_id positions are only computed once
+            positions = access._get_positions()
+            access.query_rangetree_batch(query[:1], self.par, other)
+            self.assertTrue(access._get_positions() is positions)
+
+class Test_streaming_cursor(unittest.TestCase):
+
+    def test_close(self):
+        # a separate streaming cursor (MySQLdb SSCursor) is closed after the
+        # fetch, also if it fails, the cursor of the caller is not closed
+        import srmcollider.precursor
+        class Cursor(object):
+            closed = False
+            fail = False
+            def execute(self, query):
+                if self.fail: raise RuntimeError(query)
+                self.rows = [rows[0]]
+            def fetchmany(self, size):
+                result, self.rows = self.rows, []
+                return result
+            def close(self):
+                self.closed = True
+        par = test_shared.get_default_setup_parameters()
+        get_streaming_cursor = srmcollider.precursor._get_streaming_cursor
+        try:
+            for fail in [False, True]:
+                caller, streaming = Cursor(), Cursor()
+                streaming.fail = fail
+                srmcollider.precursor._get_streaming_cursor = lambda c: streaming
+                access = Precursors()
+                if fail:
+                    self.assertRaises(RuntimeError, access.getFromDB, par, caller, 400, 600)
+                else:
+                    access.getFromDB(par, caller, 400, 600)
+                    self.assertEqual([_as_tuple(p) for p in access.precursors], [rows[0]])
+                self.assertTrue(streaming.closed)
+                self.assertFalse(caller.closed)
+            srmcollider.precursor._get_streaming_cursor = lambda c: c
+            caller = Cursor()
+            Precursors().getFromDB(par, caller, 400, 600)
+            self.assertFalse(caller.closed)
+        finally:
+            srmcollider.precursor._get_streaming_cursor = get_streaming_cursor
+
+@attr('sqlite')
+class Test_precursor_access_sqlite(unittest.TestCase):
+
+    def setUp(self):
+        import sqlite3
+        self.db = sqlite3.connect(test_shared.SQLITE_DATABASE_LOCATION)
+        self.par = test_shared.get_default_setup_parameters()
+
+    def tearDown(self):
+        self.db.close()
+
+    def test_getFromDB(self):
+        import srmcollider.precursor
+        lower_q1, upper_q1 = 500, 600
+        myprecursors = Precursors()
+        batchsize = srmcollider.precursor.FETCH_BATCHSIZE
+        srmcollider.precursor.FETCH_BATCHSIZE = 7
+        try:
+            myprecursors.getFromDB(self.par, self.db.cursor(), lower_q1, upper_q1)
+        finally:
+            srmcollider.precursor.FETCH_BATCHSIZE = batchsize
+        self.assertTrue(isinstance(myprecursors.precursors, PrecursorTable))
+
+        # compare to the precursors from the complete result
+        cursor = self.db.cursor()
+        cursor.execute("""select modified_sequence, transition_group, parent_id, q1_charge, q1,
+            ssrcalc, modifications, missed_cleavages, isotopically_modified from %s %s""" % (
+            self.par.peptide_tables[0], self.par.query2_add.replace('and', 'where', 1)))
+        expected = []
+        for res in cursor.fetchall():
+            p = Precursor()
+            p.initialize(*res)
+            if p.included_in_isotopic_range(lower_q1, upper_q1, self.par):
+                expected.append(_as_tuple(p))
+        self.assertTrue(len(expected) > 0)
+        self.assertEqual(sorted([_as_tuple(p) for p in myprecursors.precursors]), sorted(expected))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+"""
+This file tests the on-disk precursor index of the precursor_index.py module
+against the SQL queries used in the collider.py and precursor.py modules.
+"""
+from nose.plugins.attrib import attr
+
+import os, sys, tempfile, unittest
+sys.path.extend(['.', '..', '../external/', 'external/'])
+from srmcollider import collider, precursor_index
+from srmcollider.precursor import Precursors
+
+import test_shared
+
+def _as_tuples(precursors):
+    return sorted([ (p.modified_sequence, p.transition_group, p.parent_id, p.q1_charge, p.q1,
+                     p.ssrcalc, p.modifications, p.missed_cleavages, p.isotopically_modified)
+                   for p in precursors])
+
+class Test_precursor_index_file(unittest.TestCase):
+
+    def setUp(self):
+        if precursor_index.numpy is None:
+            raise unittest.SkipTest("numpy is not available")
+        fd, self.filename = tempfile.mkstemp(suffix='.idx')
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.filename)
+
+    def test_roundtrip(self):
+        rows = [
+            ('PEPTIDER', 1, 10, 2, 500.5, 20.0, 0, 0, 0),
+            (u'C[160]EPTIDEK', 2, 11, 3, 400.25, 30.0, 1, 0, 1),
+            ('ELVISLIVESK', 3, 12, 2, 600.0, 10.5, 0, 1, 0),
+        ]
+        self.assertEqual(precursor_index.write_index(self.filename, rows), 3)
+        index = precursor_index.PrecursorIndex(self.filename)
+        self.assertEqual(len(index), 3)
+        # the rows are sorted by q1
+        self.assertEqual(index.get_row(0), ('C[160]EPTIDEK', 2, 11, 3, 400.25, 30.0, 1, 0, 1))
+        self.assertEqual(index.get_row(1), rows[0])
+        self.assertEqual(index.get_row(2), rows[2])
+        self.assertEqual(index.q1_range(400.25, 500.5), (0, 2))
+        self.assertEqual(index.q1_range(400.25, 500.5, inclusive=False), (1, 1))
+
+        p = index.get_precursor(0)
+        self.assertEqual(p.modified_sequence, 'C[160]EPTIDEK')
+        self.assertEqual(p.parent_id, 11)
+
+    def test_empty(self):
+        precursor_index.write_index(self.filename, [])
+        index = precursor_index.PrecursorIndex(self.filename)
+        self.assertEqual(len(index), 0)
+        self.assertEqual(index.q1_range(0, 1000), (0, 0))
+
+    def test_wrong_file(self):
+        f = open(self.filename, 'w')
+        f.write('this is not an index' * 10)
+        f.close()
+        self.assertRaises(precursor_index.PrecursorIndexError,
+                          precursor_index.PrecursorIndex, self.filename)
+
+@attr('sqlite')
+class Test_precursor_index_sqlite(unittest.TestCase):
+
+    def setUp(self):
+        if precursor_index.numpy is None:
+            raise unittest.SkipTest("numpy is not available")
+        import sqlite3
+        self.db = sqlite3.connect(test_shared.SQLITE_DATABASE_LOCATION)
+        self.cursor = self.db.cursor()
+        fd, self.filename = tempfile.mkstemp(suffix='.idx')
+        os.close(fd)
+
+        self.par = test_shared.get_default_setup_parameters()
+        self.par.max_mods = 5
+        self.par.max_MC = 1
+        self.par.eval()
+        precursor_index.build_index_from_db(self.filename, self.cursor, self.par.peptide_tables)
+
+        self.par_index = self.par.get_copy()
+        self.par_index.precursor_index = self.filename
+
+    def tearDown(self):
+        self.db.close()
+        os.remove(self.filename)
+
+    def test_getFromDB(self):
+        for low, high in [ (400, 1500), (500, 525), (712.3, 713.1) ]:
+            from_db = Precursors()
+            from_db.getFromDB(self.par, self.cursor, low, high)
+            from_index = Precursors()
+            from_index.getFromDB(self.par_index, None, low, high)
+            self.assertTrue(len(from_db.precursors) > 0)
+            self.assertEqual(_as_tuples(from_db.precursors), _as_tuples(from_index.precursors))
+
+    def test_get_all_precursors(self):
+        mycollider = collider.SRMcollider()
+        allprecursors = Precursors()
+        allprecursors.getFromDB(self.par, self.cursor, 400, 1500)
+        query = allprecursors.getPrecursorsToEvaluate(400, 1500)[::10]
+        # select_by "sequence" does not work with sqlite (unicode strings)
+        for select_by in ["id", "modified_sequence", "none"]:
+            self.par.select_by = select_by
+            self.par_index.select_by = select_by
+            for p in query:
+                from_db = mycollider._get_all_precursors(self.par, p, self.cursor)
+                from_index = mycollider._get_all_precursors(self.par_index, p, None)
+                self.assertEqual(_as_tuples(from_db), _as_tuples(from_index))
+
+    def test_sql_restrictions(self):
+        self.par_index.add_sql_select = "and q1_charge = 2"
+        self.assertRaises(precursor_index.PrecursorIndexError,
+            Precursors().getFromDB, self.par_index, None, 400, 1500)
+
+if __name__ == '__main__':
+    unittest.main()
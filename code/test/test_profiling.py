@@ -0,0 +1,108 @@
+"""
+This file tests the functionality of the profiling.py module.
+"""
+import json, os, sys, tempfile, time, unittest
+sys.path.extend(['.', '..', '../external/', 'external/'])
+from srmcollider import parallel, profiling
+
+@profiling.profiled('outer')
+def outer_stage():
+    with profiling.timer('inner'):
+        time.sleep(0.02)
+    time.sleep(0.01)
+    return 5
+
+@profiling.profiled('outer')
+def reentrant_stage():
+    # calls another function of the same stage
+    with profiling.timer('outer'):
+        time.sleep(0.01)
+    return outer_stage()
+
+def profiled_range(start, end):
+    for i in range(start, end):
+        profiling.observe('values', i)
+        with profiling.timer('stage'): pass
+    return end - start
+
+class Test_profiling(unittest.TestCase):
+
+    def tearDown(self):
+        profiling.disable()
+
+    def test_disabled(self):
+        profiling.disable()
+        self.assertEqual(outer_stage(), 5)
+        profiling.count('counter')
+        profiling.observe('histogram', 3)
+        self.assertTrue(profiling.timer('stage') is profiling.timer('other'))
+
+    def test_timers(self):
+        profiling.enable()
+        self.assertEqual(outer_stage(), 5)
+        outer_stage()
+        p = profiling.get_profile()
+        self.assertEqual(p.timers['outer'][0], 2)
+        self.assertEqual(p.timers['inner'][0], 2)
+        # the time of the nested stage is not part of the own time
+        self.assertTrue(p.timers['outer'][1] >= 0.06)
+        self.assertTrue(p.timers['outer'][2] < p.timers['outer'][1] - 0.03)
+        self.assertTrue(p.timers['inner'][1] >= 0.04)
+        self.assertEqual(outer_stage.__name__, 'outer_stage')
+
+    def test_reentrant(self):
+        profiling.enable()
+        reentrant_stage()
+        p = profiling.get_profile()
+        # the nested timers of the same stage are only counted once
+        self.assertEqual(p.timers['outer'][0], 1)
+        self.assertEqual(p.timers['inner'][0], 1)
+        self.assertTrue(p.timers['outer'][1] < 0.2)
+        self.assertTrue(abs(p.timers['outer'][1] - p.timers['outer'][2] - p.timers['inner'][1]) < 0.005)
+
+    def test_histograms(self):
+        profiling.enable()
+        for v in [0, 1, 2, 3, 4, 9]: profiling.observe('size', v)
+        profiling.count('queries', 2)
+        profiling.count('queries')
+        p = profiling.get_profile()
+        self.assertEqual(p.get_histogram('size'), (6, 19,
+            [(0, 0, 1), (1, 1, 1), (2, 3, 2), (4, 7, 1), (8, 15, 1)]))
+        self.assertEqual(p.counters, {'queries' : 3})
+        other = profiling.Profile()
+        other.observe('size', 1)
+        other.add_time('stage', 1.0, 0.5)
+        p.merge(other)
+        self.assertEqual(p.get_histogram('size')[0], 7)
+        self.assertEqual(p.timers['stage'], [1, 1.0, 0.5])
+        self.assertTrue('summed over all processes' in p.report())
+
+    def test_write(self):
+        profiling.enable()
+        outer_stage()
+        profiling.observe('size', 2)
+        fd, filename = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+        try:
+            profiling.get_profile().write(filename)
+            result = json.load(open(filename))
+            self.assertEqual(result['timers']['outer']['calls'], 1)
+            self.assertEqual(result['histograms']['size']['buckets'], [[2, 3, 1]])
+            profiling.get_profile().write(filename[:-5] + '.csv')
+            lines = open(filename[:-5] + '.csv').read().splitlines()
+            self.assertEqual(lines[0], 'type,name,count,seconds,self_seconds,low,high')
+            self.assertEqual(len(lines), 4)
+        finally:
+            os.remove(filename)
+            if os.path.exists(filename[:-5] + '.csv'): os.remove(filename[:-5] + '.csv')
+
+    def test_parallel(self):
+        # the measurements of the workers are merged into the ones of the parent
+        profiling.enable()
+        self.assertEqual(sum(parallel.map_ranges(profiled_range, 100, 3)), 100)
+        p = profiling.get_profile()
+        self.assertEqual(p.timers['stage'][0], 100)
+        self.assertEqual(p.get_histogram('values')[:2], (100, 4950))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+"""
+This file tests the functionality of the progress.py module.
+"""
+import sys, time, unittest
+from StringIO import StringIO
+sys.path.extend(['.', '..', '../external/', 'external/'])
+from srmcollider import parallel, progress
+
+progressm = None
+
+def _report_half(start, end):
+    # only report every second item, the rest is counted by map_ranges
+    for i in range(start, end, 2): progressm.update(1)
+    return end - start
+
+class Test_progress(unittest.TestCase):
+
+    def setUp(self):
+        self.stdout = sys.stdout
+        sys.stdout = StringIO()
+
+    def tearDown(self):
+        sys.stdout = self.stdout
+
+    def test_log_output(self):
+        # without a terminal plain lines are written, not more often than log_refresh
+        p = progress.ProgressMeter(total=1000, unit='peptides', log_refresh=3600)
+        self.assertFalse(p.tty)
+        for i in range(1000): p.update(1)
+        output = sys.stdout.getvalue()
+        self.assertFalse(progress.ProgressMeter.ESC in output)
+        lines = output.splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertTrue(lines[0].startswith('0% (1/1000 peptides)'))
+        self.assertTrue(lines[1].startswith('100% (1000/1000 peptides)'))
+        self.assertTrue(lines[2].startswith('It took'))
+        # further updates do not print anything
+        p.update(1)
+        self.assertEqual(sys.stdout.getvalue(), output)
+        self.assertEqual(p.count, 1000)
+
+    def test_tty_output(self):
+        p = progress.ProgressMeter(total=100, unit='peptides', tty=True, rate_refresh=3600)
+        for i in range(100): p.update(1)
+        output = sys.stdout.getvalue()
+        self.assertEqual(output.count(progress.ProgressMeter.ESC + '[2K'), 2)
+        self.assertTrue('100%' in output)
+        self.assertTrue('It took' in output)
+
+    def test_workers(self):
+        global progressm
+        progressm = progress.ProgressMeter(total=1000, unit='peptides', batch=7)
+        self.assertEqual(sum(parallel.map_ranges(_report_half, 1000, 3, progressm=progressm)), 1000)
+        self.assertEqual(progressm.count, 1000)
+        self.assertTrue(progressm.finished)
+        self.assertTrue(sys.stdout.getvalue().splitlines()[-1].startswith('It took'))
+
+if __name__ == '__main__':
+    unittest.main()
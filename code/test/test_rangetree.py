@@ -1,7 +1,8 @@
 import random
 import unittest
 """
-This file tests the functionality of the c_rangetree module. 
+This file tests the functionality of the c_rangetree module and of the
+rangetree.py module.
 """
 
 import sys
@@ -9,6 +10,10 @@ sys.path.extend(['.', '..', '../external/', 'external/'])
 
 from nose.plugins.attrib import attr
 
+from srmcollider import rangetree
+from srmcollider.precursor import Precursors, PrecursorTable
+from srmcollider.Residues import Residues
+
 try:
     from srmcollider import c_rangetree
 except ImportError:
@@ -114,5 +119,115 @@ class Test_crangetree(unittest.TestCase):
                                       self.q1 + 1,  self.ssrcalc + 1, 1, 0) 
             self.assertEqual( len(res), 0)
 
+def _reference(tuples, q1_low, rt_low, q1_high, rt_high, isotopes, correction):
+    # select all precursors in the half-open window, then check the isotopes
+    result = []
+    for t in tuples:
+        q1, ssrcalc, charge = t[4], t[5], t[3]
+        if not (q1 >= q1_low - correction and q1 < q1_high): continue
+        if not (ssrcalc >= rt_low and ssrcalc < rt_high): continue
+        for iso in range(isotopes+1):
+            mz = q1 + (Residues.mass_diffC13 * iso) / charge
+            if mz > q1_low and mz < q1_high:
+                result.append( (t[2],) )
+                break
+    return sorted(result)
+
+class Test_rangetree(unittest.TestCase):
+
+    def setUp(self):
+        random.seed(42)
+        # many ties in the retention time and some in q1
+        self.tuples = tuple([ (0, 0, i, random.choice([1, 2, 3]),
+            round(random.uniform(400, 500), 1), random.choice([5.0, 7.5, random.uniform(0, 20)]))
+            for i in range(3000)])
+        self.windows = [(420.0, 5.0, 421.0, 7.5, 0, 0.0),
+                        (400.0, 0.0, 500.0, 20.0, 3, 3 * Residues.mass_diffC13 / 1),
+                        (450.3, 7.5, 450.5, 7.5, 0, 0.0),
+                        (self.tuples[5][4], self.tuples[5][5], self.tuples[5][4] + 2, 15.0, 2, 1.0),
+                        (600.0, 0.0, 700.0, 20.0, 0, 0.0),
+                        (399.0, -1.0, 430.0, 5.0, 1, 0.5)]
+
+    def _check(self, tree):
+        tree.create_tree(self.tuples)
+        self.assertEqual(len(tree), len(self.tuples))
+        for w in self.windows:
+            self.assertEqual(sorted(tree.query_tree(*w)), _reference(self.tuples, *w))
+
+    def test_numpy(self):
+        self._check(rangetree.Rangetree_Q1_RT.create())
+        # use the blocks also for short Q1 ranges, with blocks smaller and
+        # larger than the result
+        for blocksize in [1, 7, 128, 10000]:
+            self._check(rangetree.Rangetree_Q1_RT(blocksize=blocksize, scan_limit=0))
+
+    def test_python(self):
+        self._check(rangetree.Rangetree_Q1_RT(use_numpy=False))
+
+    def test_boundaries(self):
+        # the same as for c_rangetree (see Test_crangetree)
+        for use_numpy in [True, False]:
+            tree = rangetree.Rangetree_Q1_RT(use_numpy=use_numpy)
+            tree.create_tree( (('PEPTIDE', 1, 101, 2, 501.0, 24),) )
+            self.assertEqual(tree.query_tree(500.0, 23, 502.0, 25, 1, 0), [(101,)])
+            # same result when lower boundary equals the value
+            self.assertEqual(tree.query_tree(501.0, 24, 502.0, 25, 1, 0), [(101,)])
+            # no result when upper boundary equals the value
+            self.assertEqual(tree.query_tree(500.0, 23, 501.0, 24, 1, 0), [])
+
+    def test_empty(self):
+        for use_numpy in [True, False]:
+            tree = rangetree.Rangetree_Q1_RT(use_numpy=use_numpy)
+            self.assertEqual(tree.query_tree(400, 0, 500, 100, 3, 1.5), [])
+            tree.create_tree(())
+            self.assertEqual(tree.query_tree(400, 0, 500, 100, 3, 1.5), [])
+
+    def _check_batch(self, tree):
+        # transition groups shared by several precursors
+        tuples = tuple([ (0, t[2] % 50) + t[2:] for t in self.tuples])
+        tree.create_tree(tuples)
+        exclude = [7, 0, 49, 5, 1, 3]
+        for isotopes, correction in [(0, 0.0), (2, 1.0)]:
+            windows = [w[:4] for w in self.windows]
+            offsets, indices = tree.query_batch(*(list(zip(*windows)) +
+                [isotopes, correction, exclude]))
+            self.assertEqual(len(offsets), len(windows) + 1)
+            for k, w in enumerate(windows):
+                expected = [r for r in _reference(tuples, *(w + (isotopes, correction)))
+                            if tuples[r[0]][1] != exclude[k]]
+                found = [int(i) for i in indices[offsets[k]:offsets[k+1]]]
+                self.assertEqual(sorted([ (i,) for i in found]), expected)
+                # sorted by Q1
+                self.assertEqual([tuples[i][4] for i in found],
+                                 sorted([tuples[i][4] for i in found]))
+        offsets, indices = tree.query_batch(400.0, 0.0, 500.0, 20.0)
+        self.assertEqual(len(offsets), 2)
+        self.assertEqual(len(indices), len(_reference(tuples, 400.0, 0.0, 500.0, 20.0, 0, 0.0)))
+
+    def test_query_batch(self):
+        self._check_batch(rangetree.Rangetree_Q1_RT.create())
+        self._check_batch(rangetree.Rangetree_Q1_RT(blocksize=7, scan_limit=0))
+        self._check_batch(rangetree.Rangetree_Q1_RT(use_numpy=False))
+        import srmcollider.rangetree
+        batch_candidates = srmcollider.rangetree.BATCH_CANDIDATES
+        srmcollider.rangetree.BATCH_CANDIDATES = 100
+        try:
+            self._check_batch(rangetree.Rangetree_Q1_RT.create())
+        finally:
+            srmcollider.rangetree.BATCH_CANDIDATES = batch_candidates
+
+    def test_precursor_table(self):
+        table = PrecursorTable()
+        for t in self.tuples:
+            table.append_row(('PEPTIDE', t[2], t[2], t[3], t[4], t[5], 0, 0, 0))
+        access = Precursors()
+        access.precursors = table
+        tree = access.build_rangetree()
+        for w in self.windows:
+            self.assertEqual(sorted(tree.query_tree(*w)), _reference(self.tuples, *w))
+        extended = access.build_extended_rangetree()
+        for w in self.windows:
+            self.assertEqual(sorted(extended.query_tree(*w)), _reference(self.tuples, *w))
+
 if __name__ == '__main__':
     unittest.main()
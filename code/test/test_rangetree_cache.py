@@ -0,0 +1,142 @@
+"""
+This file tests the file cache of precursors and rangetrees of the
+rangetree_cache.py module.
+"""
+from nose.plugins.attrib import attr
+
+import os, random, shutil, sys, tempfile, unittest
+sys.path.extend(['.', '..', '../external/', 'external/'])
+from srmcollider import rangetree, rangetree_cache
+from srmcollider.precursor import Precursors, PrecursorTable
+
+import test_shared
+
+def _as_tuples(precursors):
+    return [ (p.modified_sequence, p.transition_group, p.parent_id, p.q1_charge, p.q1,
+              p.ssrcalc, p.modifications, p.missed_cleavages, p.isotopically_modified)
+            for p in precursors]
+
+class Test_rangetree_cache_file(unittest.TestCase):
+
+    def setUp(self):
+        if rangetree_cache.numpy is None:
+            raise unittest.SkipTest("numpy is not available")
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'test.bin')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_arrays(self):
+        numpy = rangetree_cache.numpy
+        arrays = {'a' : numpy.arange(5, dtype=numpy.int32),
+                  'b' : numpy.array([1.5, 2.5]),
+                  'empty' : numpy.zeros(0, dtype=numpy.int64),
+                  'sequence' : numpy.frombuffer('PEPTIDE', dtype='S1')}
+        rangetree_cache.write_arrays(self.filename, 'abc', arrays)
+        result = rangetree_cache.read_arrays(self.filename, 'abc')
+        self.assertEqual(sorted(result.keys()), sorted(arrays.keys()))
+        for name, a in arrays.iteritems():
+            self.assertEqual(result[name].dtype, a.dtype)
+            self.assertEqual(list(result[name]), list(a))
+        self.assertEqual(result['sequence'].tostring(), 'PEPTIDE')
+        # changes are not written back to the file
+        result['a'][0] = 42
+        self.assertEqual(list(rangetree_cache.read_arrays(self.filename)['a']), range(5))
+
+        self.assertRaises(rangetree_cache.RangetreeCacheError,
+                          rangetree_cache.read_arrays, self.filename, 'abd')
+        open(self.filename, 'wb').write('SRMPIDX\0' + '\0' * 100)
+        self.assertRaises(rangetree_cache.RangetreeCacheError,
+                          rangetree_cache.read_arrays, self.filename)
+
+    def test_rangetree(self):
+        random.seed(5)
+        tuples = tuple([ (0, i % 10, i, random.choice([2, 3]), random.uniform(400, 420),
+            random.uniform(0, 30)) for i in range(2000)])
+        for tree_class in [rangetree.Rangetree_Q1_RT, rangetree.ExtendedRangetree_Q1_RT]:
+            tree = tree_class(blocksize=16, scan_limit=0)
+            tree.create_tree(tuples)
+            tree.save(self.filename, 'abc')
+            loaded = tree_class.load(self.filename, 'abc')
+            self.assertTrue(isinstance(loaded, tree_class))
+            self.assertEqual((loaded.blocksize, loaded.scan_limit), (16, 0))
+            self.assertEqual(len(loaded), len(tuples))
+            for args in [(401.0, 5.0, 405.0, 15.0, 3, 1.5), (400.0, 0.0, 420.0, 30.0, 0, 0.0)]:
+                self.assertEqual(loaded.query_tree(*args), tree.query_tree(*args))
+            windows = ([402.0, 410.0], [0.0, 10.0], [404.0, 415.0], [30.0, 12.0], 2, 1.0, [3, 4])
+            for a, b in zip(loaded.query_batch(*windows), tree.query_batch(*windows)):
+                self.assertEqual(list(a), list(b))
+            self.assertRaises(rangetree_cache.RangetreeCacheError,
+                              tree_class.load, self.filename, 'abd')
+
+    def test_precursor_table(self):
+        table = PrecursorTable()
+        table.append_row(('PEPTIDER', 1, 10, 2, 500.5, 20.0, 0, 0, 0))
+        table.append_row((u'C[160]EPTIDEK', 2, 11, 3, 400.25, 30.0, 1, 0, 1))
+        loaded = PrecursorTable.from_arrays(table.get_arrays())
+        self.assertEqual(_as_tuples(loaded), _as_tuples(table))
+        self.assertEqual(type(loaded[0].parent_id), int)
+        self.assertEqual(list(loaded.get_column('q1')), [500.5, 400.25])
+        empty = PrecursorTable.from_arrays(PrecursorTable().get_arrays())
+        self.assertEqual(len(empty), 0)
+
+@attr('sqlite')
+class Test_rangetree_cache_sqlite(unittest.TestCase):
+
+    def setUp(self):
+        if rangetree_cache.numpy is None:
+            raise unittest.SkipTest("numpy is not available")
+        import sqlite3
+        self.db = sqlite3.connect(test_shared.SQLITE_DATABASE_LOCATION)
+        self.cursor = self.db.cursor()
+        self.directory = tempfile.mkdtemp()
+        self.par = test_shared.get_default_setup_parameters()
+        self.par.eval()
+        self.par.rangetree_cache = self.directory
+
+    def tearDown(self):
+        self.db.close()
+        shutil.rmtree(self.directory)
+
+    def _get(self, par, low=500, high=525, **kwargs):
+        access = Precursors()
+        rtree = access.getFromDB_with_rangetree(par, self.cursor, low, high, **kwargs)
+        return access, rtree
+
+    def test_cache(self):
+        par = self.par.get_copy()
+        par.rangetree_cache = ''
+        reference, reference_tree = self._get(par)
+        self.assertEqual(os.listdir(self.directory), [])
+        built, built_tree = self._get(self.par)
+        self.assertEqual(len(os.listdir(self.directory)), 1)
+        loaded, loaded_tree = self._get(self.par)
+        self.assertEqual(len(os.listdir(self.directory)), 1)
+
+        self.assertTrue(len(reference.precursors) > 0)
+        for access in [built, loaded]:
+            self.assertEqual(_as_tuples(access.precursors), _as_tuples(reference.precursors))
+        p = reference.precursors[3]
+        self.assertEqual(_as_tuples([loaded.lookup_by_parent_id(p.parent_id)]), _as_tuples([p]))
+        self.assertEqual(_as_tuples([loaded.lookup_by_transition_group(p.transition_group)]),
+                         _as_tuples([reference.lookup_by_transition_group(p.transition_group)]))
+
+        query = reference.getPrecursorsToEvaluate(500, 525)
+        expected = reference.query_rangetree_batch(query, self.par, reference_tree)
+        result = loaded.query_rangetree_batch(query, self.par, loaded_tree)
+        for k in range(len(query)):
+            self.assertEqual(_as_tuples(loaded.get_neighbours(result, k)),
+                             _as_tuples(reference.get_neighbours(expected, k)))
+
+        # a different background (or window) uses a different file
+        self.par.query2_add = 'and q1_charge = 2'
+        restricted, restricted_tree = self._get(self.par)
+        self.assertEqual(len(os.listdir(self.directory)), 2)
+        self.assertTrue(len(restricted.precursors) < len(reference.precursors))
+        self._get(self.par, 500, 530)
+        self._get(self.par, GRAVY=True)
+        self.assertEqual(len(os.listdir(self.directory)), 4)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+"""
+This file tests the functionality of the result_cache.py module.
+"""
+import os, sys, time, shutil, tempfile, unittest
+sys.path.extend(['.', '..', '../external/', 'external/'])
+from srmcollider import result_cache
+from srmcollider.result_cache import ResultCache
+from srmcollider.precursor import Precursor
+
+import test_shared
+
+class Test_result_cache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.par = test_shared.get_default_setup_parameters()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_keys(self):
+        transitions = [(500.25, 0), (600.5, 1)]
+        key = result_cache.get_peptide_key('PEPTIDER', 500.5, 25.0, transitions, self.par)
+        self.assertEqual(key, result_cache.get_peptide_key(u'PEPTIDER', 500.5, 25.0,
+            tuple(transitions), self.par))
+        self.assertNotEqual(key, result_cache.get_peptide_key('PEPTIDEK', 500.5, 25.0,
+            transitions, self.par))
+        self.par.q3_window = 2.0
+        self.assertNotEqual(key, result_cache.get_peptide_key('PEPTIDER', 500.5, 25.0,
+            transitions, self.par))
+        self.par.q3_window = 1.0
+        self.par.aions = True
+        self.assertNotEqual(key, result_cache.get_peptide_key('PEPTIDER', 500.5, 25.0,
+            transitions, self.par))
+
+    def test_put_get(self):
+        cache = ResultCache(self.directory)
+        key = result_cache.get_ssrcalc_key('PEPTIDER', '')
+        self.assertEqual(cache.get(key), None)
+        p = Precursor(modified_sequence='PEPTIDER', q1=500.5, parent_id=1)
+        cache.put(key, ([p], {1 : [0, 1]}))
+        precursors, collisions = ResultCache(self.directory).get(key)
+        self.assertEqual(precursors[0].modified_sequence, 'PEPTIDER')
+        self.assertEqual(collisions, {1 : [0, 1]})
+        self.assertEqual(cache.stats(), {'hits' : 0, 'misses' : 1})
+
+    def test_ttl(self):
+        cache = ResultCache(self.directory, ttl=60)
+        cache.put('key', 5)
+        self.assertEqual(cache.get('key'), 5)
+        filename = cache._filename('key')
+        os.utime(filename, (time.time() - 120, time.time() - 120))
+        self.assertEqual(cache.get('key'), None)
+        self.assertFalse(os.path.exists(filename))
+
+    def test_eviction(self):
+        cache = ResultCache(self.directory, maxsize=2500)
+        for i in range(5):
+            cache.put(i, 'x' * 1000)
+            os.utime(cache._filename(i), (time.time() - 100 + i, time.time()))
+        # entry 0 is the most recently used now
+        self.assertEqual(cache.get(0), 'x' * 1000)
+        cache.cleanup()
+        self.assertEqual([i for i in range(5) if cache.get(i) is not None], [0, 4])
+
+    def test_unusable_directory(self):
+        # the directory cannot be created (its parent is a file)
+        filename = os.path.join(self.directory, 'file')
+        open(filename, 'w').close()
+        cache = ResultCache(os.path.join(filename, 'cache'))
+        self.assertFalse(cache.enabled)
+        cache.put('key', 'value')
+        self.assertEqual(cache.get('key'), None)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+"""
+This file tests the functionality of the service.py module.
+"""
+from nose.plugins.attrib import attr
+
+import sys, threading, unittest
+sys.path.extend(['.', '..', '../external/', 'external/'])
+from srmcollider import service, collider, precursor_index
+from srmcollider.precursor import Precursors
+
+import test_shared
+
+def _as_tuples(precursors):
+    return sorted([ (p.modified_sequence, p.transition_group, p.parent_id, p.q1_charge, p.q1,
+                     p.ssrcalc, p.modifications, p.missed_cleavages, p.isotopically_modified)
+                   for p in precursors])
+
+class Test_service(unittest.TestCase):
+
+    def test_thread_local_output(self):
+        default = service.StringIO()
+        output = service.ThreadLocalOutput(default)
+        results = {}
+        def work(i):
+            output.start()
+            for j in range(100):
+                output.write("%s" % i)
+            results[i] = output.stop()
+        threads = [threading.Thread(target=work, args=(i,)) for i in range(5)]
+        for t in threads: t.start()
+        for t in threads: t.join()
+        output.write('x')
+        self.assertEqual(results, dict([(i, str(i) * 100) for i in range(5)]))
+        self.assertEqual(default.getvalue(), 'x')
+
+    def test_connection_pool(self):
+        created = []
+        class Connection(object):
+            def __init__(self): created.append(self)
+            def close(self): pass
+        pool = service.ConnectionPool(Connection, 2)
+        c1 = pool.get()
+        c2 = pool.get()
+        pool.put(c1)
+        self.assertTrue(pool.get() is c1)
+        pool.discard(c1)
+        c3 = pool.get()
+        self.assertEqual(len(created), 3)
+        self.assertFalse(c3 is c1 or c3 is c2)
+
+    def test_background_loading(self):
+        # loading one background does not block the requests for another
+        loading = threading.Event()
+        release = threading.Event()
+        class Cursor(object):
+            def execute(self, query):
+                self.slow = 'slow_table' in query
+            def fetchall(self):
+                if self.slow:
+                    loading.set()
+                    release.wait(10)
+                return []
+        backgrounds = service.BackgroundIndices()
+        fast = backgrounds.load(Cursor(), 'fast_table', '')
+        result = {}
+        def load_slow(k):
+            result[k] = backgrounds.load(Cursor(), 'slow_table', '')
+        threads = [threading.Thread(target=load_slow, args=(k,)) for k in range(2)]
+        for t in threads: t.start()
+        self.assertTrue(loading.wait(10))
+        self.assertTrue(backgrounds.load(Cursor(), 'fast_table', '') is fast)
+        self.assertEqual(len(backgrounds), 1)
+        release.set()
+        for t in threads: t.join()
+        # the slow background was only loaded once
+        self.assertTrue(result[0] is result[1])
+        self.assertEqual(len(backgrounds), 2)
+
+    def test_metrics(self):
+        metrics = service.RequestMetrics(window=3)
+        for latency in [5.0, 1.0, 2.0, 3.0]:
+            metrics.record('analysis', latency)
+        metrics.record('form', 0.5, error=True)
+        stats = metrics.stats()
+        self.assertEqual(stats['analysis']['count'], 4)
+        self.assertEqual(stats['analysis']['max'], 3.0)
+        self.assertEqual(stats['analysis']['p50'], 2.0)
+        self.assertEqual(stats['analysis']['mean'], 2.0)
+        self.assertEqual(stats['form']['errors'], 1)
+        self.assertTrue('requests{type="analysis"} 4' in metrics.format())
+
+@attr('sqlite')
+class Test_background_indices(unittest.TestCase):
+
+    def setUp(self):
+        if precursor_index.numpy is None:
+            raise unittest.SkipTest("numpy is not available")
+        import sqlite3
+        self.db = sqlite3.connect(test_shared.SQLITE_DATABASE_LOCATION)
+        self.cursor = self.db.cursor()
+        self.par = test_shared.get_default_setup_parameters()
+        self.par.max_mods = 5
+        self.par.max_MC = 1
+        self.par.eval()
+        # restrictions as used by the web interface
+        self.par.query2_add = ' and modifications = 0  and missed_cleavages <= 1 '
+
+    def tearDown(self):
+        self.db.close()
+
+    def test_get_all_precursors(self):
+        mycollider = collider.SRMcollider()
+        allprecursors = Precursors()
+        allprecursors.getFromDB(self.par, self.cursor, 400, 1500)
+        query = allprecursors.getPrecursorsToEvaluate(400, 1500)[::10]
+        self.assertTrue(len(query) > 0)
+        backgrounds = service.BackgroundIndices()
+        total = 0
+        for p in query:
+            from_db = mycollider._get_all_precursors(self.par, p, self.cursor)
+            from_memory = backgrounds.get_all_precursors(self.par, p, self.cursor)
+            self.assertEqual(_as_tuples(from_db), _as_tuples(from_memory))
+            total += len(from_db)
+        self.assertTrue(total > 0)
+        # the background was only loaded once
+        self.assertEqual(len(backgrounds), 1)
+
+if __name__ == '__main__':
+    unittest.main()